@@ -0,0 +1,228 @@
+# agencies.py
+# Registry of the transit agencies this deployment serves. Each agency has its own feed URLs,
+# stops file, model artifacts and poll interval, and gets its own poller, stops index and
+# stream broadcaster. All pollers run concurrently on the event loop; requests to the same
+# upstream host are capped so dozens of agencies on one vendor don't stampede it.
+#
+# Without AGENCY_REGISTRY the registry holds a single agency built from the existing
+# environment settings (GTFS_RT_BASE_URL, PREDICTION_POLL_INTERVAL, ...). Otherwise it is
+# loaded from a JSON file; see agencies.example.json.
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import decision_tree_predict
+from broadcast import PredictionBroadcaster
+from feed_archive import ReplaySource
+from model_registry import ModelBundle, ModelRegistry, ROOT_VERSION, bundle_path, current_version, load_bundle
+from poller import PredictionPoller, POLL_INTERVAL, POLL_JITTER, MAX_BACKOFF
+from shared_snapshot import SharedSnapshot, SHARED_SNAPSHOT_DIR
+from stops_index import load_stops_index, stops_index
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# JSON file describing the agencies to serve (unset: just the default agency)
+AGENCY_REGISTRY = os.environ.get("AGENCY_REGISTRY")
+
+# Concurrent requests allowed per upstream host, across all agencies
+MAX_REQUESTS_PER_HOST = int(os.environ.get("MAX_REQUESTS_PER_HOST", "4"))
+
+DEFAULT_AGENCY_ID = "drt"
+
+@dataclass
+class AgencyConfig:
+    agency_id: str
+    vehicle_positions_url: str
+    trip_updates_url: str
+    name: str = ""
+    stops_path: Path = BASE_DIR / "data/stops.txt"
+    model_dir: Path = BASE_DIR / "model_weights"
+    poll_interval: float = POLL_INTERVAL
+    jitter: float = POLL_JITTER
+    max_backoff: float = MAX_BACKOFF
+    replay_dir: str | None = None
+    replay_speed: float = 1.0
+
+    @classmethod
+    def from_dict(cls, data, base_dir):
+        """Build a config from one registry entry; relative paths are resolved against base_dir."""
+        unknown = set(data) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown settings for agency '{data.get('agency_id')}': {sorted(unknown)}")
+        config = cls(**data)
+        config.name = config.name or config.agency_id
+        config.stops_path = base_dir / config.stops_path
+        config.model_dir = base_dir / config.model_dir
+        if config.replay_dir:
+            config.replay_dir = str(base_dir / config.replay_dir)
+        return config
+
+def default_config():
+    """The single agency described by the environment (Durham Region Transit by default)."""
+    return AgencyConfig(
+        agency_id=DEFAULT_AGENCY_ID,
+        name="Durham Region Transit",
+        vehicle_positions_url=decision_tree_predict.VEHICLE_POSITIONS_URL,
+        trip_updates_url=decision_tree_predict.TRIP_UPDATES_URL,
+        replay_dir=decision_tree_predict.FEED_REPLAY_DIR,
+        replay_speed=decision_tree_predict.FEED_REPLAY_SPEED,
+    )
+
+# Artifacts shared between agencies that point at the same files; the default ones are
+# already loaded by stops_index and decision_tree_predict
+_stops_cache = {(BASE_DIR / "data/stops.txt").resolve(): stops_index}
+_model_cache = {(BASE_DIR / "model_weights").resolve(): ModelBundle(
+    version=ROOT_VERSION, path=BASE_DIR / "model_weights", model=decision_tree_predict.fast_model, loaded_at=time.time())}
+
+def load_stops(path):
+    key = Path(path).resolve()
+    if key not in _stops_cache:
+        _stops_cache[key] = load_stops_index(key)
+    return _stops_cache[key]
+
+def load_model(model_dir):
+    """The ModelBundle a model directory's CURRENT file names (its top-level model files if none)."""
+    version = current_version(model_dir)
+    key = bundle_path(model_dir, version).resolve()
+    if key not in _model_cache:
+        _model_cache[key] = load_bundle(model_dir, version)
+    return _model_cache[key]
+
+class HostLimiter:
+    """One semaphore per upstream host, so agencies sharing a vendor share its request budget."""
+
+    def __init__(self, limit=MAX_REQUESTS_PER_HOST):
+        self.limit = limit
+        self._semaphores = {}
+
+    def __call__(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limit)
+        return self._semaphores[host]
+
+class Agency:
+    """Runtime state of one agency: its stops, models, poller and stream broadcaster."""
+
+    def __init__(self, config, limiter):
+        self.config = config
+        self.agency_id = config.agency_id
+        self.stops = load_stops(config.stops_path)
+        self.limiter = limiter
+        self.replay = ReplaySource(config.replay_dir, speed=config.replay_speed) if config.replay_dir else None
+        # With SHARED_SNAPSHOT_DIR, one process per host polls this agency and the rest follow it
+        shared = SharedSnapshot(Path(SHARED_SNAPSHOT_DIR) / config.agency_id) if SHARED_SNAPSHOT_DIR else None
+        self.poller = PredictionPoller(
+            interval=config.poll_interval, model=load_model(config.model_dir).model, stops=self.stops, fetch=self.fetch_payloads,
+            name=config.agency_id, jitter=config.jitter, max_backoff=config.max_backoff, shared=shared,
+        )
+        self.broadcaster = PredictionBroadcaster()
+        self.poller.add_listener(self.broadcaster.publish_snapshot)
+        self.models = ModelRegistry(config.model_dir, self.poller, load_model(config.model_dir), name=config.agency_id)
+
+    async def _fetch(self, url):
+        async with self.limiter(url):
+            return await decision_tree_predict.fetch_feed(url, self.agency_id)
+
+    async def fetch_payloads(self):
+        """This agency's raw (vehicle_positions_pb, trip_updates_pb), fetched concurrently."""
+        if self.replay is not None:
+            return await self.replay.fetch_payloads()
+        return await asyncio.gather(
+            self._fetch(self.config.vehicle_positions_url),
+            self._fetch(self.config.trip_updates_url),
+        )
+
+    def describe(self):
+        return {
+            "agency_id": self.agency_id,
+            "name": self.config.name,
+            "poll_interval": self.config.poll_interval,
+            "stops": len(self.stops),
+            "model_version": self.models.active.version,
+            "feed_timestamp": self.poller.snapshot.feed_timestamp if self.poller.snapshot else None,
+            "shared_snapshot": self.poller.shared.describe() if self.poller.shared is not None else None,
+        }
+
+class AgencyRegistry:
+    """All agencies served by this process, and the scheduler that polls them."""
+
+    def __init__(self, configs, default=None, limiter=None):
+        if not configs:
+            raise ValueError("The agency registry needs at least one agency.")
+        self.limiter = limiter or HostLimiter()
+        self.agencies = {}
+        for config in configs:
+            if config.agency_id in self.agencies:
+                raise ValueError(f"Duplicate agency id '{config.agency_id}'.")
+            self.agencies[config.agency_id] = Agency(config, self.limiter)
+        # The per-host semaphores are the limit that matters; the shared HTTP client's connection
+        # pool must not cap every agency's requests together below them
+        hosts = {urlsplit(url).netloc for config in configs if not config.replay_dir
+                 for url in (config.vehicle_positions_url, config.trip_updates_url)}
+        decision_tree_predict.set_max_connections(max(decision_tree_predict.DEFAULT_MAX_CONNECTIONS,
+                                                      len(hosts) * self.limiter.limit))
+        self.default_id = default or configs[0].agency_id
+        if self.default_id not in self.agencies:
+            raise ValueError(f"Default agency '{self.default_id}' is not in the registry.")
+
+    @classmethod
+    def from_file(cls, path):
+        path = Path(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        configs = [AgencyConfig.from_dict(entry, path.parent) for entry in data['agencies']]
+        limiter = HostLimiter(data.get('max_requests_per_host', MAX_REQUESTS_PER_HOST))
+        return cls(configs, default=data.get('default'), limiter=limiter)
+
+    @classmethod
+    def from_env(cls):
+        if AGENCY_REGISTRY:
+            registry = cls.from_file(AGENCY_REGISTRY)
+            logger.info(f"Loaded {len(registry)} agencies from {AGENCY_REGISTRY}.")
+            return registry
+        return cls([default_config()])
+
+    def __len__(self):
+        return len(self.agencies)
+
+    def __iter__(self):
+        return iter(self.agencies.values())
+
+    def get(self, agency_id=None):
+        """The agency with this id (the default agency for None), or None if unknown."""
+        return self.agencies.get(agency_id or self.default_id)
+
+    @property
+    def default(self):
+        return self.agencies[self.default_id]
+
+    def add_listener(self, callback):
+        """Call callback(agency, snapshot) whenever any agency publishes new data."""
+        for agency in self:
+            agency.poller.add_listener(lambda snapshot, agency=agency: callback(agency, snapshot))
+
+    def start(self):
+        """
+        Start every agency's poller, staggered across its first interval so they don't fire together,
+        and its model directory watcher.
+        """
+        for agency in self:
+            agency.poller.start(initial_delay=random.uniform(0, agency.config.poll_interval) if len(self) > 1 else 0)
+            agency.models.start()
+
+    async def stop(self):
+        await asyncio.gather(*(agency.models.stop() for agency in self))
+        await asyncio.gather(*(agency.poller.stop() for agency in self))
+
+# Agencies served by the API
+registry = AgencyRegistry.from_env()
@@ -0,0 +1,103 @@
+# artifact_cache.py
+# Prebuilt binary copies of the artifacts the server loads at startup (the stops index and the
+# compiled decision tree), so a cold start maps a few .npy files instead of parsing stops.txt
+# with pandas or unpickling the model through sklearn.
+#
+# Each artifact is a directory of uncompressed .npy arrays, opened with mmap_mode='r', plus a
+# meta.json recording the size and mtime of the source files it was built from. When a source
+# changes (or the cache format does) the artifact is rebuilt from the sources on next load.
+#
+# Usage: python artifact_cache.py   (prebuild the default artifacts, e.g. in a Docker build)
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Where artifacts are stored; must be writable for the cache to be (re)built
+ARTIFACT_CACHE_DIR = Path(os.environ.get("ARTIFACT_CACHE_DIR", BASE_DIR / ".artifact_cache"))
+
+# Bump when the layout of any cached artifact, or the way one is built, changes
+CACHE_FORMAT = 2
+
+def fingerprint(sources):
+    """Size and modification time of every source file (None for files that don't exist)."""
+    stamps = []
+    for path in sources:
+        try:
+            stat = path.stat()
+            stamps.append([str(path), stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            stamps.append([str(path), None, None])
+    return stamps
+
+def artifact_dir(kind, sources):
+    key = hashlib.blake2b(str(sources[0]).encode(), digest_size=8).hexdigest()
+    return ARTIFACT_CACHE_DIR / f"{kind}-{key}"
+
+def write_artifact(directory, arrays, meta):
+    """Write every array and meta.json to a staging directory, then swap it into place."""
+    staging = directory.with_name(f".{directory.name}.{os.getpid()}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(staging / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+    with open(staging / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    # Readers that already mapped the old files keep them; unlinking doesn't invalidate a mapping
+    old = directory.with_name(f".{directory.name}.{os.getpid()}.old")
+    if directory.exists():
+        os.replace(directory, old)
+    os.replace(staging, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+def load_or_build(kind, sources, build):
+    """
+    Load an artifact from the cache, or build and cache it if its sources have changed.
+
+    Parameters:
+    - kind (str): Artifact type, e.g. 'stops' or 'model'
+    - sources (list): Files the artifact is built from; the first one names the artifact
+    - build (callable): Returns (arrays, info) from the sources: a dict of NumPy arrays (no object
+      dtypes) and a JSON-friendly dict of anything else the artifact needs
+
+    Returns:
+    - tuple: (arrays, info), with the arrays memory-mapped read-only when they come from the cache
+    """
+    sources = [Path(path).resolve() for path in sources]
+    directory = artifact_dir(kind, sources)
+    stamp = {'format': CACHE_FORMAT, 'sources': fingerprint(sources)}
+    try:
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta['stamp'] == stamp:
+            arrays = {name: np.load(directory / f"{name}.npy", mmap_mode='r') for name in meta['arrays']}
+            return arrays, meta['info']
+    except (OSError, ValueError, KeyError):
+        pass  # Missing or unreadable: rebuild
+
+    arrays, info = build()
+    try:
+        write_artifact(directory, arrays, {'stamp': stamp, 'arrays': list(arrays), 'info': info})
+        logger.info(f"Rebuilt the cached {kind} artifact for {sources[0]}.")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not cache the {kind} artifact for {sources[0]}: {e}")
+    return arrays, info
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Loading the defaults builds any artifact that is missing or stale
+    import decision_tree_predict  # noqa: F401
+    print(f"Artifacts are up to date in {ARTIFACT_CACHE_DIR}")
+
+if __name__ == "__main__":
+    main()
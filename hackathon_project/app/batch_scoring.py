@@ -0,0 +1,329 @@
+# batch_scoring.py
+# Scores large batches of feature rows (historical datasets, simulated scenarios) with a model
+# bundle, without the live feed. Rows stream through in fixed-size chunks: each chunk's model
+# inputs become one float64 matrix for the compiled tree and the chunk is written out with a
+# predicted_status column, so memory stays bounded by the chunk size, not the input size.
+#
+# Input and output formats:
+#   parquet  Parquet file, read batch by batch with only the needed columns
+#   arrow    Arrow IPC file or stream, memory-mapped
+#   ndjson   one JSON object per line
+#
+# Parquet and Arrow need pyarrow. Predictions are written in the input's format unless another
+# one is asked for. The same code serves POST /batch/predict in main.py.
+#
+# Usage: python batch_scoring.py snapshots.parquet predictions.parquet
+#        python batch_scoring.py scenario.ndjson out.ndjson --version 20250601T120000Z --keep bus_id route_id
+#        python batch_scoring.py history.arrow out.parquet --chunk-rows 500000
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import CancelledError
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+from features import FEATURE_COLUMNS
+from model_registry import ROOT_VERSION, current_version, load_bundle
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Rows scored per chunk (override with the BATCH_CHUNK_ROWS env var)
+BATCH_CHUNK_ROWS = int(os.environ.get("BATCH_CHUNK_ROWS", "100000"))
+
+PREDICTION_COLUMN = 'predicted_status'
+
+FORMATS = ('parquet', 'arrow', 'ndjson')
+
+MEDIA_TYPES = {
+    'parquet': "application/vnd.apache.parquet",
+    'arrow': "application/vnd.apache.arrow.file",
+    'ndjson': "application/x-ndjson",
+}
+
+EXTENSIONS = {
+    '.parquet': 'parquet', '.pq': 'parquet',
+    '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow', '.arrows': 'arrow',
+    '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson',
+}
+
+# Identifier columns read from NDJSON as strings, as they are stored in the dataset
+STRING_COLUMNS = {'bus_id': str, 'trip_id': str, 'route_id': str, 'next_stop_id': str}
+
+# pandas' NDJSON writer keeps 15 decimal places; orjson, when installed, writes every float exactly
+NDJSON_DOUBLE_PRECISION = 15
+
+def detect_format(path=None, media_type=None):
+    """Batch format from a media type (e.g. a Content-Type header) or a file extension."""
+    if media_type:
+        media_type = media_type.split(';')[0].strip().lower()
+        for fmt, known in MEDIA_TYPES.items():
+            if media_type == known:
+                return fmt
+        if media_type in ("application/x-parquet", "application/parquet"):
+            return 'parquet'
+        if media_type in ("application/vnd.apache.arrow.stream", "application/x-arrow"):
+            return 'arrow'
+        if media_type in ("application/jsonl", "application/x-jsonlines", "application/json-seq"):
+            return 'ndjson'
+    if path is not None and Path(path).suffix.lower() in EXTENSIONS:
+        return EXTENSIONS[Path(path).suffix.lower()]
+    raise ValueError(f"Can't tell the batch format of {path or media_type}; use one of {FORMATS}.")
+
+def check_columns(available, wanted):
+    missing = [name for name in wanted or () if name not in available]
+    if missing:
+        raise ValueError(f"Batch is missing columns: {missing}")
+
+def read_chunks(path, fmt, columns=None, chunk_rows=BATCH_CHUNK_ROWS):
+    """
+    Yield the rows of a batch file in chunks of at most chunk_rows rows: pyarrow RecordBatches
+    for Parquet and Arrow, DataFrames for NDJSON. `columns` limits what is read (None: all).
+    """
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        with pq.ParquetFile(path) as parquet:
+            check_columns(parquet.schema_arrow.names, columns)
+            yield from parquet.iter_batches(batch_size=chunk_rows, columns=columns)
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        with pa.memory_map(str(path)) as source:
+            try:
+                reader = pa.ipc.open_file(source)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                source.seek(0)
+                batches = pa.ipc.open_stream(source)
+            for batch in batches:
+                check_columns(batch.schema.names, columns)
+                if columns is not None:
+                    batch = pa.RecordBatch.from_arrays([batch.column(name) for name in columns], names=columns)
+                # Slices are views of the mapped file
+                for offset in range(0, batch.num_rows, chunk_rows):
+                    yield batch.slice(offset, chunk_rows)
+    elif fmt == 'ndjson':
+        # The *_time columns are Unix seconds; without convert_dates=False pandas parses them as dates.
+        # precise_float reads numbers to the last bit, so they score as they would from Parquet.
+        with pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=STRING_COLUMNS, convert_dates=False,
+                          keep_default_dates=False, precise_float=True) as reader:
+            for chunk in reader:
+                check_columns(chunk.columns, columns)
+                yield chunk[columns] if columns is not None else chunk
+    else:
+        raise ValueError(f"Unknown batch format '{fmt}'; use one of {FORMATS}.")
+
+def column_names(chunk):
+    return chunk.schema.names if hasattr(chunk, 'schema') else list(chunk.columns)
+
+def numeric_values(column):
+    """
+    A column as float64. Stop ids arrive as strings; the rare merged ids become NaN instead of
+    failing. Ids repeat a lot, so each distinct string is only parsed once.
+    """
+    if hasattr(column, 'dictionary_encode'):
+        import pyarrow as pa
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            return column.to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+        encoded = column.dictionary_encode()
+        uniques = encoded.dictionary.to_numpy(zero_copy_only=False)
+        codes = encoded.indices.fill_null(-1).to_numpy()
+    else:
+        values = column.to_numpy()
+        if values.dtype.kind in 'biuf':
+            return values.astype(np.float64, copy=False)
+        codes, uniques = pd.factorize(values)
+    # Code -1 (null) picks the NaN at the end
+    lookup = np.append(pd.to_numeric(uniques, errors='coerce').astype(np.float64), np.nan)
+    return lookup[codes]
+
+def input_matrix(chunk, features):
+    """One chunk's model inputs as a float64 matrix (see features.feature_matrix)."""
+    X = np.empty((len(chunk), len(features)), dtype=np.float64)
+    for j, name in enumerate(features):
+        X[:, j] = numeric_values(chunk.column(name) if hasattr(chunk, 'schema') else chunk[name])
+    return X
+
+def json_default(value):
+    """orjson fallback for values it doesn't know: missing values become null."""
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return str(value)
+
+def ndjson_lines(df):
+    """
+    A DataFrame's rows as NDJSON bytes, one line per row. Numbers come out as they are, so the
+    file reads back to the same values. Datetime columns (from Parquet or Arrow input) become
+    Unix seconds, like the dataset's own time columns.
+    """
+    for name in df.columns:
+        if df[name].dtype.kind == 'M':
+            times = df[name] if df[name].dt.tz is None else df[name].dt.tz_convert(None)
+            df[name] = (times - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+    if ORJSON_AVAILABLE:
+        # Rows zipped from whole-column lists; to_dict('records') is about 3x slower.
+        names = list(df.columns)
+        columns = [df[name].tolist() for name in names]
+        return b"".join(orjson.dumps(dict(zip(names, values)), default=json_default,
+                                     option=orjson.OPT_APPEND_NEWLINE)
+                        for values in zip(*columns))
+    return df.to_json(orient='records', lines=True, double_precision=NDJSON_DOUBLE_PRECISION).encode('utf-8')
+
+class BatchWriter:
+    """Writes scored chunks to one file in a batch format, replacing `path` only once complete."""
+
+    def __init__(self, path, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown batch format '{fmt}'; use one of {FORMATS}.")
+        self.path = Path(path)
+        self.fmt = fmt
+        self.tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self._file = None
+        self._writer = None
+        self.schema = None
+
+    def write(self, chunk, codes, labels):
+        """Write one chunk with its predictions: labels[codes] for each row."""
+        if self.fmt == 'ndjson':
+            if self._file is None:
+                self._file = open(self.tmp, 'wb')
+            df = chunk.to_pandas() if hasattr(chunk, 'schema') else chunk.copy(deep=False)
+            df[PREDICTION_COLUMN] = labels[codes]
+            if len(df):
+                self._file.write(ndjson_lines(df).rstrip(b'\n') + b'\n')
+            return
+
+        import pyarrow as pa
+        if not hasattr(chunk, 'schema'):
+            chunk = pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+        predictions = pa.array(labels, type=pa.string()).take(pa.array(codes))
+        batch = pa.RecordBatch.from_arrays(list(chunk.columns) + [predictions],
+                                           names=chunk.schema.names + [PREDICTION_COLUMN])
+        table = pa.Table.from_batches([batch])
+        if self._writer is None:
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.tmp, table.schema, compression='zstd')
+            else:
+                self._file = pa.OSFile(str(self.tmp), 'wb')
+                self._writer = pa.ipc.new_file(self._file, table.schema)
+            self.schema = table.schema
+        elif table.schema != self.schema:
+            # Types inferred per chunk (NDJSON) can differ, e.g. a column that is all null in one chunk
+            table = table.cast(self.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        """Finish the file and move it into place."""
+        if self._writer is None and self._file is None:
+            # Nothing to write: leave an empty file rather than none
+            open(self.tmp, 'wb').close()
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        try:
+            if self._writer is not None:
+                self._writer.close()
+            if self._file is not None:
+                self._file.close()
+        finally:
+            self.tmp.unlink(missing_ok=True)
+
+def score_file(source, destination, model, fmt=None, output_format=None, keep=None, chunk_rows=BATCH_CHUNK_ROWS,
+               cancel=None):
+    """
+    Score every row of a batch file and write the rows with their predictions.
+
+    Parameters:
+    - source (str | Path): Batch file of dataset rows holding at least the model's input columns
+    - destination (str | Path): File to write; replaced only once every chunk has been scored
+    - model (CompiledTree): The model to score with
+    - fmt (str): Input format (default: from the file extension)
+    - output_format (str): Output format (default: the input's)
+    - keep (list): Input columns to copy to the output (default: all of them)
+    - chunk_rows (int): Rows scored at a time
+    - cancel (threading.Event): Once set, scoring stops before the next chunk with a CancelledError
+
+    Returns:
+    - dict: Rows and chunks scored, seconds taken and rows per second
+    """
+    fmt = fmt or detect_format(source)
+    output_format = output_format or fmt
+    features = model.features or FEATURE_COLUMNS
+    columns = None if keep is None else list(dict.fromkeys(list(keep) + list(features)))
+    started = time.perf_counter()
+    rows = chunks = 0
+    labels = np.asarray(model.classes).astype(str)
+    writer = BatchWriter(destination, output_format)
+    try:
+        for chunk in read_chunks(source, fmt, columns, chunk_rows):
+            if cancel is not None and cancel.is_set():
+                raise CancelledError(f"Scoring {source} was cancelled after {rows} rows.")
+            check_columns(column_names(chunk), features)
+            codes = model.predict_codes(input_matrix(chunk, features))
+            if keep is not None:
+                chunk = select(chunk, keep)
+            writer.write(chunk, codes, labels)
+            rows += len(codes)
+            chunks += 1
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    seconds = time.perf_counter() - started
+    return {'rows': rows, 'chunks': chunks, 'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds > 0 else None}
+
+def select(chunk, names):
+    """Only the given columns of a chunk, in that order."""
+    if hasattr(chunk, 'schema'):
+        import pyarrow as pa
+        return pa.RecordBatch.from_arrays([chunk.column(name) for name in names], names=list(names))
+    return chunk[list(names)]
+
+def load_model(model_dir, version=None):
+    """The model of a bundle version (default: the one CURRENT names, else the top-level pickles)."""
+    return load_bundle(model_dir, version or current_version(model_dir) or ROOT_VERSION)
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Score a batch of feature rows with a model bundle.")
+    parser.add_argument('source', help="Parquet, Arrow IPC or NDJSON file of dataset rows")
+    parser.add_argument('destination', help="File to write the rows and their predictions to")
+    parser.add_argument('--format', choices=FORMATS, help="Input format (default: from the extension)")
+    parser.add_argument('--output-format', choices=FORMATS, help="Output format (default: from the "
+                                                                  "destination's extension, else the input's)")
+    parser.add_argument('--model-dir', default=str(BASE_DIR / 'model_weights'), help="Model directory")
+    parser.add_argument('--version', help="Bundle version to score with (default: the one CURRENT names)")
+    parser.add_argument('--keep', nargs='+', help="Input columns to copy to the output (default: all)")
+    parser.add_argument('--chunk-rows', type=int, default=BATCH_CHUNK_ROWS, help="Rows scored at a time")
+    args = parser.parse_args()
+
+    output_format = args.output_format
+    if output_format is None:
+        try:
+            output_format = detect_format(args.destination)
+        except ValueError:
+            output_format = None
+    bundle = load_model(args.model_dir, args.version)
+    stats = score_file(args.source, args.destination, bundle.model, fmt=args.format, output_format=output_format,
+                       keep=args.keep, chunk_rows=args.chunk_rows)
+    print(f"Scored {stats['rows']} rows in {stats['chunks']} chunks with model {bundle.version} "
+          f"in {stats['seconds']:.2f}s ({stats['rows_per_second']} rows/s) -> {args.destination}")
+
+if __name__ == "__main__":
+    main()
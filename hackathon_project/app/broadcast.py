@@ -0,0 +1,84 @@
+# broadcast.py
+# Fan-out of prediction updates to streaming clients (Server-Sent Events and WebSocket).
+# Each update is serialized once and handed to every client through a bounded queue; a
+# client whose queue fills up is evicted and has to reconnect for a fresh snapshot.
+
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Updates a client may fall behind by before it is evicted (override with STREAM_QUEUE_SIZE)
+STREAM_QUEUE_SIZE = int(os.environ.get("STREAM_QUEUE_SIZE", "16"))
+
+class StreamMessage:
+    """One serialized update, shared by every subscriber."""
+    __slots__ = ('event', 'data', 'sse', 'created_at')
+
+    def __init__(self, event, payload, created_at=0.0):
+        self.event = event
+        # Publish time of the snapshot this message describes
+        self.created_at = created_at
+        self.data = json.dumps({"type": event, **payload}, default=str)
+        self.sse = f"event: {event}\ndata: {self.data}\n\n"
+
+# Placed on a subscriber's queue when it is evicted
+EVICTED = StreamMessage('evicted', {"reason": "client too slow; reconnect for a fresh snapshot"})
+
+def snapshot_message(snapshot):
+    """Full-state message sent to a client when it connects."""
+    return StreamMessage('snapshot', {
+        "feed_timestamp": snapshot.feed_timestamp,
+        "bus_predictions": snapshot.bus_predictions,
+    }, snapshot.created_at)
+
+def delta_message(snapshot):
+    """Buses added, removed or predicted differently by a new snapshot."""
+    return StreamMessage('delta', {
+        "feed_timestamp": snapshot.feed_timestamp,
+        "added": snapshot.delta['added'],
+        "changed": snapshot.delta['changed'],
+        "removed": snapshot.delta['removed'],
+    }, snapshot.created_at)
+
+class PredictionBroadcaster:
+    """Tracks connected stream clients and pushes every snapshot delta to all of them."""
+
+    def __init__(self, queue_size=STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.evictions = 0
+
+    def subscribe(self):
+        """Register a client; returns the queue its messages will arrive on."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _evict(self, queue):
+        self.subscribers.discard(queue)
+        self.evictions += 1
+        logger.warning("Evicted a slow stream client.")
+        # Drop the backlog so the eviction notice is the next thing the client reads
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(EVICTED)
+
+    def publish(self, message):
+        """Queue one message for every subscriber without waiting on any of them."""
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._evict(queue)
+
+    def publish_snapshot(self, snapshot):
+        """Poller listener: broadcast the snapshot's delta if any prediction changed."""
+        delta = snapshot.delta
+        if delta['added'] or delta['changed'] or delta['removed']:
+            self.publish(delta_message(snapshot))
@@ -0,0 +1,176 @@
+# cpu_pool.py
+# Runs the CPU-bound part of every poll cycle (protobuf decoding, the next-stop join, features,
+# the tree and the /get_predictions body) off the event loop, so health checks, raw feed
+# requests and streams keep being answered while a large snapshot is scored.
+#
+# CPU_POOL picks where that work runs:
+# - thread:  a shared thread pool. NumPy and protobuf release the GIL for much of the work,
+#            and nothing has to be copied between the loop and the workers.
+# - process: worker processes. Each poller is pinned to one worker, which keeps its scorer
+#            (previous snapshot, position history) between cycles; the feed bytes go in and
+#            the scored snapshot comes back pickled.
+# - inline:  on the event loop itself, as before.
+#
+# At most CPU_POOL_QUEUE tasks are queued or running at once; beyond that run() raises
+# PoolBusy instead of letting a backlog build up. Cancelling the awaiting coroutine drops a
+# task that hasn't started yet (one already running finishes and its result is discarded).
+#
+# LoopLagMonitor measures how late the event loop wakes up from a short sleep, which is how
+# long any request would have waited behind work still running on the loop.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Where CPU-bound poll work runs: "thread", "process" or "inline"
+CPU_POOL = os.environ.get("CPU_POOL", "thread").lower()
+
+# Worker threads or processes
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", "2"))
+
+# Tasks queued or running at most before new ones are rejected
+CPU_POOL_QUEUE = int(os.environ.get("CPU_POOL_QUEUE", "8"))
+
+# Seconds between event loop lag probes (0 disables the monitor)
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+
+POOL_KINDS = ("thread", "process", "inline")
+
+class PoolBusy(RuntimeError):
+    """The pool's queue is full."""
+
+class CpuPool:
+    """
+    Bounded executor for CPU-bound work. Tasks sharing a `key` always run in the same worker
+    process in process mode, so a worker can keep state for that key between tasks.
+    """
+
+    def __init__(self, kind=CPU_POOL, workers=CPU_POOL_WORKERS, max_pending=CPU_POOL_QUEUE):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"CPU_POOL must be one of {POOL_KINDS}, not '{kind}'.")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executors = {}
+        self._keys = {}
+
+    def _executor(self, key):
+        """The executor a task for `key` is submitted to, created on first use."""
+        if self.kind == "thread":
+            slot = 0
+        else:
+            # One single-process executor per worker, and keys assigned to workers in turn
+            slot = self._keys.setdefault(key, len(self._keys) % self.workers)
+        executor = self._executors.get(slot)
+        if executor is None:
+            if self.kind == "thread":
+                executor = ThreadPoolExecutor(self.workers, thread_name_prefix="cpu-pool")
+            else:
+                # spawn: forking a process that runs an event loop and threads isn't safe
+                executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+            self._executors[slot] = executor
+        return slot, executor
+
+    def _done(self, future):
+        self.pending -= 1
+        self.completed += 1
+        metrics.CPU_POOL_PENDING.set(self.pending)
+
+    async def run(self, func, *args, key=None):
+        """
+        Run func(*args) in the pool and return its result.
+
+        Raises:
+        - PoolBusy: if CPU_POOL_QUEUE tasks are already queued or running
+        """
+        if self.kind == "inline":
+            return func(*args)
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            metrics.CPU_POOL_REJECTED.inc()
+            raise PoolBusy(f"{self.pending} tasks are already queued in the CPU pool.")
+
+        loop = asyncio.get_running_loop()
+        slot, executor = self._executor(key)
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh one, without its old state
+            logger.error(f"CPU pool worker {slot} died; restarting it.")
+            self._executors.pop(slot, None)
+            slot, executor = self._executor(key)
+            future = executor.submit(func, *args)
+        self.pending += 1
+        metrics.CPU_POOL_PENDING.set(self.pending)
+        # Counted down when the task really ends, not when a cancelled caller stops waiting
+        future.add_done_callback(lambda f: loop.is_closed() or loop.call_soon_threadsafe(self._done, f))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def describe(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        """Stop the workers, dropping queued tasks."""
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = {}
+
+class LoopLagMonitor:
+    """Measures event loop lag: how much later than asked a short sleep on the loop wakes up."""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, window=60.0):
+        self.interval = interval
+        # Probes covering the last `window` seconds
+        self.recent = deque([0.0], maxlen=max(1, int(window / interval)) if interval > 0 else 1)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.recent.append(lag)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+
+    def describe(self):
+        """Latest lag and the worst one over the window, in seconds."""
+        return {"last_seconds": round(self.recent[-1], 4), "max_seconds": round(max(self.recent), 4)}
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+cpu_pool = CpuPool()
+loop_lag = LoopLagMonitor()
@@ -0,0 +1,171 @@
+# dataset_store.py
+# Partitioned Parquet storage for the collected bus status dataset. Rows are buffered in memory
+# up to a fixed size, then written as one compressed file per (service date, route) partition:
+#
+#   <root>/service_date=2025-03-14/route=902/part-1710430000-0001.parquet
+#
+# Each flush adds new part files instead of appending to existing ones. Partitions that have
+# collected enough parts, or whose service day is over, are compacted into a single file.
+
+import logging
+import os
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Service days run on local time and roll over in the early morning, after the last trips
+SERVICE_TIMEZONE = "America/Toronto"
+SERVICE_DAY_START_HOUR = 4
+
+PARQUET_COMPRESSION = "zstd"
+
+# Rows that identify one vehicle report; a report seen again on a later poll is not stored twice
+DEDUP_COLUMNS = ['bus_id', 'position_timestamp']
+
+def service_dates(unix_seconds):
+    """Service date (YYYY-MM-DD) each Unix timestamp belongs to."""
+    local = pd.to_datetime(pd.Series(unix_seconds), unit='s', utc=True).dt.tz_convert(SERVICE_TIMEZONE)
+    return (local - pd.Timedelta(hours=SERVICE_DAY_START_HOUR)).dt.strftime('%Y-%m-%d')
+
+def partition_dir(root, service_date, route_id):
+    return Path(root) / f"service_date={service_date}" / f"route={quote(str(route_id), safe='')}"
+
+def read_dataset(root, columns=None, service_date_range=None, routes=None):
+    """
+    Read the partitioned dataset, touching only the requested columns and partitions.
+
+    Parameters:
+    - root (str | Path): Dataset directory written by ParquetDatasetWriter
+    - columns (list): Columns to load (default: all stored columns)
+    - service_date_range (tuple): Inclusive (first, last) service dates as 'YYYY-MM-DD'
+    - routes (list): Route ids to load (default: all routes)
+
+    Returns:
+    - pd.DataFrame: The matching rows (partition keys are not added as columns)
+    """
+    filters = []
+    if service_date_range is not None:
+        first, last = service_date_range
+        filters += [('service_date', '>=', first), ('service_date', '<=', last)]
+    if routes is not None:
+        filters.append(('route', 'in', [quote(str(route), safe='') for route in routes]))
+
+    if columns is None:
+        # Stored columns only; the partition keys are implied by the directory layout
+        files = sorted(Path(root).glob('service_date=*/route=*/*.parquet'))
+        if not files:
+            return pd.DataFrame()
+        import pyarrow.parquet as pq
+        columns = pq.read_schema(files[0]).names
+    return pd.read_parquet(root, columns=columns, filters=filters or None)
+
+class ParquetDatasetWriter:
+    """
+    Buffers dataset rows and writes them as compressed, partitioned Parquet files.
+
+    Memory stays bounded by flush_rows: once that many rows are buffered (or flush_seconds have
+    passed since the last write) everything buffered is written out.
+    """
+
+    def __init__(self, root, flush_rows=50000, flush_seconds=600, compact_min_files=12):
+        self.root = Path(root)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.compact_min_files = compact_min_files
+        self._buffer = []
+        self._buffered_rows = 0
+        self._last_flush = time.monotonic()
+        self._last_seen = None
+        self._sequence = 0
+        # Partitions written to since they were last compacted
+        self._open_partitions = set()
+
+    def add(self, df):
+        """
+        Buffer one snapshot of dataset rows, dropping vehicle reports already stored by the
+        previous snapshot. Returns the number of new rows kept.
+        """
+        if df.empty:
+            return 0
+        df = df.drop_duplicates(subset=DEDUP_COLUMNS)
+        seen = pd.Series(df['position_timestamp'].to_numpy(), index=df['bus_id'])
+        seen = seen[~seen.index.duplicated(keep='last')]
+        if self._last_seen is not None:
+            previous = self._last_seen.reindex(df['bus_id']).to_numpy()
+            df = df[previous != df['position_timestamp'].to_numpy()]
+        self._last_seen = seen
+
+        if not df.empty:
+            self._buffer.append(df)
+            self._buffered_rows += len(df)
+        return len(df)
+
+    def should_flush(self):
+        return self._buffered_rows >= self.flush_rows or (
+            self._buffered_rows > 0 and time.monotonic() - self._last_flush >= self.flush_seconds)
+
+    def flush(self):
+        """Write buffered rows (one new part file per partition) and compact where due."""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return []
+        df = pd.concat(self._buffer, ignore_index=True)
+        self._buffer = []
+        self._buffered_rows = 0
+
+        self._sequence += 1
+        stamp = int(time.time())
+        written = []
+        for (service_date, route_id), part in df.groupby([service_dates(df['current_time']).to_numpy(),
+                                                          df['route_id'].to_numpy()], sort=False):
+            directory = partition_dir(self.root, service_date, route_id)
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"part-{stamp}-{self._sequence:04d}.parquet"
+            write_parquet(part, path)
+            written.append(directory)
+        self._open_partitions.update(written)
+        logger.info(f"Wrote {len(df)} rows to {len(written)} partitions under {self.root}.")
+        self.compact()
+        return written
+
+    def compact(self, force=False):
+        """
+        Compact partitions whose service day is over (or every partition, with force) into a
+        single file; partitions still being written are compacted once they reach
+        compact_min_files parts.
+        """
+        current_date = f"service_date={service_dates([time.time()])[0]}"
+        for directory in list(self._open_partitions):
+            closed = force or directory.parent.name < current_date
+            compact_partition(directory, min_files=2 if closed else self.compact_min_files)
+            if closed:
+                self._open_partitions.discard(directory)
+
+def write_parquet(df, path):
+    """Write atomically: readers never see a half-written file."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    df.to_parquet(tmp, index=False, compression=PARQUET_COMPRESSION)
+    os.replace(tmp, path)
+
+def compact_partition(directory, min_files=2):
+    """
+    Merge a partition's part files into one file (deduplicating vehicle reports on the way).
+    Returns the compacted path, or None if the partition had fewer than min_files files.
+    """
+    directory = Path(directory)
+    files = sorted(directory.glob('*.parquet'))
+    if len(files) < min_files:
+        return None
+    df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+    df = df.drop_duplicates(subset=DEDUP_COLUMNS)
+    path = directory / f"compacted-{int(time.time())}.parquet"
+    write_parquet(df, path)
+    for f in files:
+        if f != path:
+            f.unlink()
+    logger.debug(f"Compacted {len(files)} files in {directory} into {path.name}.")
+    return path
@@ -1,247 +1,271 @@
-# decision_tree_predict.py
-
-import time
-import pickle
-import httpx  # Replaced requests with httpx for async support
-import pandas as pd
-import math
-import pytz
-import tempfile
-import os
-import json
-import logging
-from datetime import datetime
-from pathlib import Path
-from protobuf_to_json import protobuf_to_json  # Custom module
-
-logger = logging.getLogger(__name__)
-
-bus_predictions = {}
-
-# Get absolute directory of the script
-BASE_DIR = Path(__file__).resolve().parent
-
-# Load the saved scaler and decision tree model using absolute paths
-try:
-    with open(BASE_DIR / "model_weights/scaler.pkl", "rb") as file:
-        scaler = pickle.load(file)
-
-    with open(BASE_DIR / "model_weights/decision_tree_model.pkl", "rb") as file:
-        dt_model = pickle.load(file)
-except FileNotFoundError as e:
-    logger.error(f"Failed to load model weights or scaler: {e}")
-    raise
-
-# Define Eastern Time Zone
-eastern = pytz.timezone('US/Eastern')
-
-# Load stops data using absolute path
-try:
-    stops_df = pd.read_csv(BASE_DIR / "data/stops.txt")
-except FileNotFoundError as e:
-    logger.error(f"Failed to load stops metadata: {e}")
-    raise
-
-# --- Utility Functions ---
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate the Haversine distance between two latitude/longitude points."""
-    R = 6371e3  # Earth's radius in meters
-    φ1, φ2 = map(math.radians, [lat1, lat2])
-    Δφ, Δλ = map(math.radians, [lat2 - lat1, lon2 - lon1])
-    a = math.sin(Δφ / 2) ** 2 + math.cos(φ1) * math.cos(φ2) * math.sin(Δλ / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c  # Distance in meters
-
-def calculate_speed(distance, time_diff):
-    """Calculate speed in meters per second."""
-    return 0 if time_diff == 0 else distance / time_diff
-
-async def fetch_and_convert(url):
-    """Fetch GTFS-Realtime data and convert to JSON asynchronously."""
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:  # 10-second timeout
-            response = await client.get(url)
-            response.raise_for_status()
-            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                tmp_file.write(response.content)
-                tmp_file.flush()
-                tmp_filename = tmp_file.name
-            data_json = protobuf_to_json(tmp_filename, save=False)
-            os.remove(tmp_filename)
-            return data_json
-    except httpx.TimeoutException:
-        logger.error(f"Timeout fetching data from {url}")
-        return None
-    except Exception as e:
-        logger.error(f"Error fetching or converting data from {url}: {e}")
-        return None
-
-async def get_real_time_data(save=False):
-    """Fetch, process, and convert GTFS data to a structured dataset."""
-    vehicle_positions_url = "https://drtonline.durhamregiontransit.com/gtfsrealtime/VehiclePositions"
-    trip_updates_url = "https://drtonline.durhamregiontransit.com/gtfsrealtime/TripUpdates"
-    
-    vehicle_positions = await fetch_and_convert(vehicle_positions_url)
-    trip_updates = await fetch_and_convert(trip_updates_url)
-    
-    if not vehicle_positions or not trip_updates:
-        logger.error("Failed to fetch GTFS data.")
-        return None
-    
-    processed_data = []
-    
-    # Get current time (as Unix timestamp)
-    current_time = datetime.fromtimestamp(vehicle_positions['header']['timestamp'], tz=eastern).timestamp()
-    
-    for vehicle_entity in vehicle_positions.get('entity', []):
-        if 'vehicle' not in vehicle_entity:
-            continue
-        
-        vehicle = vehicle_entity['vehicle']
-        bus_id = vehicle_entity.get('id')
-        trip_id = vehicle['trip'].get('trip_id')
-        route_id = vehicle['trip'].get('route_id')
-        current_lat = vehicle['position'].get('latitude')
-        current_lon = vehicle['position'].get('longitude')
-        position_timestamp = datetime.fromtimestamp(vehicle['timestamp'], tz=eastern).timestamp()
-
-        # Find trip update for this vehicle
-        trip_update = next((tu['trip_update'] for tu in trip_updates.get('entity', []) 
-                            if tu['trip_update']['trip'].get('trip_id') == trip_id), None)
-        
-        if trip_update and 'stop_time_update' in trip_update:
-            next_stop_update = trip_update['stop_time_update'][0]  # Assume first stop is next
-            next_stop_id = next_stop_update.get('stop_id')
-            
-            stop_match = stops_df[stops_df['stop_id'] == next_stop_id]
-            if stop_match.empty:
-                continue  # Skip if stop not found
-            
-            next_stop = stop_match.iloc[0]
-            next_stop_lat = next_stop['stop_lat']
-            next_stop_lon = next_stop['stop_lon']
-            next_stop_name = next_stop['stop_name']
-            
-            # Convert expected arrival to Unix timestamp
-            if next_stop_update.get('arrival') and next_stop_update['arrival'].get('time'):
-                expected_arrival = datetime.fromtimestamp(next_stop_update['arrival']['time'], tz=eastern).timestamp()
-            else:
-                continue
-            
-            time_to_arrival = expected_arrival - current_time
-            distance_to_stop = calculate_distance(current_lat, current_lon, next_stop_lat, next_stop_lon)
-            speed = calculate_speed(distance_to_stop, max(1, time_to_arrival))
-            
-            # Determine status (label for training)
-            if time_to_arrival < -60:
-                status = 'early'
-            elif time_to_arrival > 60:
-                status = 'late'
-            else:
-                status = 'on-time'
-            
-            record = {
-                'bus_id': bus_id,
-                'trip_id': trip_id,
-                'route_id': route_id,
-                'current_lat': current_lat,
-                'current_lon': current_lon,
-                'next_stop_id': next_stop_id,
-                'next_stop_lat': next_stop_lat,
-                'next_stop_lon': next_stop_lon,
-                'next_stop_name': next_stop_name,
-                'current_time': current_time,
-                'position_timestamp': position_timestamp,
-                'expected_arrival_time': expected_arrival,
-                'time_to_arrival_seconds': time_to_arrival,
-                'distance_to_stop_meters': distance_to_stop,
-                'speed_m_s': speed,
-                'status': status,
-                'stop_sequence': next_stop_update.get('stop_sequence'),
-                'wheelchair_boarding': next_stop.get('wheelchair_boarding')
-            }
-            processed_data.append(record)
-    
-    df = pd.DataFrame(processed_data)
-    if save:
-        csv_filename = 'bus_status_dataset.csv'
-        df.to_csv(csv_filename, index=False)
-        logger.info(f"Dataset saved as '{csv_filename}' with {len(df)} records.")
-    
-    return df
-
-def make_predictions(df):
-    """Make predictions using the decision tree model."""
-    if df is None or df.empty:
-        logger.warning("No data available for predictions.")
-        return None
-    
-    df_pred = df.copy()
-
-    # Drop non-feature columns
-    # NOTE: To fix the Target Leakage issue, 'time_to_arrival_seconds' and 'expected_arrival_time' 
-    # must be dropped from training and inference. However, since the loaded scaler and model
-    # were trained with these features, dropping them now without retraining would result in 
-    # a feature mismatch error. Once the model is retrained using the updated train_decision_tree.py, 
-    # add these columns to the blacklist below.
-    blacklist = ['bus_id', 'trip_id', 'route_id', 'next_stop_name', 'stop_sequence', 'wheelchair_boarding', 'status']
-    X = df_pred.drop(columns=blacklist, errors='ignore')
-
-    # Convert timestamps to Unix timestamps (redundant but ensures correctness)
-    time_columns = ['current_time', 'position_timestamp', 'expected_arrival_time']
-    for col in time_columns:
-        if col in X.columns:
-            X[col] = pd.to_numeric(X[col], errors='coerce')
-
-    # Scale features
-    X_scaled = scaler.transform(X)
-
-    # Predict
-    predictions = dt_model.predict(X_scaled)
-    bus_predictions = {}
-
-    # Iterate through each bus to compare predicted and real status
-    for idx, row in df_pred.iterrows():
-        predicted_status = predictions[idx]
-        
-        # Get the real status based on the calculated time to arrival
-        time_to_arrival = row['time_to_arrival_seconds']
-        if time_to_arrival < -60:
-            real_status = 'early'
-        elif time_to_arrival > 60:
-            real_status = 'late'
-        else:
-            real_status = 'on-time'
-        
-        # Log both predicted and real status
-        logger.info(f"Bus ID: {row['bus_id']}, Trip ID: {row['trip_id']}, Predicted Status: {predicted_status}, Real Status: {real_status}")
-        
-        # Save the predicted status in a dictionary
-        bus_predictions[row['bus_id']] = predicted_status
-    
-    return bus_predictions
-
-def decision_tree_scan(time_in_seconds=0):
-    """
-    Fetches real-time data, processes it, and makes predictions.
-    If `time_in_seconds` > 0, runs in a loop every `time_in_seconds` seconds.
-    """
-    import asyncio  # Required for async loop
-    if time_in_seconds <= 0:
-        df = asyncio.run(get_real_time_data())
-        if df is not None:
-            make_predictions(df)
-    else:
-        while True:
-            df = asyncio.run(get_real_time_data())
-            if df is not None:
-                make_predictions(df)
-            time.sleep(time_in_seconds)
-
-if __name__ == "__main__":
-    # Set time interval (in seconds) between data pulls. 0 = run once.
-    time_in_seconds = 5
-    try:
-        decision_tree_scan(time_in_seconds)
-    except Exception as e:
+# decision_tree_predict.py
+
+import asyncio
+import time
+import pickle
+import numpy as np
+import logging
+import os
+from pathlib import Path
+from urllib.parse import urlsplit
+from stops_index import stops_index  # Built once at import
+from gtfs_columnar import parse_feed, decode_vehicle_positions, decode_trip_updates
+from features import build_dataset, feature_matrix
+from feed_archive import ReplaySource
+from model_registry import load_bundle
+import metrics
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+bus_predictions = {}
+
+# Get absolute directory of the script
+BASE_DIR = Path(__file__).resolve().parent
+
+# Flat-array copy of the saved model with the scaler folded in, used on the serving path. It comes
+# from the artifact cache, so sklearn is only imported when the pickles change.
+try:
+    fast_model = load_bundle(BASE_DIR / "model_weights").model
+except FileNotFoundError as e:
+    logger.error(f"Failed to load model weights or scaler: {e}")
+    raise
+
+def __getattr__(name):
+    # The pickled sklearn scaler and model, and the parsed stops.txt, for code that still uses
+    # them (benchmarks, parity checks); loaded on first use
+    files = {'scaler': "scaler.pkl", 'dt_model': "decision_tree_model.pkl"}
+    if name in files:
+        with open(BASE_DIR / "model_weights" / files[name], "rb") as file:
+            globals()[name] = pickle.load(file)
+        return globals()[name]
+    if name == 'stops_df':
+        import stops_index as stops_module
+        return stops_module.stops_df
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# GTFS-Realtime feed URLs, Durham Region Transit by default. Point GTFS_RT_BASE_URL at another
+# server (e.g. benchmarks/mock_feed_server.py) or override either feed URL on its own.
+GTFS_RT_BASE_URL = os.environ.get("GTFS_RT_BASE_URL", "https://drtonline.durhamregiontransit.com/gtfsrealtime").rstrip("/")
+VEHICLE_POSITIONS_URL = os.environ.get("VEHICLE_POSITIONS_URL", f"{GTFS_RT_BASE_URL}/VehiclePositions")
+TRIP_UPDATES_URL = os.environ.get("TRIP_UPDATES_URL", f"{GTFS_RT_BASE_URL}/TripUpdates")
+
+# Replay archived feeds instead of polling upstream (see feed_archive.py). FEED_REPLAY_SPEED is a
+# multiple of real time; 0 serves one archived record per fetch, as fast as they are requested.
+FEED_REPLAY_DIR = os.environ.get("FEED_REPLAY_DIR")
+FEED_REPLAY_SPEED = float(os.environ.get("FEED_REPLAY_SPEED", "1"))
+
+# --- Feed Fetching ---
+# Long-lived client so keep-alive connections are reused across polls
+_client = None
+_client_loop = None
+
+# Connection pool size of the shared client. agencies.AgencyRegistry raises it so that every
+# upstream host can use its whole MAX_REQUESTS_PER_HOST budget at the same time
+DEFAULT_MAX_CONNECTIONS = 10
+_max_connections = DEFAULT_MAX_CONNECTIONS
+
+def set_max_connections(limit):
+    """Size the shared client's connection pool. Call it before the first fetch creates the client."""
+    global _max_connections
+    _max_connections = limit
+
+# Validators and raw payload of the last successful fetch, keyed by URL
+_feed_cache = {}
+
+# Last converted dictionary per URL, reused while its payload is unchanged
+_converted_cache = {}
+
+def get_client():
+    """Return the shared pooled HTTP client, creating it on first use (or for a new event loop)."""
+    global _client, _client_loop
+    import httpx  # Deferred so importing the app doesn't pay for it
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=10.0,  # 10-second timeout
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=_max_connections, max_keepalive_connections=_max_connections,
+                                keepalive_expiry=120.0),
+        )
+        _client_loop = loop
+    return _client
+
+async def close_client():
+    """Close the shared HTTP client and its pooled connections."""
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+def feed_host(url):
+    """Host of a feed URL, for metric labels: feed URLs can carry API keys in their query string."""
+    return urlsplit(url).hostname or ""
+
+async def fetch_feed(url, agency=""):
+    """
+    Fetch raw GTFS-Realtime protobuf bytes asynchronously.
+    Sends the previous ETag/Last-Modified so an unchanged feed comes back as a 304, in which
+    case the previously fetched bytes object is returned again. Metrics are labelled with
+    `agency` and the URL's host.
+    """
+    import httpx
+    host = feed_host(url)
+    try:
+        client = get_client()
+        cached = _feed_cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = await client.get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            metrics.FETCHES.inc(agency, host, 'not_modified')
+            return cached['content']
+        response.raise_for_status()
+        metrics.FETCHES.inc(agency, host, 'ok')
+        metrics.FETCH_BYTES.inc(agency, host, amount=len(response.content))
+
+        _feed_cache[url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content': response.content,
+        }
+        return response.content
+    except httpx.TimeoutException:
+        metrics.FETCHES.inc(agency, host, 'timeout')
+        logger.error(f"Timeout fetching data from {url}")
+        return None
+    except Exception as e:
+        metrics.FETCHES.inc(agency, host, 'error')
+        logger.error(f"Error fetching data from {url}: {e}")
+        return None
+
+async def fetch_and_convert(url):
+    """
+    Fetch GTFS-Realtime data and convert to JSON asynchronously.
+    An unchanged feed returns the previously converted dictionary without parsing; callers
+    must not mutate it.
+    """
+    content = await fetch_feed(url)
+    if content is None:
+        return None
+
+    cached = _converted_cache.get(url)
+    if cached is not None and cached[0] is content:
+        return cached[1]
+    from protobuf_to_json import protobuf_bytes_to_json  # Deferred: only the JSON paths need it
+    try:
+        data_json = protobuf_bytes_to_json(content)
+    except Exception as e:
+        logger.error(f"Error converting data from {url}: {e}")
+        return None
+    _converted_cache[url] = (content, data_json)
+    return data_json
+
+async def fetch_feeds():
+    """Fetch and convert the VehiclePositions and TripUpdates feeds concurrently."""
+    vehicle_positions, trip_updates = await asyncio.gather(
+        fetch_and_convert(VEHICLE_POSITIONS_URL),
+        fetch_and_convert(TRIP_UPDATES_URL),
+    )
+    return vehicle_positions, trip_updates
+
+# Alternative source of payloads (e.g. a ReplaySource); None means the live feeds
+_payload_source = None
+
+def set_payload_source(source):
+    """Serve fetch_payloads from `source` (anything with an async fetch_payloads()), or None for upstream."""
+    global _payload_source
+    _payload_source = source
+
+async def fetch_payloads():
+    """Fetch the raw VehiclePositions and TripUpdates protobuf payloads concurrently."""
+    if _payload_source is not None:
+        return await _payload_source.fetch_payloads()
+    vehicle_positions_pb, trip_updates_pb = await asyncio.gather(
+        fetch_feed(VEHICLE_POSITIONS_URL),
+        fetch_feed(TRIP_UPDATES_URL),
+    )
+    return vehicle_positions_pb, trip_updates_pb
+
+def decode_payloads(vehicle_positions_pb, trip_updates_pb):
+    """Decode raw VehiclePositions and TripUpdates payloads straight into column tables."""
+    vehicles = decode_vehicle_positions(parse_feed(vehicle_positions_pb))
+    trips = decode_trip_updates(parse_feed(trip_updates_pb))
+    return vehicles, trips
+
+def process_payloads(vehicle_positions_pb, trip_updates_pb):
+    """Build the feature dataset from raw VehiclePositions and TripUpdates payloads."""
+    return build_dataset(*decode_payloads(vehicle_positions_pb, trip_updates_pb))
+
+async def get_real_time_data(save=False):
+    """Fetch, process, and convert GTFS data to a structured dataset."""
+    vehicle_positions_pb, trip_updates_pb = await fetch_payloads()
+    
+    if not vehicle_positions_pb or not trip_updates_pb:
+        logger.error("Failed to fetch GTFS data.")
+        return None
+    
+    try:
+        df = process_payloads(vehicle_positions_pb, trip_updates_pb)
+    except Exception as e:
+        logger.error(f"Error decoding GTFS data: {e}")
+        return None
+    if save:
+        csv_filename = 'bus_status_dataset.csv'
+        df.to_csv(csv_filename, index=False)
+        logger.info(f"Dataset saved as '{csv_filename}' with {len(df)} records.")
+    
+    return df
+
+def make_predictions(df):
+    """Make predictions using the decision tree model."""
+    if df is None or df.empty:
+        logger.warning("No data available for predictions.")
+        return None
+    
+    # Raw features in scaler order; the compiled tree has the scaling folded in
+    predictions = fast_model.predict(feature_matrix(df))
+    bus_predictions = dict(zip(df['bus_id'], predictions))
+
+    matches = int(np.count_nonzero(predictions == df['status'].to_numpy()))
+    logger.info(f"Predicted status for {len(predictions)} buses ({matches} match the real status).")
+    return bus_predictions
+
+if FEED_REPLAY_DIR:
+    set_payload_source(ReplaySource(FEED_REPLAY_DIR, speed=FEED_REPLAY_SPEED))
+    logger.info(f"Replaying archived feeds from {FEED_REPLAY_DIR} at {FEED_REPLAY_SPEED}x.")
+
+def decision_tree_scan(time_in_seconds=0):
+    """
+    Fetches real-time data, processes it, and makes predictions.
+    If `time_in_seconds` > 0, runs in a loop every `time_in_seconds` seconds.
+    """
+    if time_in_seconds <= 0:
+        df = asyncio.run(get_real_time_data())
+        if df is not None:
+            make_predictions(df)
+    else:
+        while True:
+            df = asyncio.run(get_real_time_data())
+            if df is not None:
+                make_predictions(df)
+            time.sleep(time_in_seconds)
+
+if __name__ == "__main__":
+    # Set time interval (in seconds) between data pulls. 0 = run once.
+    time_in_seconds = 5
+    try:
+        decision_tree_scan(time_in_seconds)
+    except Exception as e:
         print(f"An error occurred: {e}")
\ No newline at end of file
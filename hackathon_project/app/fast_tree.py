@@ -0,0 +1,151 @@
+# fast_tree.py
+# Flat-array decision tree inference with the StandardScaler folded into the split thresholds.
+# Predicting a batch is a handful of NumPy gathers per tree level, with none of sklearn's
+# per-call validation and no scaling pass over the input.
+
+import warnings
+
+import numpy as np
+
+def ordered_keys(values):
+    """float64 values as int64 keys that sort in the same order (-0.0 and 0.0 share a key)."""
+    bits = values.view(np.int64)
+    return np.where(bits < 0, -(bits & np.int64(0x7FFFFFFFFFFFFFFF)), bits)
+
+def from_ordered_keys(keys):
+    bits = np.where(keys < 0, (-keys) | np.int64(-0x8000000000000000), keys)
+    return bits.view(np.float64)
+
+def smallest_raw_going_right(threshold, mean, scale):
+    """
+    Per split, the smallest float64 raw value that sklearn's StandardScaler + tree pipeline
+    sends right: float32((raw - mean) / scale) > threshold. Bisects over every float64 at once.
+    """
+    def goes_right(raw):
+        with np.errstate(over='ignore', invalid='ignore'):
+            return ((raw - mean) / scale).astype(np.float32).astype(np.float64) > threshold
+    low = ordered_keys(np.full(len(threshold), -np.finfo(np.float64).max))
+    high = ordered_keys(np.full(len(threshold), np.inf))
+    # Invariant: low goes left, high goes right. The keys span nearly all of int64, so take
+    # midpoints without forming high - low
+    while np.any(high > low + 1):
+        middle = (low >> 1) + (high >> 1) + (low & high & 1)
+        right = goes_right(from_ordered_keys(middle))
+        low, high = np.where(right, low, middle), np.where(right, middle, high)
+    return from_ordered_keys(high)
+
+class CompiledTree:
+    """
+    A fitted DecisionTreeClassifier exported to flat node arrays.
+
+    Leaves point back at themselves, so every sample can be advanced `max_depth` times
+    without checking which ones have already stopped.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, leaf_class, classes, max_depth,
+                 n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.leaf_class = leaf_class
+        self.classes = classes
+        self.max_depth = max_depth
+        self.n_features = n_features
+        # Dataset columns the model reads, in order, when known (None: features.FEATURE_COLUMNS)
+        self.features = None
+        # Features that any split actually reads; other columns cannot change a prediction
+        self.used_features = np.unique(feature[left != np.arange(len(left))])
+
+    @classmethod
+    def from_sklearn(cls, dt_model, scaler=None):
+        """
+        Export a fitted DecisionTreeClassifier, optionally folding the StandardScaler that
+        preprocessed its inputs into the thresholds so raw features can be fed directly.
+        """
+        tree = dt_model.tree_
+        if tree.n_outputs != 1:
+            raise ValueError("Only single-output decision trees can be compiled.")
+
+        n_nodes = tree.node_count
+        nodes = np.arange(n_nodes)
+        is_leaf = tree.children_left < 0
+        left = np.where(is_leaf, nodes, tree.children_left).astype(np.intp)
+        right = np.where(is_leaf, nodes, tree.children_right).astype(np.intp)
+        feature = np.where(is_leaf, 0, tree.feature).astype(np.intp)
+
+        # sklearn scales the input ((raw - mean) / scale, in float64), casts it to float32 and
+        # sends it right when that float32 is above the float64 threshold. That is a monotonic
+        # function of the raw value, so each split has a smallest raw value that goes right, which
+        # becomes the raw-unit threshold. Rounding in the scaling and the cast makes it awkward
+        # to derive in closed form, so bisect for it instead, exactly.
+        t = tree.threshold.astype(np.float64)
+        mean, scale = np.zeros(n_nodes), np.ones(n_nodes)
+        if scaler is not None:
+            if scaler.mean_ is not None and scaler.with_mean:
+                mean = scaler.mean_[feature]
+            if scaler.scale_ is not None and scaler.with_std:
+                scale = scaler.scale_[feature]
+        bound = smallest_raw_going_right(t, mean, scale)
+        # Leaves never branch; +inf keeps the comparison harmless
+        threshold = np.where(is_leaf, np.inf, bound)
+
+        # Where NaN goes at each split (sklearn >= 1.3); older trees send it right
+        missing_left = getattr(tree, 'missing_go_to_left', None)
+        missing_left = np.zeros(n_nodes, dtype=bool) if missing_left is None else np.asarray(missing_left, dtype=bool)
+
+        leaf_class = np.argmax(tree.value[:, 0, :], axis=1).astype(np.intp)
+        return cls(feature, threshold, left, right, missing_left & ~is_leaf, leaf_class,
+                   np.asarray(dt_model.classes_), int(tree.max_depth), int(dt_model.n_features_in_))
+
+    def to_arrays(self):
+        """(arrays, info) for artifact_cache: the node arrays, and the scalars and feature names."""
+        arrays = {
+            'feature': self.feature, 'threshold': self.threshold, 'left': self.left, 'right': self.right,
+            'missing_left': self.missing_left, 'leaf_class': self.leaf_class, 'classes': self.classes.astype(str),
+        }
+        info = {'max_depth': self.max_depth, 'n_features': self.n_features, 'features': self.features}
+        return arrays, info
+
+    @classmethod
+    def from_arrays(cls, arrays, info):
+        """Rebuild a compiled tree from to_arrays output (e.g. memory-mapped from the artifact cache)."""
+        arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        tree = cls(arrays['feature'], arrays['threshold'], arrays['left'], arrays['right'], arrays['missing_left'],
+                   arrays['leaf_class'], arrays['classes'].astype(object), info['max_depth'], info['n_features'])
+        tree.features = info['features']
+        return tree
+
+    def apply(self, X):
+        """Leaf index reached by each row of X (raw, unscaled features as float64)."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected a 2D array with {self.n_features} features, got shape {X.shape}.")
+
+        rows = np.arange(X.shape[0])
+        node = np.zeros(X.shape[0], dtype=np.intp)
+        for _ in range(self.max_depth):
+            value = X[rows, self.feature[node]]
+            go_left = (value < self.threshold[node]) | (np.isnan(value) & self.missing_left[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_codes(self, X):
+        """Index into self.classes of each row's predicted class."""
+        return self.leaf_class[self.apply(X)]
+
+    def predict(self, X):
+        """Predicted class label for each row of X."""
+        return self.classes[self.predict_codes(X)]
+
+def agreement(compiled, dt_model, scaler, X):
+    """Fraction of rows where the compiled tree and the sklearn scaler+model pipeline agree."""
+    X = np.asarray(X, dtype=np.float64)
+    if len(X) == 0:
+        return 1.0
+    with warnings.catch_warnings():
+        # The scaler may have been fitted on a DataFrame; plain arrays are fine here
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        expected = dt_model.predict(scaler.transform(X) if scaler is not None else X)
+    return float(np.mean(compiled.predict(X) == expected))
@@ -0,0 +1,218 @@
+# features.py
+# Batched feature stage shared by the API and the dataset collector, so training and serving
+# features are computed by the same code. Vehicles are joined to their next stop (or to every
+# upcoming stop) once per snapshot, then distance, speed, time-to-arrival and the status label
+# are computed with NumPy.
+
+import numpy as np
+import pandas as pd
+
+from gtfs_columnar import index_trips
+from position_history import HISTORY_COLUMNS, empty_history
+from stops_index import stops_index, haversine_m
+
+# Arrivals within this many seconds of the expected time count as on time
+ON_TIME_WINDOW_SECONDS = 60
+
+# Every column of the dataset, in the order the collector and the API produce them
+DATASET_COLUMNS = [
+    'bus_id', 'trip_id', 'route_id', 'current_lat', 'current_lon', 'next_stop_id', 'next_stop_lat',
+    'next_stop_lon', 'next_stop_name', 'current_time', 'position_timestamp', 'expected_arrival_time',
+    'time_to_arrival_seconds', 'distance_to_stop_meters', 'speed_m_s', 'status', 'stop_sequence',
+    'wheelchair_boarding'
+] + HISTORY_COLUMNS
+
+# Columns the serving scaler and model were fitted on, in fitting order.
+# NOTE: 'time_to_arrival_seconds', 'expected_arrival_time' and 'speed_m_s' leak the target; they stay
+# until the model is retrained without them (see train_decision_tree.py).
+FEATURE_COLUMNS = [
+    'current_lat', 'current_lon', 'next_stop_id', 'next_stop_lat', 'next_stop_lon', 'current_time',
+    'position_timestamp', 'expected_arrival_time', 'time_to_arrival_seconds',
+    'distance_to_stop_meters', 'speed_m_s'
+]
+
+# Columns the status label can be recovered from; training never uses them as inputs. speed_m_s is
+# distance_to_stop_meters over time_to_arrival_seconds, so next to the distance it gives the label away
+LEAKAGE_COLUMNS = ['expected_arrival_time', 'time_to_arrival_seconds', 'speed_m_s']
+
+def classify_status(time_to_arrival):
+    """Label arrival offsets (seconds) as 'early', 'late' or 'on-time'."""
+    t = np.asarray(time_to_arrival, dtype=np.float64)
+    labels = np.where(t < -ON_TIME_WINDOW_SECONDS, 'early',
+                      np.where(t > ON_TIME_WINDOW_SECONDS, 'late', 'on-time'))
+    return labels.astype(object)
+
+def join_next_stops(vehicles, trips, stops=stops_index):
+    """
+    Pair every vehicle with the first stop_time_update of its trip (assumed to be the next stop).
+    Vehicles without a trip update, a known stop or an arrival time are skipped.
+
+    Parameters:
+    - vehicles (dict): VehiclePositions columns from gtfs_columnar.decode_vehicle_positions
+    - trips (dict): TripUpdates tables from gtfs_columnar.decode_trip_updates
+    - stops (StopsIndex): Stops the feed refers to (default: this deployment's data/stops.txt)
+
+    Returns:
+    - dict: Equal-length column arrays in feed order; stop metadata is referenced by `stop_pos`
+    """
+    trip_rows = index_trips(trips)
+    n = len(vehicles['trip_id'])
+    trip_row = np.fromiter((trip_rows.get(trip_id, -1) for trip_id in vehicles['trip_id']),
+                           dtype=np.intp, count=n)
+
+    # Keep vehicles whose trip has at least one stop_time_update
+    offsets = trips['offsets']
+    matched = np.flatnonzero(trip_row >= 0)
+    first_update = offsets[trip_row[matched]]
+    has_updates = offsets[trip_row[matched] + 1] > first_update
+    matched, first_update = matched[has_updates], first_update[has_updates]
+
+    # ...whose next stop is known and has an arrival time
+    stop_pos = stops.positions_of(trips['stop_id'][first_update])
+    expected_arrival = trips['arrival_time'][first_update]
+    usable = (stop_pos >= 0) & (expected_arrival != 0)
+    matched, first_update, stop_pos = matched[usable], first_update[usable], stop_pos[usable]
+
+    return {
+        'bus_id': vehicles['entity_id'][matched],
+        'trip_id': vehicles['trip_id'][matched],
+        'route_id': vehicles['route_id'][matched],
+        'current_lat': vehicles['latitude'][matched],
+        'current_lon': vehicles['longitude'][matched],
+        'position_timestamp': vehicles['timestamp'][matched].astype(np.float64),
+        'next_stop_id': trips['stop_id'][first_update],
+        'stop_pos': stop_pos,
+        'expected_arrival_time': expected_arrival[usable].astype(np.float64),
+        'stop_sequence': trips['stop_sequence'][first_update],
+    }
+
+def join_upcoming_stops(vehicles, trips, stops=stops_index):
+    """
+    Pair every vehicle with every stop_time_update of its trip, not only the first, by expanding
+    the decoded offsets table in one vectorized pass. Pairs whose stop is unknown or has no
+    arrival time are skipped.
+
+    Parameters:
+    - vehicles (dict): VehiclePositions columns from gtfs_columnar.decode_vehicle_positions
+    - trips (dict): TripUpdates tables from gtfs_columnar.decode_trip_updates
+    - stops (StopsIndex): Stops the feed refers to
+
+    Returns:
+    - dict: join_next_stops' columns with one row per (vehicle, stop), where the next_stop_*
+      columns name the stop of the pair, grouped by vehicle in feed order and in trip order
+      within a vehicle, plus 'stops_ahead' (the update's position in the trip, 0 for the next stop)
+    """
+    trip_rows = index_trips(trips)
+    n = len(vehicles['trip_id'])
+    trip_row = np.fromiter((trip_rows.get(trip_id, -1) for trip_id in vehicles['trip_id']),
+                           dtype=np.intp, count=n)
+    matched = np.flatnonzero(trip_row >= 0)
+    offsets = trips['offsets']
+    starts = offsets[trip_row[matched]]
+    counts = offsets[trip_row[matched] + 1] - starts
+
+    # Pair k of a vehicle is update starts + k of its trip
+    vehicle = np.repeat(matched, counts)
+    stops_ahead = np.arange(len(vehicle)) - np.repeat(np.cumsum(counts) - counts, counts)
+    update = np.repeat(starts, counts) + stops_ahead
+
+    # Stop ids repeat across trips; look each distinct one up once
+    codes, uniques = pd.factorize(trips['stop_id'])
+    stop_pos = np.append(stops.positions_of(uniques), -1)[codes][update]
+    expected_arrival = trips['arrival_time'][update]
+    usable = (stop_pos >= 0) & (expected_arrival != 0)
+    vehicle, update, stop_pos = vehicle[usable], update[usable], stop_pos[usable]
+
+    return {
+        'bus_id': vehicles['entity_id'][vehicle],
+        'trip_id': vehicles['trip_id'][vehicle],
+        'route_id': vehicles['route_id'][vehicle],
+        'current_lat': vehicles['latitude'][vehicle],
+        'current_lon': vehicles['longitude'][vehicle],
+        'position_timestamp': vehicles['timestamp'][vehicle].astype(np.float64),
+        'next_stop_id': trips['stop_id'][update],
+        'stop_pos': stop_pos,
+        'expected_arrival_time': expected_arrival[usable].astype(np.float64),
+        'stop_sequence': trips['stop_sequence'][update],
+        'stops_ahead': stops_ahead[usable],
+    }
+
+def compute_features(columns, current_time, distance_to_stop=None, stops=stops_index, history=None):
+    """
+    Compute the full dataset for one snapshot in a single vectorized pass.
+
+    Parameters:
+    - columns (dict): Column arrays as returned by join_next_stops
+    - current_time (float): Feed header timestamp (Unix seconds)
+    - distance_to_stop (np.ndarray): Precomputed distances to skip the Haversine pass (optional)
+    - stops (StopsIndex): The index `stop_pos` refers to
+    - history (dict): HISTORY_COLUMNS arrays from PositionHistory.observe (default: all NaN)
+
+    Returns:
+    - pd.DataFrame: One row per vehicle with DATASET_COLUMNS
+    """
+    stop_pos = columns['stop_pos']
+    next_stop_lat = stops.lat[stop_pos]
+    next_stop_lon = stops.lon[stop_pos]
+
+    time_to_arrival = columns['expected_arrival_time'] - current_time
+    if distance_to_stop is None:
+        distance_to_stop = haversine_m(columns['current_lat'], columns['current_lon'], next_stop_lat, next_stop_lon)
+    speed = distance_to_stop / np.maximum(1, time_to_arrival)
+    if history is None:
+        history = empty_history(len(stop_pos))
+
+    return pd.DataFrame({
+        'bus_id': columns['bus_id'],
+        'trip_id': columns['trip_id'],
+        'route_id': columns['route_id'],
+        'current_lat': columns['current_lat'],
+        'current_lon': columns['current_lon'],
+        'next_stop_id': columns['next_stop_id'],
+        'next_stop_lat': next_stop_lat,
+        'next_stop_lon': next_stop_lon,
+        'next_stop_name': stops.name[stop_pos],
+        'current_time': np.full(len(stop_pos), float(current_time)),
+        'position_timestamp': columns['position_timestamp'],
+        'expected_arrival_time': columns['expected_arrival_time'],
+        'time_to_arrival_seconds': time_to_arrival,
+        'distance_to_stop_meters': distance_to_stop,
+        'speed_m_s': speed,
+        'status': classify_status(time_to_arrival),
+        'stop_sequence': columns['stop_sequence'],
+        'wheelchair_boarding': stops.wheelchair_boarding[stop_pos],
+        **history,
+    }, columns=DATASET_COLUMNS)
+
+def build_dataset(vehicles, trips, stops=stops_index, history=None):
+    """
+    Join decoded VehiclePositions and TripUpdates tables and compute their features. With a
+    PositionHistory, the snapshot is recorded in it and the observed-motion features are filled in.
+    """
+    columns = join_next_stops(vehicles, trips, stops)
+    current_time = float(vehicles['header_timestamp'])
+    observed = history.observe(columns, current_time, stops) if history is not None else None
+    return compute_features(columns, current_time, stops=stops, history=observed)
+
+def feature_frame(df, columns=FEATURE_COLUMNS):
+    """Select the model's input columns from a dataset, in the order the scaler expects."""
+    X = df[columns].copy()
+    # Stop ids are numeric for almost every stop; the rare merged ids become NaN instead of failing
+    if 'next_stop_id' in X:
+        X['next_stop_id'] = pd.to_numeric(X['next_stop_id'], errors='coerce')
+    return X
+
+def feature_matrix(df, columns=FEATURE_COLUMNS):
+    """Model input columns of a dataset as one float64 array (raw, unscaled), in scaler order."""
+    X = np.empty((len(df), len(columns)), dtype=np.float64)
+    for j, col in enumerate(columns):
+        values = df[col]
+        if values.dtype.kind in 'biuf':
+            X[:, j] = values.to_numpy()
+            continue
+        # Stop ids arrive as strings, and repeat across rows: parse each distinct one once.
+        # The rare merged ids become NaN instead of failing
+        codes, uniques = pd.factorize(values)
+        parsed = pd.to_numeric(np.asarray(uniques, dtype=object), errors='coerce').astype(np.float64)
+        X[:, j] = np.append(parsed, np.nan)[codes]
+    return X
@@ -0,0 +1,177 @@
+# feed_archive.py
+# Append-only archive of raw GTFS-RT payloads and a replay source that serves them back.
+#
+# Each poll that brings new data is stored as one record holding the VehiclePositions and
+# TripUpdates payloads (zlib-compressed) in an hourly segment file, named after the UTC hour of
+# the feed header timestamp. Every segment has a sidecar .idx file of (header timestamp, byte
+# offset) pairs, so a replay can seek straight to any point in time.
+
+import asyncio
+import logging
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Record header: feed header timestamp, compressed VehiclePositions and TripUpdates lengths
+RECORD_HEADER = struct.Struct('<qII')
+INDEX_DTYPE = np.dtype([('timestamp', '<i8'), ('offset', '<i8')])
+COMPRESSION_LEVEL = 6
+
+def segment_name(header_timestamp):
+    hour = datetime.fromtimestamp(header_timestamp, tz=timezone.utc).strftime('%Y%m%dT%H')
+    return f"feeds-{hour}.bin"
+
+class FeedArchive:
+    """Writes and reads the segment files under one archive directory."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._last = None
+        # A single writer thread keeps records in publish order and file I/O off the event loop
+        self._executor = None
+
+    def append(self, vehicle_positions_pb, trip_updates_pb, header_timestamp):
+        """Store one pair of payloads. Returns False if it repeats the last pair stored."""
+        if self._last is not None and self._last == (vehicle_positions_pb, trip_updates_pb):
+            return False
+        self._last = (vehicle_positions_pb, trip_updates_pb)
+
+        vp = zlib.compress(vehicle_positions_pb, COMPRESSION_LEVEL)
+        tu = zlib.compress(trip_updates_pb, COMPRESSION_LEVEL)
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / segment_name(header_timestamp)
+        with open(path, 'ab') as segment:
+            offset = segment.tell()
+            segment.write(RECORD_HEADER.pack(int(header_timestamp), len(vp), len(tu)))
+            segment.write(vp)
+            segment.write(tu)
+        # The index entry goes in only after its record is complete on disk
+        with open(path.with_suffix('.idx'), 'ab') as index:
+            index.write(np.array([(header_timestamp, offset)], dtype=INDEX_DTYPE).tobytes())
+        return True
+
+    def append_snapshot(self, snapshot):
+        """Poller listener: archive a published snapshot's payloads without blocking the loop."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='feed-archive')
+        future = self._executor.submit(self.append, snapshot.vehicle_positions_pb, snapshot.trip_updates_pb,
+                                       snapshot.feed_timestamp)
+        future.add_done_callback(_log_failure)
+
+    def close(self):
+        """Wait for queued writes to finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def segments(self):
+        return sorted(self.root.glob('feeds-*.bin'))
+
+    def index(self, segment):
+        """(timestamp, offset) entries for a segment, rebuilt by scanning if the sidecar is missing."""
+        path = segment.with_suffix('.idx')
+        size = segment.stat().st_size
+        if path.exists():
+            entries = np.fromfile(path, dtype=INDEX_DTYPE)
+            return entries[entries['offset'] < size]
+        entries = []
+        with open(segment, 'rb') as f:
+            offset = 0
+            while offset + RECORD_HEADER.size <= size:
+                f.seek(offset)
+                timestamp, vp_len, tu_len = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                end = offset + RECORD_HEADER.size + vp_len + tu_len
+                if end > size:
+                    break  # Truncated by a crash mid-write
+                entries.append((timestamp, offset))
+                offset = end
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def records(self, start=None, end=None):
+        """
+        Yield archived (header_timestamp, vehicle_positions_pb, trip_updates_pb) in archive order.
+
+        Parameters:
+        - start (int): First header timestamp to include (default: the beginning)
+        - end (int): Last header timestamp to include (default: the end)
+        """
+        for segment in self.segments():
+            entries = self.index(segment)
+            if len(entries) == 0:
+                continue
+            if end is not None and entries['timestamp'][0] > end:
+                break
+            if start is not None:
+                entries = entries[np.searchsorted(entries['timestamp'], start):]
+            with open(segment, 'rb') as f:
+                for timestamp, offset in entries:
+                    if end is not None and timestamp > end:
+                        return
+                    f.seek(offset)
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    timestamp, vp_len, tu_len = RECORD_HEADER.unpack(header)
+                    body = f.read(vp_len + tu_len)
+                    if len(body) < vp_len + tu_len:
+                        break
+                    yield int(timestamp), zlib.decompress(body[:vp_len]), zlib.decompress(body[vp_len:])
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(f"Failed to archive feed payloads: {future.exception()}")
+
+class ReplaySource:
+    """
+    Serves archived payloads in place of the live feeds.
+
+    With a speed (1.0 = real time, 10.0 = ten times faster), a replay clock starts on the first
+    fetch and every fetch returns the latest record due by then, the way polling the live feed
+    would. Without one, every fetch returns the next record, as fast as it is asked for.
+    """
+
+    def __init__(self, archive, speed=1.0, start=None, end=None):
+        self.archive = archive if isinstance(archive, FeedArchive) else FeedArchive(archive)
+        self.speed = speed
+        self._records = self.archive.records(start, end)
+        self._current = None
+        self._next = next(self._records, None)
+        self._clock_start = None
+        self.exhausted = self._next is None
+
+    def _advance(self):
+        self._current = self._next
+        self._next = next(self._records, None)
+
+    async def fetch_payloads(self):
+        """Return the (vehicle_positions_pb, trip_updates_pb) pair the feeds would serve now."""
+        if not self.speed:
+            if self._next is None:
+                self.exhausted = True
+                return None, None
+            await asyncio.to_thread(self._advance)
+            self.exhausted = self._next is None
+        else:
+            if self._clock_start is None:
+                if self._next is None:
+                    return None, None
+                self._clock_start = (time.monotonic(), self._next[0])
+            started, first_timestamp = self._clock_start
+            replay_time = first_timestamp + (time.monotonic() - started) * self.speed
+            # Decompressing a backlog of records is file I/O; keep it off the event loop
+            while self._next is not None and self._next[0] <= replay_time:
+                await asyncio.to_thread(self._advance)
+            self.exhausted = self._next is None
+        # An unchanged record comes back as the same bytes objects, like a 304 from upstream
+        return self._current[1], self._current[2]
+
+    def replay_time(self):
+        """Header timestamp of the record currently being served."""
+        return self._current[0] if self._current is not None else None
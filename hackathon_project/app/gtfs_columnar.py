@@ -0,0 +1,115 @@
+# gtfs_columnar.py
+# Decodes GTFS-Realtime FeedMessages straight into NumPy column tables for the prediction
+# pipeline. Unlike protobuf_to_json, which builds a nested dict per entity and per
+# stop_time_update (kept for the raw JSON endpoints), every column here is preallocated
+# once and filled in a single walk over the feed.
+
+import numpy as np
+
+def parse_feed(data):
+    """Parse a serialized FeedMessage."""
+    # Deferred so importing the app doesn't load the protobuf bindings before the first poll
+    from google.transit import gtfs_realtime_pb2
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(data)
+    return feed
+
+def decode_vehicle_positions(feed):
+    """
+    Decodes the vehicle entities of a VehiclePositions feed into columns.
+
+    Returns:
+    - dict: 'header_timestamp' (int) plus equal-length arrays 'entity_id', 'trip_id',
+      'route_id' (object), 'latitude', 'longitude' (float64) and 'timestamp' (int64)
+    """
+    n = len(feed.entity)
+    entity_id = np.empty(n, dtype=object)
+    trip_id = np.empty(n, dtype=object)
+    route_id = np.empty(n, dtype=object)
+    latitude = np.empty(n, dtype=np.float64)
+    longitude = np.empty(n, dtype=np.float64)
+    timestamp = np.empty(n, dtype=np.int64)
+
+    count = 0
+    for entity in feed.entity:
+        if not entity.HasField('vehicle'):
+            continue
+        vehicle = entity.vehicle
+        entity_id[count] = entity.id
+        trip_id[count] = vehicle.trip.trip_id
+        route_id[count] = vehicle.trip.route_id
+        latitude[count] = vehicle.position.latitude
+        longitude[count] = vehicle.position.longitude
+        timestamp[count] = vehicle.timestamp
+        count += 1
+
+    # Slicing returns views, so skipped entities cost nothing extra
+    return {
+        'header_timestamp': feed.header.timestamp,
+        'entity_id': entity_id[:count],
+        'trip_id': trip_id[:count],
+        'route_id': route_id[:count],
+        'latitude': latitude[:count],
+        'longitude': longitude[:count],
+        'timestamp': timestamp[:count],
+    }
+
+def decode_trip_updates(feed):
+    """
+    Decodes the trip_update entities of a TripUpdates feed into a trip table and a flattened
+    stop_time_update table. The updates of trip i are rows offsets[i]:offsets[i + 1].
+    A missing arrival or departure is stored as 0.
+
+    Returns:
+    - dict: 'header_timestamp' (int); trip columns 'trip_id', 'route_id' (object) and
+      'offsets' (int64, one longer than the trip columns); stop_time_update columns
+      'stop_sequence', 'arrival_time', 'departure_time' (int64) and 'stop_id' (object)
+    """
+    trip_updates = [entity.trip_update for entity in feed.entity if entity.HasField('trip_update')]
+    n_trips = len(trip_updates)
+    n_stops = sum(len(trip_update.stop_time_update) for trip_update in trip_updates)
+
+    trip_id = np.empty(n_trips, dtype=object)
+    route_id = np.empty(n_trips, dtype=object)
+    offsets = np.empty(n_trips + 1, dtype=np.int64)
+    stop_sequence = np.empty(n_stops, dtype=np.int64)
+    stop_id = np.empty(n_stops, dtype=object)
+    arrival_time = np.zeros(n_stops, dtype=np.int64)
+    departure_time = np.zeros(n_stops, dtype=np.int64)
+
+    row = 0
+    for i, trip_update in enumerate(trip_updates):
+        trip_id[i] = trip_update.trip.trip_id
+        route_id[i] = trip_update.trip.route_id
+        offsets[i] = row
+        for stu in trip_update.stop_time_update:
+            stop_sequence[row] = stu.stop_sequence
+            stop_id[row] = stu.stop_id
+            if stu.HasField('arrival'):
+                arrival_time[row] = stu.arrival.time
+            if stu.HasField('departure'):
+                departure_time[row] = stu.departure.time
+            row += 1
+    offsets[n_trips] = row
+
+    return {
+        'header_timestamp': feed.header.timestamp,
+        'trip_id': trip_id,
+        'route_id': route_id,
+        'offsets': offsets,
+        'stop_sequence': stop_sequence,
+        'stop_id': stop_id,
+        'arrival_time': arrival_time,
+        'departure_time': departure_time,
+    }
+
+def index_trips(trips):
+    """
+    Maps trip_id to its row in a decoded trip table so vehicles can be joined in O(1).
+    Empty trip_ids are skipped; when a trip_id repeats, the first row in feed order wins.
+    """
+    index = {}
+    for row, trip_id in enumerate(trips['trip_id']):
+        if trip_id:
+            index.setdefault(trip_id, row)
+    return index
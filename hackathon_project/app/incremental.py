@@ -0,0 +1,238 @@
+# incremental.py
+# Keyed, incremental scoring between feed snapshots. Vehicles whose report and next
+# stop_time_update are unchanged reuse their previous distance, only rows whose model inputs
+# changed go back through the tree, and every cycle yields an explicit added/changed/removed
+# delta of predictions keyed by bus_id for downstream consumers. A bus is only "changed" when
+# its prediction is; on a live feed nearly every bus reports a new position each cycle. Each
+# cycle also scores every upcoming stop of every vehicle in one batch, for the multi-stop
+# arrival predictions.
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS, compute_features, feature_matrix, join_next_stops, join_upcoming_stops
+from gtfs_columnar import parse_feed, decode_vehicle_positions, decode_trip_updates
+from position_history import HISTORY_COLUMNS, PositionHistory
+from raw_feeds import dumps
+from snapshot_index import SnapshotIndex
+from stops_index import GridIndex, stops_index, haversine_m
+
+# Fields that identify a new vehicle report or a new next-stop prediction
+SIGNATURE_COLUMNS = [
+    'trip_id', 'position_timestamp', 'current_lat', 'current_lon', 'next_stop_id',
+    'expected_arrival_time', 'stop_sequence'
+]
+
+def empty_delta():
+    """A delta with no changes."""
+    return {'added': {}, 'changed': {}, 'removed': []}
+
+class IncrementalScorer:
+    """
+    Scores successive snapshots, keeping the previous one keyed by bus_id.
+
+    Note that time-dependent features (time to arrival, speed, status) are recomputed for every
+    row each cycle because they move with the feed header timestamp; with a model that splits on
+    them, rows are re-scored whenever the header advances, just in one batch per cycle. The
+    shipped model splits only on time_to_arrival_seconds, so it rescores every bus on every poll:
+    predictions are only reused once a model trained without the clock-dependent inputs (see
+    train_decision_tree.py) is serving.
+    Every snapshot is also recorded in a PositionHistory for the observed-motion features.
+    """
+
+    def __init__(self, model, stops=stops_index, history=None):
+        self.model = model
+        self.stops = stops
+        self.history = history if history is not None else PositionHistory()
+        self._previous = None
+
+    def reset(self, model=None):
+        """
+        Forget the previous snapshot (and optionally switch models), forcing a full recompute.
+        The position history is kept; it doesn't depend on the model.
+        """
+        if model is not None:
+            self.model = model
+        self._previous = None
+
+    def update(self, vehicles, trips):
+        """
+        Score one snapshot of decoded feeds.
+
+        Returns:
+        - tuple: (df, bus_predictions, delta, stats) where delta maps 'added' to the new buses'
+          {bus_id: prediction}, 'changed' to those of buses whose prediction differs from the
+          previous snapshot's (not merely their inputs) and 'removed' to a list of bus_ids, and
+          stats counts the rows whose features and predictions were reused and times each stage
+          in 'seconds'
+        """
+        started = time.perf_counter()
+        columns = join_next_stops(vehicles, trips, self.stops)
+        bus_ids = columns['bus_id']
+        keys = pd.Index(bus_ids)
+        previous = self._previous
+
+        if previous is not None and previous['keys'].is_unique:
+            prev_row = previous['keys'].get_indexer(keys)
+        else:
+            previous = None
+            prev_row = np.full(len(keys), -1, dtype=np.intp)
+        known = prev_row >= 0
+        take = prev_row[known]
+
+        # Vehicles whose report and next stop are identical to the previous snapshot
+        unchanged = known.copy()
+        if known.any():
+            same = np.ones(len(take), dtype=bool)
+            for col in SIGNATURE_COLUMNS:
+                same &= columns[col][known] == previous['columns'][col][take]
+            unchanged[known] = same
+
+        # Distance to the next stop only moves when the report or the stop does
+        distance = np.empty(len(keys), dtype=np.float64)
+        if unchanged.any():
+            distance[unchanged] = previous['distance'][prev_row[unchanged]]
+        fresh = ~unchanged
+        stop_pos = columns['stop_pos'][fresh]
+        distance[fresh] = haversine_m(columns['current_lat'][fresh], columns['current_lon'][fresh],
+                                      self.stops.lat[stop_pos], self.stops.lon[stop_pos])
+
+        current_time = float(vehicles['header_timestamp'])
+        joined = time.perf_counter()
+        observed = self.history.observe(columns, current_time, self.stops)
+        recorded = time.perf_counter()
+        df = compute_features(columns, current_time, distance, self.stops, observed)
+        X = feature_matrix(df, self.model.features or FEATURE_COLUMNS)
+        featurized = time.perf_counter()
+
+        # Re-score only rows whose inputs to the tree's splits changed
+        rescore = ~known
+        if known.any():
+            used = self.model.used_features
+            a, b = X[known][:, used], previous['X'][take][:, used]
+            rescore[known] = ~np.all((a == b) | (np.isnan(a) & np.isnan(b)), axis=1)
+        predictions = np.empty(len(keys), dtype=object)
+        reuse = ~rescore
+        if reuse.any():
+            predictions[reuse] = previous['predictions'][prev_row[reuse]]
+        if rescore.any():
+            predictions[rescore] = self.model.predict(X[rescore])
+        predicted = time.perf_counter()
+
+        changed = np.zeros(len(keys), dtype=bool)
+        if known.any():
+            changed[known] = predictions[known] != previous['predictions'][take]
+        delta = {
+            'added': dict(zip(bus_ids[~known], predictions[~known])),
+            'changed': dict(zip(bus_ids[changed], predictions[changed])),
+            'removed': list(previous['keys'][~previous['keys'].isin(keys)]) if previous is not None else [],
+        }
+        stats = {
+            'rows': len(keys),
+            'reused_features': int(np.count_nonzero(unchanged)),
+            'reused_predictions': int(np.count_nonzero(reuse)),
+            'rescored': int(np.count_nonzero(rescore)),
+            # The join includes the next-stop lookup and the distances to those stops
+            'seconds': {
+                'join': joined - started,
+                'history': recorded - joined,
+                'features': featurized - recorded,
+                'predict': predicted - featurized,
+            },
+        }
+
+        self._previous = {
+            'keys': keys,
+            'columns': columns,
+            'distance': distance,
+            'X': X,
+            'predictions': predictions,
+        }
+        return df, dict(zip(bus_ids, predictions)), delta, stats
+
+    def score_upcoming(self, vehicles, trips, df):
+        """
+        Features and predictions for every upcoming stop of every vehicle, as one batch. Each
+        (vehicle, stop) pair takes its vehicle's observed-motion features from df, the result of
+        this cycle's update().
+
+        Returns:
+        - pd.DataFrame: One row per pair with DATASET_COLUMNS (the next_stop_* columns describe
+          the pair's stop), 'stops_ahead' and 'prediction'
+        """
+        pairs = join_upcoming_stops(vehicles, trips, self.stops)
+        keys = pd.Index(df['bus_id'])
+        row = keys.get_indexer(pairs['bus_id']) if keys.is_unique else np.full(len(pairs['bus_id']), -1)
+        # Row -1 (a vehicle without a usable next stop) picks the NaN appended at the end
+        history = {col: np.append(df[col].to_numpy(dtype=np.float64), np.nan)[row] for col in HISTORY_COLUMNS}
+        upcoming = compute_features(pairs, float(vehicles['header_timestamp']), stops=self.stops, history=history)
+        upcoming['stops_ahead'] = pairs['stops_ahead']
+        upcoming['prediction'] = self.model.predict(feature_matrix(upcoming, self.model.features or FEATURE_COLUMNS))
+        return upcoming
+
+def score_payloads(scorer, vehicle_positions_pb, trip_updates_pb):
+    """
+    One poll cycle's CPU-bound work, run in a cpu_pool worker: decode both feeds, score them (and
+    every upcoming stop), index the vehicle positions and rows and serialize the predictions for
+    /get_predictions.
+
+    Returns:
+    - dict: 'df', 'bus_predictions', 'delta' and 'stats' as returned by update() (with the decode,
+      upcoming, index and serialize stages added to stats['seconds']), the 'upcoming' table of
+      score_upcoming(), 'feed_timestamp', the 'vehicles' and 'trips' entity counts,
+      'vehicle_grid', the SnapshotIndex as 'index' and 'predictions_json' (bytes)
+    """
+    started = time.perf_counter()
+    vehicles = decode_vehicle_positions(parse_feed(vehicle_positions_pb))
+    trips = decode_trip_updates(parse_feed(trip_updates_pb))
+    decoded = time.perf_counter()
+    df, bus_predictions, delta, stats = scorer.update(vehicles, trips)
+    scored = time.perf_counter()
+    upcoming = scorer.score_upcoming(vehicles, trips, df)
+    upcoming_scored = time.perf_counter()
+    vehicle_grid = GridIndex(df['current_lat'], df['current_lon'])
+    index = SnapshotIndex(df, bus_predictions, upcoming)
+    indexed = time.perf_counter()
+    predictions_json = dumps(bus_predictions)
+    stats['upcoming_rows'] = len(upcoming)
+    stats['seconds'] = {'decode': decoded - started, **stats['seconds'], 'upcoming': upcoming_scored - scored,
+                        'index': indexed - upcoming_scored, 'serialize': time.perf_counter() - indexed}
+    return {
+        'df': df,
+        'bus_predictions': bus_predictions,
+        'upcoming': upcoming,
+        'delta': delta,
+        'stats': stats,
+        'feed_timestamp': vehicles['header_timestamp'],
+        'vehicles': len(vehicles['entity_id']),
+        'trips': len(trips['trip_id']),
+        'vehicle_grid': vehicle_grid,
+        'index': index,
+        'predictions_json': predictions_json,
+    }
+
+# Scorers kept by a cpu_pool worker process between cycles, keyed by poller name
+_worker_scorers = {}
+
+def score_in_worker(name, setup, vehicle_positions_pb, trip_updates_pb):
+    """
+    score_payloads in a worker process, with the scorer kept in that process.
+
+    Parameters:
+    - name (str): The poller the scorer belongs to
+    - setup (dict): None, {'model'} to switch models, or {'model', 'stops'} to (re)create the scorer
+
+    Raises:
+    - LookupError: if this process has no scorer for `name` yet and `setup` can't create one
+    """
+    scorer = _worker_scorers.get(name)
+    setup = setup or {}
+    if 'stops' in setup:
+        scorer = _worker_scorers[name] = IncrementalScorer(setup['model'], setup['stops'])
+    elif scorer is None:
+        raise LookupError(f"No scorer for '{name}' in this worker.")
+    elif 'model' in setup:
+        scorer.reset(setup['model'])
+    return score_payloads(scorer, vehicle_positions_pb, trip_updates_pb)
@@ -1,78 +1,479 @@
-# api.py 
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
-import decision_tree_predict
-import uvicorn
-import sys
-import logging
-from pathlib import Path
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Initialize FastAPI app with default /docs and /redoc
-app = FastAPI(
-    title="Bus Prediction API",
-    description="API to fetch bus predictions and raw GTFS data using a Decision Tree model",
-    version="1.0.0",
-    docs_url="/docs",    # Swagger UI at /docs
-    redoc_url="/redoc",  # ReDoc at /redoc
-)
-
-# Load the HTML file using absolute path relative to this file
-BASE_DIR = Path(__file__).resolve().parent
-with open(BASE_DIR / "index.html", "r", encoding="utf-8") as f:
-    ROOT_HTML = f.read()
-
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    logger.info("Root endpoint accessed")
-    return HTMLResponse(content=ROOT_HTML)
-
-@app.get("/test")
-async def test():
-    logger.info("Test endpoint accessed")
-    return {"message": "Server is running"}
-
-@app.get("/get_predictions")
-async def get_predictions():
-    logger.info("Fetching predictions")
-    df = await decision_tree_predict.get_real_time_data()
-    if df is not None:
-        bus_predictions = decision_tree_predict.make_predictions(df)
-        logger.info("Predictions made")
-        return {"bus_predictions": bus_predictions}
-    logger.error("Failed to fetch real-time data")
-    return {"error": "Failed to fetch or process real-time data."}
-
-@app.get("/fetch_vehicle_positions")
-async def fetch_vehicle_positions():
-    logger.info("Fetching vehicle positions")
-    vehicle_positions_url = "https://drtonline.durhamregiontransit.com/gtfsrealtime/VehiclePositions"
-    vehicle_positions = await decision_tree_predict.fetch_and_convert(vehicle_positions_url)
-    if vehicle_positions is not None:
-        logger.info("Vehicle positions fetched")
-        return vehicle_positions
-    logger.error("Failed to fetch vehicle positions")
-    return {"error": "Failed to fetch vehicle positions data."}
-
-@app.get("/fetch_trip_updates")
-async def fetch_trip_updates():
-    logger.info("Fetching trip updates")
-    trip_updates_url = "https://drtonline.durhamregiontransit.com/gtfsrealtime/TripUpdates"
-    trip_updates = await decision_tree_predict.fetch_and_convert(trip_updates_url)
-    if trip_updates is not None:
-        logger.info("Trip updates fetched")
-        return trip_updates
-    logger.error("Failed to fetch trip updates")
-    return {"error": "Failed to fetch trip updates data."}
-
-if __name__ == "__main__":
-    port = 8000
-    if len(sys.argv) > 1:
-        try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print("Invalid port. Using default port 8000.")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+# api.py 
+from contextlib import asynccontextmanager
+import asyncio
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from agencies import registry
+from broadcast import snapshot_message, EVICTED
+from raw_feeds import choose_encoding, dumps, JSON_MEDIA_TYPE, PROTOBUF_MEDIA_TYPE
+from cpu_pool import cpu_pool, loop_lag
+from snapshot_index import parse_fields, DEFAULT_FIELDS, DEFAULT_ARRIVAL_FIELDS, DEFAULT_BUS_STOP_FIELDS, FIELDS, UPCOMING_FIELDS
+from batch_scoring import detect_format, score_file, FORMATS, MEDIA_TYPES
+from feed_archive import FeedArchive
+import decision_tree_predict
+import metrics
+import time
+import uvicorn
+import os
+import pickle
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import logging
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Token the /admin endpoints and /batch/predict require in the X-Admin-Token header (unset: they
+# are all disabled)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Largest upload /batch/predict accepts, in MiB (0 disables the endpoint)
+BATCH_MAX_UPLOAD_MB = float(os.environ.get("BATCH_MAX_UPLOAD_MB", "256"))
+
+# Batch uploads accepted at the same time, from the first byte uploaded to the last one scored;
+# more are turned away with a 429, so concurrent uploads can't pile up on disk
+batch_jobs = asyncio.Semaphore(int(os.environ.get("BATCH_MAX_JOBS", "1")))
+
+# Directory to archive every new pair of raw feed payloads in, one subdirectory per agency,
+# for later replay (unset: off)
+FEED_ARCHIVE_DIR = os.environ.get("FEED_ARCHIVE_DIR")
+feed_archives = {agency.agency_id: FeedArchive(Path(FEED_ARCHIVE_DIR) / agency.agency_id)
+                 for agency in registry} if FEED_ARCHIVE_DIR else {}
+
+@asynccontextmanager
+async def lifespan(app):
+    # Poll every agency's GTFS feeds in the background for the lifetime of the app
+    for agency_id, archive in feed_archives.items():
+        poller = registry.get(agency_id).poller
+        # Workers following a shared snapshot see the leader's payloads; only the leader archives them
+        poller.add_listener(lambda snapshot, poller=poller, archive=archive:
+                            poller.leading and archive.append_snapshot(snapshot))
+    registry.start()
+    loop_lag.start()
+    yield
+    await loop_lag.stop()
+    await registry.stop()
+    cpu_pool.shutdown()
+    await decision_tree_predict.close_client()
+    for archive in feed_archives.values():
+        await asyncio.to_thread(archive.close)
+
+# Initialize FastAPI app with default /docs and /redoc
+app = FastAPI(
+    title="Bus Prediction API",
+    description="API to fetch bus predictions and raw GTFS data using a Decision Tree model",
+    version="1.0.0",
+    docs_url="/docs",    # Swagger UI at /docs
+    redoc_url="/redoc",  # ReDoc at /redoc
+    lifespan=lifespan,
+)
+
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, agencies=registry.agencies)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def get_metrics():
+        """Prometheus scrape endpoint."""
+        # Staleness is relative to now, so it is measured at scrape time rather than per poll
+        for agency in registry:
+            snapshot = agency.poller.snapshot
+            if snapshot is not None and snapshot.feed_timestamp:
+                metrics.FEED_AGE.set(round(time.time() - snapshot.feed_timestamp, 3), agency.agency_id)
+        return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_KEEPALIVE_SECONDS = 15
+
+# Load the HTML file using absolute path relative to this file
+BASE_DIR = Path(__file__).resolve().parent
+with open(BASE_DIR / "index.html", "r", encoding="utf-8") as f:
+    ROOT_HTML = f.read()
+
+@app.get("/", response_class=HTMLResponse)
+async def root():
+    logger.info("Root endpoint accessed")
+    return HTMLResponse(content=ROOT_HTML)
+
+@app.get("/test")
+async def test():
+    logger.info("Test endpoint accessed")
+    return {"message": "Server is running", "event_loop_lag": loop_lag.describe(), "cpu_pool": cpu_pool.describe()}
+
+@app.get("/agencies")
+async def list_agencies():
+    """Agencies served by this deployment; each one's API lives under /agencies/{agency_id}."""
+    return {"default": registry.default_id, "agencies": [agency.describe() for agency in registry]}
+
+def get_agency(request: Request):
+    """The agency named in the path, or the default agency for the unprefixed routes."""
+    agency_id = request.path_params.get("agency_id")
+    agency = registry.get(agency_id)
+    if agency is None:
+        raise HTTPException(status_code=404, detail=f"Unknown agency '{agency_id}'.")
+    return agency
+
+# Per-agency endpoints, mounted both under /agencies/{agency_id} and, for the default agency,
+# at the top level
+router = APIRouter()
+
+def set_snapshot_headers(response, snapshot):
+    """Tell clients how old the data they are looking at is."""
+    response.headers["X-Snapshot-Age"] = f"{snapshot.age():.3f}"
+    response.headers["X-Feed-Timestamp"] = str(snapshot.feed_timestamp)
+
+@router.get("/get_predictions")
+async def get_predictions(agency=Depends(get_agency)):
+    logger.info("Fetching predictions")
+    snapshot = await agency.poller.get_snapshot()
+    if snapshot is not None:
+        # The predictions were serialized in the CPU pool; only the small tail is built here
+        tail = dumps({"feed_timestamp": snapshot.feed_timestamp, "snapshot_age_seconds": round(snapshot.age(), 3)})
+        response = Response(content=b'{"bus_predictions":' + snapshot.predictions_json + b',' + tail[1:],
+                            media_type=JSON_MEDIA_TYPE)
+        set_snapshot_headers(response, snapshot)
+        return response
+    logger.error("Failed to fetch real-time data")
+    return {"error": "Failed to fetch or process real-time data."}
+
+async def raw_feed_response(request, agency, fmt, attribute, name):
+    """
+    Serve one raw feed from the current snapshot as pre-serialized JSON or the original protobuf,
+    compressed when the client accepts it and answered with a 304 when its ETag still matches.
+    """
+    snapshot = await agency.poller.get_snapshot()
+    if snapshot is None:
+        logger.error(f"Failed to fetch {name}")
+        return {"error": f"Failed to fetch {name} data."}
+
+    feed = getattr(snapshot, attribute)
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    headers = {"ETag": feed.etag(fmt, encoding), "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if feed.matches(request.headers.get("if-none-match"), fmt):
+        metrics.CACHE.inc('etag', 'hit')
+        response = Response(status_code=304, headers=headers)
+    else:
+        metrics.CACHE.inc('etag', 'miss')
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        body = await feed.body(fmt, encoding)
+        media_type = PROTOBUF_MEDIA_TYPE if fmt == "pb" else JSON_MEDIA_TYPE
+        response = Response(content=body, media_type=media_type, headers=headers)
+    set_snapshot_headers(response, snapshot)
+    return response
+
+@router.get("/fetch_vehicle_positions")
+async def fetch_vehicle_positions(request: Request, format: str = Query("json", pattern="^(json|pb)$"),
+                                  agency=Depends(get_agency)):
+    logger.info("Fetching vehicle positions")
+    return await raw_feed_response(request, agency, format, "vehicle_positions_feed", "vehicle positions")
+
+@router.get("/fetch_trip_updates")
+async def fetch_trip_updates(request: Request, format: str = Query("json", pattern="^(json|pb)$"),
+                             agency=Depends(get_agency)):
+    logger.info("Fetching trip updates")
+    return await raw_feed_response(request, agency, format, "trip_updates_feed", "trip updates")
+
+@router.get("/stops/nearest")
+async def nearest_stops(
+    lat: float | None = None,
+    lon: float | None = None,
+    bus_id: str | None = None,
+    limit: int = Query(5, ge=1, le=100),
+    agency=Depends(get_agency),
+):
+    """Closest stops to a coordinate, or to a bus's current position when bus_id is given."""
+    if bus_id is not None:
+        snapshot = await agency.poller.get_snapshot()
+        if snapshot is None or snapshot.df.empty:
+            raise HTTPException(status_code=503, detail="No vehicle data available.")
+        match = (snapshot.df['bus_id'] == bus_id).to_numpy().nonzero()[0]
+        if len(match) == 0:
+            raise HTTPException(status_code=404, detail=f"Bus {bus_id} not found.")
+        lat = float(snapshot.df['current_lat'].iat[match[0]])
+        lon = float(snapshot.df['current_lon'].iat[match[0]])
+    elif lat is None or lon is None:
+        raise HTTPException(status_code=422, detail="Provide either lat and lon, or bus_id.")
+    return {"stops": agency.stops.nearest(lat, lon, limit)}
+
+@router.get("/buses/near")
+async def buses_near(lat: float, lon: float, radius_m: float = Query(500.0, gt=0, le=20000),
+                     agency=Depends(get_agency)):
+    """Buses in the current snapshot within radius_m of a coordinate, nearest first."""
+    snapshot = await agency.poller.get_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="No vehicle data available.")
+    indices, distances = snapshot.vehicle_grid.within(lat, lon, radius_m)
+    df = snapshot.df
+    buses = [
+        {
+            "bus_id": df['bus_id'].iat[i],
+            "route_id": df['route_id'].iat[i],
+            "current_lat": float(df['current_lat'].iat[i]),
+            "current_lon": float(df['current_lon'].iat[i]),
+            "distance_meters": float(d),
+            "prediction": snapshot.bus_predictions.get(df['bus_id'].iat[i]),
+        }
+        for i, d in zip(indices, distances)
+    ]
+    return {"buses": buses}
+
+def select_fields(fields, default=DEFAULT_FIELDS, allowed=FIELDS):
+    """The record fields a client asked for with ?fields=a,b,c."""
+    try:
+        return parse_fields(fields, default, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def current_snapshot(agency):
+    snapshot = await agency.poller.get_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="No vehicle data available.")
+    return snapshot
+
+def indexed_response(snapshot, body):
+    body["feed_timestamp"] = snapshot.feed_timestamp
+    response = Response(content=dumps(body), media_type=JSON_MEDIA_TYPE)
+    set_snapshot_headers(response, snapshot)
+    return response
+
+@router.get("/routes/{route_id}/predictions")
+async def route_predictions(route_id: str, fields: str | None = None, offset: int = Query(0, ge=0),
+                            limit: int = Query(100, ge=1, le=1000), agency=Depends(get_agency)):
+    """Predictions for the buses currently on a route, by bus_id, one page at a time."""
+    fields = select_fields(fields)
+    snapshot = await current_snapshot(agency)
+    index = snapshot.index
+    page = index.page(index.route_rows(route_id), fields, offset, limit, key="predictions")
+    return indexed_response(snapshot, {"route_id": route_id, **page})
+
+@router.get("/stops/{stop_id}/arrivals")
+async def stop_arrivals(stop_id: str, fields: str | None = None, offset: int = Query(0, ge=0),
+                        limit: int = Query(100, ge=1, le=1000), agency=Depends(get_agency)):
+    """
+    Buses due at stop_id, whether it is their next stop or one further along their trip (see
+    stops_ahead), soonest expected arrival first, one page at a time.
+    """
+    position = agency.stops.position(stop_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail=f"Stop {stop_id} not found.")
+    fields = select_fields(fields, DEFAULT_ARRIVAL_FIELDS, UPCOMING_FIELDS)
+    snapshot = await current_snapshot(agency)
+    index = snapshot.index
+    page = index.page(index.stop_rows(stop_id), fields, offset, limit, key="arrivals", upcoming=True)
+    return indexed_response(snapshot, {"stop": agency.stops.record(position), **page})
+
+@router.get("/buses/{bus_id}")
+async def bus_record(bus_id: str, fields: str | None = None, agency=Depends(get_agency)):
+    """Everything the current snapshot knows about one bus (or just `fields`), with its prediction."""
+    fields = select_fields(fields, FIELDS)
+    snapshot = await current_snapshot(agency)
+    row = snapshot.index.bus_row(bus_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Bus {bus_id} not found.")
+    return indexed_response(snapshot, {"bus": snapshot.index.records([row], fields)[0]})
+
+@router.get("/buses/{bus_id}/stops")
+async def bus_stops(bus_id: str, fields: str | None = None, offset: int = Query(0, ge=0),
+                    limit: int = Query(100, ge=1, le=1000), agency=Depends(get_agency)):
+    """Arrival predictions for every stop still ahead of a bus on its trip, in trip order."""
+    fields = select_fields(fields, DEFAULT_BUS_STOP_FIELDS, UPCOMING_FIELDS)
+    snapshot = await current_snapshot(agency)
+    index = snapshot.index
+    rows = index.bus_stop_rows(bus_id)
+    if len(rows) == 0 and index.bus_row(bus_id) is None:
+        raise HTTPException(status_code=404, detail=f"Bus {bus_id} not found.")
+    page = index.page(rows, fields, offset, limit, key="stops", upcoming=True)
+    return indexed_response(snapshot, {"bus_id": bus_id, **page})
+
+@router.get("/stream/predictions")
+async def stream_predictions(request: Request, agency=Depends(get_agency)):
+    """Server-Sent Events: a full snapshot on connect, then the buses whose prediction changed on every feed update."""
+    broadcaster = agency.broadcaster
+    queue = broadcaster.subscribe()
+    snapshot = await agency.poller.get_snapshot()
+    # Deltas published up to this snapshot are already part of it
+    seen_until = snapshot.created_at if snapshot is not None else 0.0
+
+    async def events():
+        try:
+            if snapshot is not None:
+                yield snapshot_message(snapshot).sse
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is EVICTED:
+                    yield message.sse
+                    break
+                if message.created_at > seen_until:
+                    yield message.sse
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def require_admin(request: Request):
+    """Reject admin calls unless ADMIN_TOKEN is set and the request carries it."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them.")
+    if not secrets.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+@router.post("/batch/predict", dependencies=[Depends(require_admin)])
+async def batch_predict(request: Request, format: str = Query(None, pattern=f"^({'|'.join(FORMATS)})$"),
+                        output_format: str = Query(None, pattern=f"^({'|'.join(FORMATS)})$"),
+                        keep: list[str] = Query(None), version: str = None, agency=Depends(get_agency)):
+    """
+    Score an uploaded batch of dataset rows (Parquet, Arrow IPC or NDJSON request body) with the
+    serving model, or a given bundle version, and return the rows with a predicted_status column
+    in the same format. The upload is spooled to disk and scored in chunks (see batch_scoring.py).
+    Needs the admin token.
+    """
+    if BATCH_MAX_UPLOAD_MB <= 0:
+        raise HTTPException(status_code=403, detail="Batch scoring is disabled; set BATCH_MAX_UPLOAD_MB to enable it.")
+    limit = BATCH_MAX_UPLOAD_MB * 2**20
+    too_large = HTTPException(status_code=413, detail=f"Batch uploads are limited to {BATCH_MAX_UPLOAD_MB:g} MiB.")
+    if int(request.headers.get("content-length") or 0) > limit:
+        raise too_large
+    try:
+        fmt = format or detect_format(media_type=request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    model = agency.models.active.model
+    if version is not None:
+        try:
+            model = (await agency.models.load(version)).model
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=f"Model bundle not found: {e}")
+        except (ValueError, pickle.UnpicklingError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    # Take a slot before reading any of the body; acquiring a free slot doesn't yield, so no
+    # other request can take it in between
+    if batch_jobs.locked():
+        raise HTTPException(status_code=429, detail="Another batch is being scored; try again later.",
+                            headers={"Retry-After": "30"})
+    workdir = Path(tempfile.mkdtemp(prefix="batch-"))
+    cleanup = BackgroundTask(shutil.rmtree, workdir, ignore_errors=True)
+    source, destination = workdir / f"input.{fmt}", workdir / f"predictions.{output_format or fmt}"
+    cancel = threading.Event()
+    try:
+        async with batch_jobs:
+            size = 0
+            with open(source, "wb") as f:
+                async for chunk in request.stream():
+                    size += len(chunk)
+                    if size > limit:
+                        raise too_large
+                    f.write(chunk)
+            stats = await asyncio.to_thread(score_file, source, destination, model, fmt, output_format, keep,
+                                            cancel=cancel)
+    except asyncio.CancelledError:
+        cancel.set()  # The worker thread stops at the next chunk
+        await cleanup()
+        raise
+    except ValueError as e:
+        await cleanup()
+        raise HTTPException(status_code=422, detail=f"Could not score the batch: {e}")
+    except BaseException:
+        await cleanup()
+        raise
+    logger.info(f"Scored a batch of {stats['rows']} rows in {stats['seconds']:.2f}s.")
+    return FileResponse(destination, media_type=MEDIA_TYPES[output_format or fmt], background=cleanup,
+                        headers={"X-Batch-Rows": str(stats['rows']), "X-Batch-Seconds": str(stats['seconds'])})
+
+async def model_action(action):
+    """Run a model registry call, reporting a bundle that is missing or fails validation as a 4xx."""
+    try:
+        await action
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Model bundle not found: {e}")
+    except (ValueError, pickle.UnpicklingError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/admin/model", dependencies=[Depends(require_admin)])
+async def get_model(agency=Depends(get_agency)):
+    """The serving, previous and shadowed models (with shadow agreement so far) and the available versions."""
+    return agency.models.describe()
+
+@router.post("/admin/model/activate", dependencies=[Depends(require_admin)])
+async def activate_model(version: str, agency=Depends(get_agency)):
+    """Load, validate and serve a model version ('.' for the model directory's top-level files)."""
+    await model_action(agency.models.activate(version))
+    return agency.models.describe()
+
+@router.post("/admin/model/rollback", dependencies=[Depends(require_admin)])
+async def rollback_model(agency=Depends(get_agency)):
+    """Serve the previously active model again."""
+    await model_action(agency.models.rollback())
+    return agency.models.describe()
+
+@router.post("/admin/model/shadow", dependencies=[Depends(require_admin)])
+async def shadow_model(version: str, agency=Depends(get_agency)):
+    """Score live snapshots with a model version alongside the serving model, without serving it."""
+    await model_action(agency.models.start_shadow(version))
+    return agency.models.describe()
+
+@router.delete("/admin/model/shadow", dependencies=[Depends(require_admin)])
+async def stop_shadow_model(agency=Depends(get_agency)):
+    agency.models.stop_shadow()
+    return agency.models.describe()
+
+@router.post("/admin/model/promote", dependencies=[Depends(require_admin)])
+async def promote_model(agency=Depends(get_agency)):
+    """Serve the shadowed model."""
+    await model_action(agency.models.promote())
+    return agency.models.describe()
+
+@router.websocket("/ws/predictions")
+async def websocket_predictions(websocket: WebSocket):
+    """WebSocket: a full snapshot on connect, then the buses whose prediction changed on every feed update."""
+    agency = registry.get(websocket.path_params.get("agency_id"))
+    if agency is None:
+        await websocket.close(code=1008)  # Policy violation: unknown agency
+        return
+    await websocket.accept()
+    broadcaster = agency.broadcaster
+    queue = broadcaster.subscribe()
+    try:
+        snapshot = await agency.poller.get_snapshot()
+        seen_until = 0.0
+        if snapshot is not None:
+            await websocket.send_text(snapshot_message(snapshot).data)
+            # Deltas published up to this snapshot are already part of it
+            seen_until = snapshot.created_at
+        while True:
+            message = await queue.get()
+            if message is EVICTED:
+                await websocket.send_text(message.data)
+                await websocket.close(code=1013)  # Try again later
+                break
+            if message.created_at > seen_until:
+                await websocket.send_text(message.data)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcaster.unsubscribe(queue)
+
+app.include_router(router, prefix="/agencies/{agency_id}")
+app.include_router(router)
+
+if __name__ == "__main__":
+    port = 8000
+    if len(sys.argv) > 1:
+        try:
+            port = int(sys.argv[1])
+        except ValueError:
+            print("Invalid port. Using default port 8000.")
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,195 @@
+# metrics.py
+# In-process metrics in the Prometheus text format, with no client library: counters, gauges
+# and fixed-bucket histograms keyed by label values, plus an ASGI middleware timing every
+# request by route. main.py serves them at /metrics.
+#
+# Recording a sample is a dict lookup and a few additions, so the pipeline can be instrumented
+# per stage. With METRICS_ENABLED=0 (or disable() before anything is recorded, as the
+# benchmarks do) every recording call returns immediately and /metrics is not mounted.
+
+import bisect
+import os
+import time
+from contextlib import contextmanager
+
+# Collect metrics and serve /metrics (override with the METRICS_ENABLED env var)
+ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# Latency buckets in seconds, from sub-millisecond pipeline stages to slow upstream fetches
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+
+def disable():
+    """Turn every recording call into a no-op (for benchmarks)."""
+    global ENABLED
+    ENABLED = False
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_label_text(self.label_names, key)} {_number(value)}")
+        return lines
+
+class Counter(Metric):
+    """A monotonically increasing count, e.g. requests or bytes."""
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if ENABLED:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. vehicles in the latest snapshot."""
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        if ENABLED:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        state = self.values.get(labels)
+        if state is None:
+            # Per-bucket (not yet cumulative) counts, the +Inf bucket, then the sum
+            state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of the with-block, in seconds."""
+        if not ENABLED:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, key)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, key)} {cumulative}")
+        return lines
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Pipeline ---
+STAGE_SECONDS = Histogram(
+    "bus_pipeline_stage_seconds",
+    "Time spent in each stage of a poll cycle: fetch, then decode, join (incl. stop lookup), history, "
+    "features, predict and serialize inside the CPU pool, and cpu_pool for all of those plus queueing.",
+    ["agency", "stage"])
+POLLS = Counter("bus_polls_total", "Poll cycles by outcome (published, unchanged, busy, failed, followed).", ["agency", "result"])
+ROWS_PROCESSED = Counter("bus_rows_processed_total", "Vehicle rows scored across all poll cycles.", ["agency"])
+SNAPSHOT_SIZE = Gauge("bus_snapshot_size", "Entities in the latest snapshot (vehicles, trips, predictions).",
+                      ["agency", "kind"])
+FEED_AGE = Gauge("bus_feed_age_seconds", "Seconds since the feed header timestamp of the latest snapshot.",
+                 ["agency"])
+REUSED = Counter("bus_incremental_reused_total",
+                 "Rows whose features or predictions were reused from the previous snapshot.", ["agency", "kind"])
+
+# --- CPU pool ---
+CPU_POOL_PENDING = Gauge("bus_cpu_pool_pending", "Tasks queued or running in the CPU pool.")
+CPU_POOL_REJECTED = Counter("bus_cpu_pool_rejected_total", "Tasks turned away because the CPU pool queue was full.")
+LOOP_LAG_SECONDS = Histogram("bus_event_loop_lag_seconds",
+                             "How late the event loop woke up from a timed sleep; requests wait this long too.")
+
+# --- Upstream ---
+# Labelled by host, never by URL: feed URLs can carry API keys in their query string
+FETCHES = Counter("bus_feed_fetches_total", "Upstream feed requests by result (ok, not_modified, timeout, error).",
+                  ["agency", "host", "result"])
+FETCH_BYTES = Counter("bus_feed_fetch_bytes_total", "Bytes of feed payload received from upstream.",
+                      ["agency", "host"])
+
+# --- Serving ---
+REQUEST_SECONDS = Histogram("bus_http_request_seconds", "Time to produce an HTTP response, by route.",
+                            ["method", "route", "agency", "status"])
+CACHE = Counter("bus_cache_requests_total", "Cache lookups by cache and result (hit, miss).", ["cache", "result"])
+BODY_BUILD_SECONDS = Histogram("bus_feed_body_build_seconds",
+                               "Time to serialize (protobuf_to_json) or compress a raw feed body.",
+                               ["format", "encoding"])
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. Requests are labelled by route template rather
+    than raw path, so /agencies/{agency_id}/... and the unprefixed routes share one template
+    and the agency gets its own label ("" for the unprefixed routes). Agency ids not in
+    `agencies` are labelled "unknown" so clients can't create label values at will.
+    """
+
+    def __init__(self, app, agencies=()):
+        self.app = app
+        self.agencies = agencies
+
+    def _observe(self, scope, started, status):
+        route = getattr(scope.get("route"), "path", "unmatched")
+        agency = scope.get("path_params", {}).get("agency_id", "")
+        if agency and agency not in self.agencies:
+            agency = "unknown"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], route, agency, status)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                self._observe(scope, started, message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            self._observe(scope, started, 500)
+            raise
@@ -0,0 +1,321 @@
+# model_registry.py
+# Model hot-swapping for a running server. Every agency has a ModelRegistry over its model
+# directory: the top-level scaler.pkl/decision_tree_model.pkl plus the versioned bundles that
+# train_decision_tree.py writes into subdirectories.
+#
+# Bundles are unpickled and validated in a worker thread, checked against the columns the
+# feature pipeline produces, and then swapped into the agency's poller between two poll cycles.
+# A bundle can first run in shadow, scored on every live snapshot next to the serving model (in
+# the poller's CPU pool, off the event loop), so its agreement with the live predictions is
+# known before it is promoted.
+#
+# The model directory's CURRENT file names the bundle to serve. Activating a bundle rewrites it,
+# and every registry watches it, so all workers serving the directory follow the same model.
+
+import asyncio
+import json
+import logging
+import os
+import pickle
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from artifact_cache import load_or_build
+from cpu_pool import PoolBusy
+from fast_tree import CompiledTree
+from features import DATASET_COLUMNS, FEATURE_COLUMNS, classify_status, feature_matrix
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of each model directory's CURRENT file (0 disables watching)
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "30"))
+
+# Pointer file naming the bundle to serve, relative to the model directory
+CURRENT_FILE = "CURRENT"
+
+# The top-level model files of a model directory, as opposed to one of its bundles
+ROOT_VERSION = "."
+
+# Labels the feature pipeline assigns, and so the only ones a model may predict
+STATUS_LABELS = set(classify_status([-3600, 0, 3600]))
+
+@dataclass
+class ModelBundle:
+    """A loaded, compiled model and what its manifest says about it."""
+    version: str
+    path: Path
+    model: CompiledTree
+    manifest: dict = field(default_factory=dict)
+    loaded_at: float = 0.0
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "features": self.model.features or FEATURE_COLUMNS,
+            "classes": [str(c) for c in self.model.classes],
+            "created_at": self.manifest.get("created_at"),
+            "loaded_at": self.loaded_at,
+        }
+
+def bundle_path(model_dir, version):
+    """Directory of a bundle inside model_dir; versions are plain directory names, never paths."""
+    if version == ROOT_VERSION:
+        return Path(model_dir)
+    if not version or version != Path(version).name or version.startswith("."):
+        raise ValueError(f"Invalid model version '{version}'.")
+    return Path(model_dir) / version
+
+def current_version(model_dir):
+    """The version CURRENT points at, or the top-level model files when there is no CURRENT file."""
+    try:
+        version = (Path(model_dir) / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return ROOT_VERSION
+    return version or ROOT_VERSION
+
+def set_current_version(model_dir, version):
+    """Point CURRENT at a version, atomically."""
+    path = Path(model_dir) / CURRENT_FILE
+    tmp = path.with_name(f".{CURRENT_FILE}.tmp")
+    tmp.write_text(f"{version}\n", encoding="utf-8")
+    os.replace(tmp, path)
+
+def list_versions(model_dir):
+    """Bundles in model_dir, oldest first (bundle versions are UTC timestamps)."""
+    return sorted(path.name for path in Path(model_dir).iterdir()
+                  if path.is_dir() and not path.name.startswith(".") and (path / "decision_tree_model.pkl").exists())
+
+def compile_bundle(path):
+    """Unpickle a bundle's scaler and tree and compile them, as (arrays, info) for the artifact cache."""
+    with open(path / "scaler.pkl", "rb") as file:
+        scaler = pickle.load(file)
+    with open(path / "decision_tree_model.pkl", "rb") as file:
+        dt_model = pickle.load(file)
+    if scaler.n_features_in_ != dt_model.n_features_in_:
+        raise ValueError(f"Scaler expects {scaler.n_features_in_} features but the model expects "
+                         f"{dt_model.n_features_in_}.")
+    return CompiledTree.from_sklearn(dt_model, scaler).to_arrays()
+
+def load_bundle(model_dir, version=ROOT_VERSION):
+    """
+    Load one bundle's compiled tree, from the artifact cache unless its pickles have changed.
+    Blocking (file I/O, and unpickling on a cache miss): run it in a worker thread from the
+    event loop.
+    """
+    path = bundle_path(model_dir, version)
+    manifest = {}
+    if (path / "manifest.json").exists():
+        with open(path / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    arrays, info = load_or_build('model', [path / "decision_tree_model.pkl", path / "scaler.pkl"],
+                                 lambda: compile_bundle(path))
+    model = CompiledTree.from_arrays(arrays, info)
+    if manifest:
+        model.features = [feature['name'] for feature in manifest['features']]
+    return ModelBundle(version=version, path=path, model=model, manifest=manifest, loaded_at=time.time())
+
+def validate_bundle(bundle, sample=None):
+    """
+    Check that a bundle fits the live feature pipeline: every input it names is a column the
+    pipeline produces, it takes as many inputs as it names, and it only predicts known labels.
+    With a sample dataset (e.g. the current snapshot), also predict it end to end.
+    """
+    features = bundle.model.features or FEATURE_COLUMNS
+    unknown = [col for col in features if col not in DATASET_COLUMNS]
+    if unknown:
+        raise ValueError(f"Model {bundle.version} needs columns the feature pipeline does not produce: {unknown}")
+    if len(features) != bundle.model.n_features:
+        raise ValueError(f"Model {bundle.version} takes {bundle.model.n_features} features but its manifest "
+                         f"names {len(features)}.")
+    labels = set(str(c) for c in bundle.model.classes)
+    if not labels <= STATUS_LABELS:
+        raise ValueError(f"Model {bundle.version} predicts unknown labels: {sorted(labels - STATUS_LABELS)}")
+    if sample is not None and len(sample):
+        bundle.model.predict(feature_matrix(sample, features))
+
+def shadow_predictions(model, df, bus_predictions):
+    """(live, shadow, status) labels for every row of a snapshot. Runs in the CPU pool."""
+    live = df['bus_id'].map(bus_predictions).to_numpy(dtype=object)
+    predicted = model.predict(feature_matrix(df, model.features or FEATURE_COLUMNS)).astype(object)
+    return live, predicted, df['status'].to_numpy(dtype=object)
+
+class ShadowStats:
+    """Running agreement between a shadowed model and the serving one on live snapshots."""
+
+    def __init__(self):
+        self.snapshots = 0
+        self.rows = 0
+        self.agreed = 0
+        self.live_correct = 0
+        self.shadow_correct = 0
+        self.disagreements = {}
+
+    def add(self, live, shadow, status):
+        self.snapshots += 1
+        self.rows += len(live)
+        self.agreed += int(np.count_nonzero(live == shadow))
+        self.live_correct += int(np.count_nonzero(live == status))
+        self.shadow_correct += int(np.count_nonzero(shadow == status))
+        for a, b in zip(live[live != shadow], shadow[live != shadow]):
+            key = f"{a}->{b}"
+            self.disagreements[key] = self.disagreements.get(key, 0) + 1
+
+    def describe(self):
+        return {
+            "snapshots": self.snapshots,
+            "rows": self.rows,
+            "agreement": self.agreed / self.rows if self.rows else None,
+            # Against the status label computed from the feed, as in the training data
+            "live_accuracy": self.live_correct / self.rows if self.rows else None,
+            "shadow_accuracy": self.shadow_correct / self.rows if self.rows else None,
+            "disagreements": self.disagreements,
+        }
+
+class ModelRegistry:
+    """
+    The serving and shadow models of one agency's poller, and the versions available to swap in.
+
+    A swap is picked up by the poller when its next cycle starts, so a poll cycle always runs
+    on exactly one model even while it is being scored in the CPU pool.
+    """
+
+    def __init__(self, model_dir, poller, active, name="default"):
+        self.model_dir = Path(model_dir)
+        self.poller = poller
+        self.name = name
+        self.active = active
+        self.previous = None
+        self.shadow = None
+        self.shadow_stats = None
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._shadow_task = None
+        poller.add_listener(self._score_shadow)
+
+    async def load(self, version):
+        """Load and validate a version in a worker thread, without touching the serving model."""
+        bundle = await asyncio.to_thread(load_bundle, self.model_dir, version)
+        snapshot = self.poller.snapshot
+        await asyncio.to_thread(validate_bundle, bundle, snapshot.df if snapshot is not None else None)
+        return bundle
+
+    def swap(self, bundle):
+        """Serve a loaded, validated bundle from the next poll cycle on."""
+        self.previous, self.active = self.active, bundle
+        self.poller.swap_model(bundle.model)
+        logger.info(f"[{self.name}] Now serving model {bundle.version}.")
+
+    async def activate(self, version, persist=True):
+        """
+        Load, validate and start serving a version. With persist, CURRENT is pointed at it too,
+        so the other workers serving this model directory follow.
+        """
+        async with self._lock:
+            bundle = await self.load(version)
+            if persist:
+                await asyncio.to_thread(set_current_version, self.model_dir, version)
+            self.swap(bundle)
+            if self.shadow is not None and self.shadow.version == version:
+                self.shadow = self.shadow_stats = None
+        # Publish the new model's predictions now rather than on the next feed change
+        try:
+            await self.poller.refresh()
+        except Exception as e:
+            logger.error(f"[{self.name}] Poll after the model swap failed: {e}")
+        return bundle
+
+    async def rollback(self):
+        """Serve the previously active model again."""
+        if self.previous is None:
+            raise ValueError("There is no previous model to roll back to.")
+        return await self.activate(self.previous.version)
+
+    async def start_shadow(self, version):
+        """Score every live snapshot with a version too, and track its agreement with the serving model."""
+        async with self._lock:
+            bundle = await self.load(version)
+            self.shadow, self.shadow_stats = bundle, ShadowStats()
+        logger.info(f"[{self.name}] Shadowing model {bundle.version}.")
+        snapshot = self.poller.snapshot
+        if snapshot is not None:
+            self._score_shadow(snapshot)
+        return bundle
+
+    def stop_shadow(self):
+        self.shadow = self.shadow_stats = None
+
+    async def promote(self):
+        """Serve the shadowed model."""
+        if self.shadow is None:
+            raise ValueError("No model is being shadowed.")
+        return await self.activate(self.shadow.version)
+
+    def _score_shadow(self, snapshot):
+        """Poller listener: predict the published snapshot with the shadow model as well."""
+        if self.shadow is None or snapshot.df.empty:
+            return
+        if self._shadow_task is not None and not self._shadow_task.done():
+            # Still scoring an earlier snapshot; skip this one rather than queue up behind it
+            return
+        self._shadow_task = asyncio.ensure_future(self._run_shadow(snapshot, self.shadow, self.shadow_stats))
+
+    async def _run_shadow(self, snapshot, shadow, stats):
+        try:
+            live, predicted, status = await self.poller.pool.run(
+                shadow_predictions, shadow.model, snapshot.df, snapshot.bus_predictions)
+        except PoolBusy:
+            logger.warning(f"[{self.name}] CPU pool busy; not shadow scoring this snapshot.")
+            return
+        except Exception as e:
+            logger.error(f"[{self.name}] Shadow scoring with model {shadow.version} failed: {e}")
+            return
+        # The shadow may have been stopped, promoted or replaced while this snapshot was scored
+        if self.shadow_stats is stats:
+            stats.add(live, predicted, status)
+
+    def describe(self):
+        return {
+            "model_dir": str(self.model_dir),
+            "current": current_version(self.model_dir),
+            "active": self.active.describe(),
+            "previous": self.previous.describe() if self.previous is not None else None,
+            "shadow": dict(self.shadow.describe(), stats=self.shadow_stats.describe())
+                      if self.shadow is not None else None,
+            "versions": list_versions(self.model_dir),
+        }
+
+    async def _watch(self, interval):
+        rejected = None
+        while True:
+            await asyncio.sleep(interval)
+            version = None
+            try:
+                version = await asyncio.to_thread(current_version, self.model_dir)
+                if version not in (self.active.version, rejected):
+                    logger.info(f"[{self.name}] {CURRENT_FILE} now points at {version}; loading it.")
+                    await self.activate(version, persist=False)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Don't retry a broken bundle every interval; a new CURRENT gets a fresh attempt
+                rejected = version
+                logger.error(f"[{self.name}] Failed to load the model named by {CURRENT_FILE}; "
+                             f"still serving {self.active.version}: {e}")
+
+    def start(self, interval=MODEL_WATCH_INTERVAL):
+        """Follow changes to CURRENT from a background task."""
+        if self._task is None and interval > 0:
+            self._task = asyncio.create_task(self._watch(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,293 @@
+# poller.py
+# Background GTFS-Realtime poller. Fetches the feeds on a fixed interval, runs the
+# model once per cycle and publishes the result as an immutable snapshot that
+# every API request reads from. There is one poller per agency (see agencies.py).
+# Decoding and scoring run in the CPU pool (cpu_pool.py), off the event loop. With a shared
+# snapshot (shared_snapshot.py) only the leading process polls; the others follow its snapshots.
+
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, replace
+
+import pandas as pd
+
+import decision_tree_predict
+import metrics
+from cpu_pool import PoolBusy, cpu_pool
+from incremental import IncrementalScorer, empty_delta, score_in_worker, score_payloads
+from raw_feeds import EncodedFeed
+from snapshot_index import SnapshotIndex
+from stops_index import GridIndex, stops_index
+
+logger = logging.getLogger(__name__)
+
+# Seconds between upstream polls (override with the PREDICTION_POLL_INTERVAL env var)
+POLL_INTERVAL = float(os.environ.get("PREDICTION_POLL_INTERVAL", "15"))
+
+# Random extra delay per cycle, as a fraction of the interval, so pollers drift apart
+POLL_JITTER = 0.1
+
+# Upper bound in seconds on the delay between polls after consecutive failures
+MAX_BACKOFF = 300.0
+
+
+@dataclass(frozen=True)
+class PredictionSnapshot:
+    """One poll cycle's worth of feed data and predictions. Treat every field as read-only."""
+    df: pd.DataFrame
+    bus_predictions: dict
+    upcoming: pd.DataFrame
+    predictions_json: bytes
+    vehicle_positions_pb: bytes
+    trip_updates_pb: bytes
+    vehicle_positions_feed: EncodedFeed
+    trip_updates_feed: EncodedFeed
+    vehicle_grid: GridIndex
+    index: SnapshotIndex
+    delta: dict
+    feed_timestamp: int
+    created_at: float
+
+    def age(self):
+        """Seconds since this snapshot was published."""
+        return time.time() - self.created_at
+
+
+class PredictionPoller:
+    """
+    Keeps the latest PredictionSnapshot fresh from a background task.
+
+    fetch is an async callable returning a (vehicle_positions_pb, trip_updates_pb) pair; by
+    default the feeds configured in decision_tree_predict. After a failed cycle the next poll
+    backs off exponentially, up to max_backoff seconds. Each cycle is scored in `pool`.
+    With a SharedSnapshot, the poller publishes into it while it leads and otherwise serves the
+    leader's snapshots instead of polling.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, model=None, stops=stops_index, fetch=None, name="default",
+                 jitter=POLL_JITTER, max_backoff=MAX_BACKOFF, pool=None, shared=None):
+        self.interval = interval
+        self.name = name
+        self.fetch = fetch or decision_tree_predict.fetch_payloads
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.snapshot = None
+        self._inflight = None
+        self._task = None
+        self.pool = pool or cpu_pool
+        self.shared = shared
+        self._shared_version = 0
+        # With a process pool the worker keeps its own copy; this one supplies its model and stops
+        self.scorer = IncrementalScorer(model or decision_tree_predict.fast_model, stops)
+        self._pending_model = None
+        self._rescore = False
+        self.listeners = []
+
+    @property
+    def leading(self):
+        """True if this process polls upstream: there is no shared snapshot, or it leads it."""
+        return self.shared is None or self.shared.leader
+
+    def add_listener(self, callback):
+        """Call callback(snapshot) whenever a snapshot with new data is published."""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def _notify(self, snapshot):
+        for callback in self.listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Snapshot listener failed: {e}")
+
+    def swap_model(self, model):
+        """Score with a different model from the next poll cycle on, even if the feeds are unchanged."""
+        # Applied when the next cycle starts, never while a worker is scoring with the old model
+        self._pending_model = model
+        self._rescore = True
+
+    async def _score(self, vehicle_positions_pb, trip_updates_pb):
+        """Decode and score one pair of payloads in the CPU pool (see incremental.score_payloads)."""
+        model = self._pending_model
+        if model is not None:
+            self.scorer.reset(model)
+        if self.pool.kind != "process":
+            result = await self.pool.run(score_payloads, self.scorer, vehicle_positions_pb, trip_updates_pb)
+        else:
+            try:
+                setup = {'model': model} if model is not None else None
+                result = await self.pool.run(score_in_worker, self.name, setup,
+                                             vehicle_positions_pb, trip_updates_pb, key=self.name)
+            except LookupError:
+                # A new (or restarted) worker: hand it the stops and model; its position history starts empty
+                setup = {'model': self.scorer.model, 'stops': self.scorer.stops}
+                result = await self.pool.run(score_in_worker, self.name, setup,
+                                             vehicle_positions_pb, trip_updates_pb, key=self.name)
+        # A swap requested while this cycle was scoring waits for the next one
+        if self._pending_model is model:
+            self._pending_model = None
+        return result
+
+    async def get_snapshot(self):
+        """Return the current snapshot, polling once if nothing has been published yet."""
+        if self.snapshot is None:
+            return await self.refresh()
+        return self.snapshot
+
+    async def refresh(self):
+        """
+        Run one poll cycle and return the resulting snapshot (as a follower, load the leader's latest).
+        Concurrent callers share a single in-flight cycle instead of each hitting upstream.
+        """
+        if self._inflight is None:
+            leading = self.shared is None or self.shared.lead()
+            self._inflight = asyncio.ensure_future(self._poll_once() if leading else self._follow())
+            self._inflight.add_done_callback(self._clear_inflight)
+        # Shield so a disconnecting client can't cancel the cycle other callers are waiting on
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, future):
+        self._inflight = None
+
+    async def _poll_once(self):
+        with metrics.STAGE_SECONDS.time(self.name, 'fetch'):
+            vehicle_positions_pb, trip_updates_pb = await self.fetch()
+        if not vehicle_positions_pb or not trip_updates_pb:
+            self.failures += 1
+            metrics.POLLS.inc(self.name, 'failed')
+            logger.error(f"[{self.name}] Poll failed; keeping the previous snapshot.")
+            return self.snapshot
+
+        previous = self.snapshot
+        if (previous is not None and not self._rescore and vehicle_positions_pb == previous.vehicle_positions_pb
+                and trip_updates_pb == previous.trip_updates_pb):
+            # Both feeds are unchanged (304 or identical bytes): the data is confirmed current
+            self.failures = 0
+            metrics.POLLS.inc(self.name, 'unchanged')
+            self.snapshot = replace(previous, delta=empty_delta(), created_at=time.time())
+            if self.shared is not None:
+                self.shared.confirm(self.snapshot.created_at)
+            return self.snapshot
+
+        try:
+            with metrics.STAGE_SECONDS.time(self.name, 'cpu_pool'):
+                result = await self._score(vehicle_positions_pb, trip_updates_pb)
+        except PoolBusy as e:
+            metrics.POLLS.inc(self.name, 'busy')
+            logger.warning(f"[{self.name}] Skipping this cycle; keeping the previous snapshot: {e}")
+            return self.snapshot
+        except Exception as e:
+            self.failures += 1
+            metrics.POLLS.inc(self.name, 'failed')
+            logger.error(f"[{self.name}] Failed to decode or score GTFS data; keeping the previous snapshot: {e}")
+            return self.snapshot
+
+        self.failures = 0
+        self._rescore = False
+        df, bus_predictions, delta, stats = result['df'], result['bus_predictions'], result['delta'], result['stats']
+        self._record(stats, result['vehicles'], result['trips'], len(bus_predictions))
+        self.snapshot = PredictionSnapshot(
+            df=df,
+            bus_predictions=bus_predictions,
+            upcoming=result['upcoming'],
+            predictions_json=result['predictions_json'],
+            vehicle_positions_pb=vehicle_positions_pb,
+            trip_updates_pb=trip_updates_pb,
+            # Serialized variants survive across snapshots for as long as a feed is unchanged
+            vehicle_positions_feed=EncodedFeed.reuse(previous and previous.vehicle_positions_feed,
+                                                     vehicle_positions_pb),
+            trip_updates_feed=EncodedFeed.reuse(previous and previous.trip_updates_feed, trip_updates_pb),
+            vehicle_grid=result['vehicle_grid'],
+            index=result['index'],
+            delta=delta,
+            feed_timestamp=result['feed_timestamp'],
+            created_at=time.time(),
+        )
+        if self.shared is not None:
+            try:
+                with metrics.STAGE_SECONDS.time(self.name, 'share'):
+                    self._shared_version = await asyncio.to_thread(self.shared.publish, self.snapshot)
+            except Exception as e:
+                logger.error(f"[{self.name}] Failed to share the snapshot with the other workers: {e}")
+        logger.info(
+            f"[{self.name}] Published snapshot with {len(bus_predictions)} predictions "
+            f"(+{len(delta['added'])} ~{len(delta['changed'])} -{len(delta['removed'])}; "
+            f"{stats['reused_predictions']} predictions reused)."
+        )
+        self._notify(self.snapshot)
+        return self.snapshot
+
+    async def _follow(self):
+        """Serve the leader's latest shared snapshot, mapping it in when its version changes."""
+        version, confirmed_at = self.shared.state()
+        if version == self._shared_version:
+            if self.snapshot is not None and confirmed_at > self.snapshot.created_at:
+                # The leader polled again and the feeds were unchanged
+                self.snapshot = replace(self.snapshot, delta=empty_delta(), created_at=confirmed_at)
+            return self.snapshot
+
+        previous = self.snapshot
+        fields = await asyncio.to_thread(self.shared.load, version)
+        self._shared_version = version
+        self.snapshot = PredictionSnapshot(
+            vehicle_positions_feed=EncodedFeed.reuse(previous and previous.vehicle_positions_feed,
+                                                     fields['vehicle_positions_pb']),
+            trip_updates_feed=EncodedFeed.reuse(previous and previous.trip_updates_feed, fields['trip_updates_pb']),
+            **fields,
+        )
+        metrics.POLLS.inc(self.name, 'followed')
+        logger.info(f"[{self.name}] Loaded shared snapshot {version} with {len(self.snapshot.bus_predictions)} predictions.")
+        self._notify(self.snapshot)
+        return self.snapshot
+
+    def _record(self, stats, vehicles, trips, predictions):
+        if not metrics.ENABLED:
+            return
+        for stage, seconds in stats['seconds'].items():
+            metrics.STAGE_SECONDS.observe(seconds, self.name, stage)
+        metrics.POLLS.inc(self.name, 'published')
+        metrics.ROWS_PROCESSED.inc(self.name, amount=stats['rows'])
+        metrics.REUSED.inc(self.name, 'features', amount=stats['reused_features'])
+        metrics.REUSED.inc(self.name, 'predictions', amount=stats['reused_predictions'])
+        metrics.SNAPSHOT_SIZE.set(vehicles, self.name, 'vehicles')
+        metrics.SNAPSHOT_SIZE.set(trips, self.name, 'trips')
+        metrics.SNAPSHOT_SIZE.set(predictions, self.name, 'predictions')
+
+    def next_delay(self):
+        """Seconds until the next poll: the interval, doubled per consecutive failure, plus jitter."""
+        delay = min(self.interval * 2 ** min(self.failures, 16), max(self.interval, self.max_backoff))
+        return delay + random.uniform(0, self.jitter * self.interval)
+
+    async def _run(self, initial_delay):
+        if initial_delay:
+            await asyncio.sleep(initial_delay)
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"[{self.name}] Error during prediction poll: {e}")
+            # Followers check for the leader's next snapshot, and for a vacant lead, much more often
+            await asyncio.sleep(self.next_delay() if self.leading else self.shared.check_interval)
+
+    def start(self, initial_delay=0.0):
+        """Start the background polling task on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(initial_delay))
+
+    async def stop(self):
+        """Cancel the background polling task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
@@ -0,0 +1,235 @@
+# position_history.py
+# Short memory of where every vehicle has been. Each vehicle gets a slot in a set of fixed-size
+# 2D arrays holding its last `size` reports (timestamp, lat, lon, next stop, stop sequence) as a
+# ring buffer. Observed-motion features are computed from these arrays for the whole fleet at
+# once, rather than per vehicle.
+#
+# Memory is bounded by max_vehicles * size samples. Vehicles that haven't reported for `ttl`
+# seconds of feed time are evicted. When every slot is taken, the least recently seen vehicle
+# gives up its slot to a new one.
+
+import os
+
+import numpy as np
+
+from stops_index import haversine_m
+
+# Reports kept per vehicle
+POSITION_HISTORY_SIZE = int(os.environ.get("POSITION_HISTORY_SIZE", "8"))
+
+# Vehicles tracked at most; together with the size this caps the buffer's memory
+POSITION_HISTORY_MAX_VEHICLES = int(os.environ.get("POSITION_HISTORY_MAX_VEHICLES", "20000"))
+
+# Seconds of feed time after which a vehicle missing from the feed is forgotten
+POSITION_HISTORY_TTL = float(os.environ.get("POSITION_HISTORY_TTL", "600"))
+
+# A vehicle whose reports stay within this many meters of its latest one is dwelling
+DWELL_RADIUS_M = 30.0
+
+# Features computed from the history, added to every dataset row (NaN without enough history)
+HISTORY_COLUMNS = ['observed_speed_m_s', 'acceleration_m_s2', 'dwell_seconds', 'stops_advanced',
+                   'approach_speed_m_s']
+
+def empty_history(n):
+    """History features for n rows with no history at all."""
+    return {col: np.full(n, np.nan) for col in HISTORY_COLUMNS}
+
+class PositionHistory:
+    """
+    Ring buffers of recent reports keyed by bus_id. Slot s holds one vehicle's samples in
+    row s of every array; head[s] is where its next sample goes.
+    """
+
+    def __init__(self, size=POSITION_HISTORY_SIZE, max_vehicles=POSITION_HISTORY_MAX_VEHICLES,
+                 ttl=POSITION_HISTORY_TTL, initial_slots=256):
+        self.size = size
+        self.max_vehicles = max_vehicles
+        self.ttl = ttl
+        self.slots = {}
+        self._free = []
+        self.capacity = 0
+        self.timestamp = np.empty((0, size))
+        self.lat = np.empty((0, size))
+        self.lon = np.empty((0, size))
+        self.stop_pos = np.empty((0, size), dtype=np.int32)
+        self.stop_sequence = np.empty((0, size), dtype=np.int32)
+        self.head = np.empty(0, dtype=np.int32)
+        self.count = np.empty(0, dtype=np.int32)
+        self.last_seen = np.empty(0)
+        self.bus_id = np.empty(0, dtype=object)
+        self._grow(min(initial_slots, max_vehicles))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def nbytes(self):
+        """Bytes held by the sample arrays."""
+        return sum(a.nbytes for a in (self.timestamp, self.lat, self.lon, self.stop_pos, self.stop_sequence,
+                                      self.head, self.count, self.last_seen, self.bus_id))
+
+    def _grow(self, capacity):
+        """Extend every array to `capacity` slots; the new slots go on the free list."""
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        pad = lambda array, fill: np.concatenate([array, np.full((extra,) + array.shape[1:], fill, dtype=array.dtype)])
+        self.timestamp = pad(self.timestamp, np.nan)
+        self.lat = pad(self.lat, np.nan)
+        self.lon = pad(self.lon, np.nan)
+        self.stop_pos = pad(self.stop_pos, -1)
+        self.stop_sequence = pad(self.stop_sequence, -1)
+        self.head = pad(self.head, 0)
+        self.count = pad(self.count, 0)
+        self.last_seen = pad(self.last_seen, -np.inf)
+        self.bus_id = pad(self.bus_id, None)
+        # Popped from the end, so lower slots are handed out first
+        self._free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def _release(self, slots):
+        for slot in slots:
+            del self.slots[self.bus_id[slot]]
+        self.bus_id[slots] = None
+        self.count[slots] = 0
+        self.head[slots] = 0
+        self.timestamp[slots] = np.nan
+        self.last_seen[slots] = -np.inf
+        self._free.extend(int(slot) for slot in slots)
+
+    def evict(self, now):
+        """Forget vehicles not seen for ttl seconds before `now`. Returns how many were evicted."""
+        stale = np.flatnonzero((self.count > 0) & (self.last_seen < now - self.ttl))
+        self._release(stale)
+        return len(stale)
+
+    def _slot_for(self, bus_id, now):
+        """A slot for a vehicle not tracked yet, or -1 if every slot is in use this cycle."""
+        if not self._free and self.capacity < self.max_vehicles:
+            self._grow(min(self.max_vehicles, max(1, self.capacity * 2)))
+        if not self._free:
+            # Full: take over the least recently seen vehicle's slot, unless it was seen this cycle
+            oldest = int(np.argmin(self.last_seen))
+            if self.last_seen[oldest] >= now:
+                return -1
+            self._release([oldest])
+        slot = self._free.pop()
+        self.slots[bus_id] = slot
+        self.bus_id[slot] = bus_id
+        # Claimed now, so a later new vehicle in the same cycle can't take it over
+        self.last_seen[slot] = now
+        return slot
+
+    def update(self, bus_ids, timestamps, lat, lon, stop_pos, stop_sequence, now):
+        """
+        Record one snapshot of reports. A report is only appended if it is newer than the
+        vehicle's latest stored sample, so repeated reports don't fill the buffer.
+
+        Returns:
+        - np.ndarray: Each row's slot, or -1 for vehicles that could not be tracked
+        """
+        self.evict(now)
+        get = self.slots.get
+        slots = np.fromiter((get(bus_id, -1) for bus_id in bus_ids), dtype=np.intp, count=len(bus_ids))
+        # Mark known vehicles as seen first, so new ones can't take over their slots
+        self.last_seen[slots[slots >= 0]] = now
+        for i in np.flatnonzero(slots < 0):
+            slots[i] = self.slots.get(bus_ids[i], -1)
+            if slots[i] < 0:
+                slots[i] = self._slot_for(bus_ids[i], now)
+
+        tracked = np.flatnonzero(slots >= 0)
+        s = slots[tracked]
+        latest = self.timestamp[s, (self.head[s] - 1) % self.size]
+        newer = ~(timestamps[tracked] <= latest)  # NaN (no samples yet) counts as older
+        rows, s = tracked[newer], s[newer]
+        # A bus_id repeated within one snapshot keeps only its last report
+        s, last = np.unique(s[::-1], return_index=True)
+        rows = rows[::-1][last]
+        h = self.head[s]
+        self.timestamp[s, h] = timestamps[rows]
+        self.lat[s, h] = lat[rows]
+        self.lon[s, h] = lon[rows]
+        self.stop_pos[s, h] = stop_pos[rows]
+        self.stop_sequence[s, h] = stop_sequence[rows]
+        self.head[s] = (h + 1) % self.size
+        self.count[s] = np.minimum(self.count[s] + 1, self.size)
+        self.last_seen[slots[tracked]] = now
+        return slots
+
+    def samples(self, slots):
+        """Every column's samples for the given slots as (n, size) arrays, newest first."""
+        back = np.arange(self.size)
+        idx = (self.head[slots][:, None] - 1 - back) % self.size
+        rows = slots[:, None]
+        have = back < self.count[slots][:, None]
+        return {
+            'timestamp': np.where(have, self.timestamp[rows, idx], np.nan),
+            'lat': self.lat[rows, idx],
+            'lon': self.lon[rows, idx],
+            'stop_pos': np.where(have, self.stop_pos[rows, idx], -1),
+            'stop_sequence': self.stop_sequence[rows, idx],
+            'have': have,
+        }
+
+    def features(self, slots, stops):
+        """
+        Observed-motion features for each row's vehicle, computed for all of them at once:
+
+        - observed_speed_m_s: distance between the two latest reports over the time between them
+        - acceleration_m_s2: change between the two latest observed speeds
+        - dwell_seconds: how long the vehicle has stayed within DWELL_RADIUS_M of its latest report
+        - stops_advanced: stop_sequence gained since the oldest report in the buffer
+        - approach_speed_m_s: how fast the distance to the current next stop has been shrinking
+        """
+        out = empty_history(len(slots))
+        tracked = np.flatnonzero(slots >= 0)
+        if len(tracked) == 0:
+            return out
+        h = self.samples(slots[tracked])
+        ts, lat, lon, have = h['timestamp'], h['lat'], h['lon'], h['have']
+        n = len(tracked)
+        count = have.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Segment speeds between consecutive reports, newest segment first
+            if self.size >= 2:
+                seg_dist = haversine_m(lat[:, :-1], lon[:, :-1], lat[:, 1:], lon[:, 1:])
+                seg_dt = ts[:, :-1] - ts[:, 1:]
+                seg_speed = np.where(seg_dt > 0, seg_dist / seg_dt, np.nan)
+                out['observed_speed_m_s'][tracked] = seg_speed[:, 0]
+            if self.size >= 3:
+                mid_dt = (ts[:, 0] - ts[:, 2]) / 2
+                out['acceleration_m_s2'][tracked] = np.where(mid_dt > 0, (seg_speed[:, 0] - seg_speed[:, 1]) / mid_dt,
+                                                             np.nan)
+
+            # Dwell: the unbroken run of reports near the latest one, going back in time
+            near = have & (haversine_m(lat[:, :1], lon[:, :1], lat, lon) <= DWELL_RADIUS_M)
+            run = np.cumprod(near, axis=1).sum(axis=1)
+            first = np.maximum(run - 1, 0)
+            out['dwell_seconds'][tracked] = np.where(run > 0, ts[:, 0] - ts[np.arange(n), first], np.nan)
+
+            oldest = np.maximum(count - 1, 0)
+            advanced = h['stop_sequence'][:, 0] - h['stop_sequence'][np.arange(n), oldest]
+            out['stops_advanced'][tracked] = np.where(count >= 2, np.maximum(advanced, 0), np.nan)
+
+            # Approach: from the oldest report that still had the same next stop
+            stop = h['stop_pos'][:, 0]
+            same = np.cumprod(have & (h['stop_pos'] == stop[:, None]), axis=1).sum(axis=1)
+            then = np.maximum(same - 1, 0)
+            known = stop >= 0
+            stop_lat = np.where(known, stops.lat[np.maximum(stop, 0)], np.nan)
+            stop_lon = np.where(known, stops.lon[np.maximum(stop, 0)], np.nan)
+            d_now = haversine_m(lat[:, 0], lon[:, 0], stop_lat, stop_lon)
+            d_then = haversine_m(lat[np.arange(n), then], lon[np.arange(n), then], stop_lat, stop_lon)
+            dt = ts[:, 0] - ts[np.arange(n), then]
+            out['approach_speed_m_s'][tracked] = np.where((same >= 2) & (dt > 0), (d_then - d_now) / dt, np.nan)
+        return out
+
+    def observe(self, columns, current_time, stops):
+        """
+        Record a snapshot joined by features.join_next_stops and return its history features.
+        Reports without a position timestamp are stamped with the feed header time.
+        """
+        timestamps = np.where(columns['position_timestamp'] > 0, columns['position_timestamp'], float(current_time))
+        slots = self.update(columns['bus_id'], timestamps, columns['current_lat'], columns['current_lon'],
+                            columns['stop_pos'], columns['stop_sequence'], float(current_time))
+        return self.features(slots, stops)
@@ -0,0 +1,139 @@
+# raw_feeds.py
+# Pre-serialized representations of the raw GTFS-RT feeds served by /fetch_vehicle_positions
+# and /fetch_trip_updates. Each feed payload is converted to JSON once, compressed once per
+# encoding, and tagged with a content hash so unchanged feeds can be answered with a 304.
+
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+
+import metrics
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+PROTOBUF_MEDIA_TYPE = "application/x-protobuf"
+JSON_MEDIA_TYPE = "application/json"
+
+# Content encodings we can produce, in order of preference
+ENCODINGS = ("br", "gzip") if BROTLI_AVAILABLE else ("gzip",)
+
+def dumps(obj):
+    """Serialize to compact UTF-8 JSON bytes."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+def choose_encoding(accept_encoding):
+    """Pick the preferred encoding the client accepts (None for identity)."""
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        weight = 1.0
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = weight
+    for encoding in ENCODINGS:
+        # "*" only covers codings not listed by name, so "br;q=0, *" still refuses br (RFC 9110)
+        if weights.get(encoding, weights.get("*", 0)) > 0:
+            return encoding
+    return None
+
+class EncodedFeed:
+    """
+    One raw feed payload plus its JSON and compressed variants, built lazily and kept for as
+    long as the payload is current. Variants are built off the event loop, once each.
+    """
+
+    def __init__(self, pb):
+        self.pb = pb
+        self.digest = hashlib.blake2b(pb, digest_size=16).hexdigest()
+        self._variants = {("pb", None): pb}
+        self._pending = {}
+
+    @classmethod
+    def reuse(cls, previous, pb):
+        """Keep the previous EncodedFeed (and its cached variants) if the payload is unchanged."""
+        if previous is not None and (previous.pb is pb or previous.pb == pb):
+            return previous
+        return cls(pb)
+
+    def etag(self, fmt, encoding=None):
+        return f'"{self.digest}-{fmt}-{encoding}"' if encoding else f'"{self.digest}-{fmt}"'
+
+    def matches(self, if_none_match, fmt):
+        """True if an If-None-Match header names any encoding of this payload in this format."""
+        if not if_none_match:
+            return False
+        prefix = f'"{self.digest}-{fmt}'
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == prefix + '"' or tag.startswith(prefix + "-"):
+                return True
+        return False
+
+    async def _build(self, fmt, encoding):
+        if encoding is None:
+            from protobuf_to_json import protobuf_bytes_to_json  # Deferred until a JSON body is asked for
+            return await asyncio.to_thread(self._timed, fmt, None, lambda: dumps(protobuf_bytes_to_json(self.pb)))
+        body = await self.body(fmt)
+        return await asyncio.to_thread(self._timed, fmt, encoding, lambda: compress(body, encoding))
+
+    @staticmethod
+    def _timed(fmt, encoding, build):
+        started = time.perf_counter()
+        body = build()
+        metrics.BODY_BUILD_SECONDS.observe(time.perf_counter() - started, fmt, encoding or "identity")
+        return body
+
+    async def body(self, fmt, encoding=None):
+        """
+        Bytes for one representation of the feed.
+
+        Parameters:
+        - fmt (str): "json" or "pb"
+        - encoding (str): "br", "gzip" or None for identity
+
+        Returns:
+        - bytes: The serialized (and possibly compressed) body
+        """
+        key = (fmt, encoding)
+        if key in self._variants:
+            metrics.CACHE.inc('feed_body', 'hit')
+            return self._variants[key]
+        metrics.CACHE.inc('feed_body', 'miss')
+        # Concurrent requests for the same variant share one build
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(self._build(fmt, encoding))
+        pending = self._pending[key]
+        try:
+            body = await asyncio.shield(pending)
+        finally:
+            if pending.done() and self._pending.get(key) is pending:
+                del self._pending[key]
+        self._variants[key] = body
+        return body
@@ -0,0 +1,173 @@
+# shared_snapshot.py
+# Lets every server process on a host (uvicorn --workers N, or replicas sharing a volume) share
+# one upstream poll per agency. With SHARED_SNAPSHOT_DIR set, the process holding an agency's
+# leader lock polls and scores as usual and publishes each snapshot into
+# <SHARED_SNAPSHOT_DIR>/<agency_id>/. The other processes never fetch the feeds; they map the
+# latest published segment read-only instead, the way artifact_cache.py maps the stops and model.
+#
+# A segment is a directory v<version>/ of uncompressed .npy arrays: the snapshot's columns and
+# upcoming table, its raw payloads and /get_predictions body as bytes, and its SnapshotIndex,
+# plus a meta.json. The leader writes it to a staging directory, renames it into place and only
+# then bumps the version counter in the memory-mapped `version` file, next to the time the
+# leader last confirmed the feeds current. Followers read both every SHARED_SNAPSHOT_CHECK
+# seconds (a memory read, no system call) and load a segment only when the version changes.
+# Numeric columns and payloads stay in the page cache, one copy for all processes; only the
+# string columns and the lookup dicts are rebuilt per process.
+#
+# The leader holds an flock on leader.lock for as long as it runs. The OS releases it when the
+# process exits, and the next follower to check takes over polling. POSIX only.
+
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from artifact_cache import write_artifact
+from snapshot_index import SnapshotIndex
+from stops_index import GridIndex
+
+logger = logging.getLogger(__name__)
+
+# Directory to share snapshots through (unset: every process polls upstream on its own)
+SHARED_SNAPSHOT_DIR = os.environ.get("SHARED_SNAPSHOT_DIR")
+
+# Seconds between followers' checks for a new version (and attempts to take over as leader)
+SHARED_SNAPSHOT_CHECK = float(os.environ.get("SHARED_SNAPSHOT_CHECK", "0.5"))
+
+# Segments kept on disk; processes still serving an older one keep their mapping of it
+KEEP_SEGMENTS = 3
+
+# Snapshot fields stored as raw bytes
+BLOBS = ('vehicle_positions_pb', 'trip_updates_pb', 'predictions_json')
+
+def segment_name(version):
+    return f"v{version:012d}"
+
+def column_array(series):
+    """A DataFrame column as a NumPy array .npy can store (strings as fixed-width unicode)."""
+    values = series.to_numpy()
+    return values.astype(str) if values.dtype == object else values
+
+def mapped_frame(arrays, prefix, columns):
+    """A DataFrame over mapped arrays; copy=False keeps the numeric columns on the mapped pages."""
+    return pd.DataFrame({name: arrays[f"{prefix}.{name}"] for name in columns}, copy=False)
+
+class SharedSnapshot:
+    """One agency's shared snapshot directory, from the point of view of this process."""
+
+    def __init__(self, directory, check_interval=SHARED_SNAPSHOT_CHECK):
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self.leader = False
+        self._lock_file = None
+        self._counter = None
+        self._writer = None
+
+    def lead(self):
+        """Become the leader if no other process is (non-blocking). True if this process leads."""
+        if self.leader:
+            return True
+        import fcntl
+        if self._lock_file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._lock_file = open(self.directory / "leader.lock", "a+b")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self.leader = True
+        logger.info(f"This process (pid {os.getpid()}) now polls upstream and publishes to {self.directory}.")
+        return True
+
+    def state(self):
+        """(latest published version, when the leader last confirmed it current); (0, 0.0) before the first."""
+        if self._counter is None:
+            try:
+                self._counter = np.memmap(self.directory / "version", dtype=np.float64, mode='r', shape=(2,))
+            except (FileNotFoundError, ValueError):
+                return 0, 0.0
+        return int(self._counter[0]), float(self._counter[1])
+
+    def _open_writer(self):
+        if self._writer is None:
+            path = self.directory / "version"
+            if not path.exists():
+                path.write_bytes(bytes(16))
+            self._writer = np.memmap(path, dtype=np.float64, mode='r+', shape=(2,))
+        return self._writer
+
+    def confirm(self, created_at):
+        """Leader: the feeds were polled again and are unchanged, so the published segment is current."""
+        self._open_writer()[1] = created_at
+
+    def publish(self, snapshot):
+        """
+        Leader: write a snapshot as the next segment, then bump the version counter.
+        Blocking (file I/O); run it in a worker thread from the event loop.
+
+        Returns:
+        - int: The published version
+        """
+        writer = self._open_writer()
+        version = int(writer[0]) + 1
+
+        df, upcoming = snapshot.df, snapshot.upcoming
+        arrays = {f"df.{name}": column_array(df[name]) for name in df.columns}
+        arrays.update({f"upcoming.{name}": column_array(upcoming[name]) for name in upcoming.columns})
+        arrays.update({name: np.frombuffer(getattr(snapshot, name), dtype=np.uint8) for name in BLOBS})
+        arrays.update({f"index.{name}": array for name, array in snapshot.index.to_arrays().items()})
+        meta = {
+            'version': version,
+            'columns': list(df.columns),
+            'upcoming_columns': list(upcoming.columns),
+            'arrays': list(arrays),
+            'delta': snapshot.delta,
+            'feed_timestamp': snapshot.feed_timestamp,
+            'created_at': snapshot.created_at,
+        }
+        write_artifact(self.directory / segment_name(version), arrays, meta)
+        writer[1] = snapshot.created_at
+        writer[0] = version
+        writer.flush()
+
+        for old in sorted(self.directory.glob("v*"))[:-KEEP_SEGMENTS]:
+            shutil.rmtree(old, ignore_errors=True)
+        return version
+
+    def load(self, version):
+        """
+        Follower: map a published segment read-only and rebuild the snapshot's lookups over it.
+        Blocking; run it in a worker thread from the event loop.
+
+        Returns:
+        - dict: The PredictionSnapshot fields other than the EncodedFeeds, with the payloads and
+          the /get_predictions body as memoryviews of the mapped files
+        """
+        directory = self.directory / segment_name(version)
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode='r') for name in meta['arrays']}
+
+        df = mapped_frame(arrays, "df", meta['columns'])
+        upcoming = mapped_frame(arrays, "upcoming", meta['upcoming_columns'])
+        index_arrays = {name[len("index."):]: array for name, array in arrays.items() if name.startswith("index.")}
+        index = SnapshotIndex.from_arrays(index_arrays, df, upcoming)
+        return {
+            'df': df,
+            'upcoming': upcoming,
+            'bus_predictions': dict(zip(index.columns['bus_id'].tolist(), index.columns['prediction'].tolist())),
+            **{name: memoryview(arrays[name]) for name in BLOBS},
+            'vehicle_grid': GridIndex(df['current_lat'], df['current_lon']),
+            'index': index,
+            'delta': meta['delta'],
+            'feed_timestamp': meta['feed_timestamp'],
+            'created_at': meta['created_at'],
+        }
+
+    def describe(self):
+        version, confirmed_at = self.state()
+        return {"directory": str(self.directory), "leader": self.leader, "version": version, "confirmed_at": confirmed_at}
@@ -0,0 +1,178 @@
+# snapshot_index.py
+# Secondary indexes over one snapshot's prediction rows, built in the CPU pool together with
+# the snapshot: route_id -> its buses, stop_id -> the buses due there (at any stop ahead of
+# them, not just the next one) by expected arrival time, and bus_id -> its row and the stops
+# ahead of it. /routes/{route_id}/predictions, /stops/{stop_id}/arrivals, /buses/{bus_id} and
+# /buses/{bus_id}/stops look a key up and turn only the page they return into records, so they
+# answer in time proportional to the result, not to the fleet.
+#
+# Each grouping is one sort: a key's rows are a contiguous run of a row permutation, and a
+# dict maps the key to the (start, stop) of its run.
+
+import numpy as np
+import pandas as pd
+
+from features import DATASET_COLUMNS
+
+# Fields a record can be asked for: every dataset column plus the served prediction
+FIELDS = DATASET_COLUMNS + ['prediction']
+
+# Fields listed per bus when the client doesn't choose
+DEFAULT_FIELDS = [
+    'bus_id', 'trip_id', 'route_id', 'current_lat', 'current_lon', 'next_stop_id', 'next_stop_name',
+    'expected_arrival_time', 'time_to_arrival_seconds', 'distance_to_stop_meters', 'prediction',
+]
+
+# Fields of the upcoming (vehicle, stop) rows; next_stop_* is the row's stop, which is
+# stops_ahead stop_time_updates past the vehicle's next one
+UPCOMING_FIELDS = FIELDS + ['stops_ahead']
+
+# Fields listed per arrival at a stop, and per stop ahead of a bus, when the client doesn't choose
+DEFAULT_ARRIVAL_FIELDS = [
+    'bus_id', 'trip_id', 'route_id', 'current_lat', 'current_lon', 'stops_ahead',
+    'expected_arrival_time', 'time_to_arrival_seconds', 'distance_to_stop_meters', 'prediction',
+]
+DEFAULT_BUS_STOP_FIELDS = [
+    'next_stop_id', 'next_stop_name', 'stop_sequence', 'stops_ahead', 'expected_arrival_time',
+    'time_to_arrival_seconds', 'distance_to_stop_meters', 'prediction',
+]
+
+def parse_fields(fields, default=DEFAULT_FIELDS, allowed=FIELDS):
+    """
+    The fields named in a comma-separated list, in that order (`default` when empty).
+
+    Raises:
+    - ValueError: if a name isn't one of `allowed`
+    """
+    if not fields:
+        return list(default)
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}; choose from {allowed}.")
+    return names
+
+def group_runs(keys, codes, order):
+    """{key: (start, stop)} for each run of equal codes in codes[order]; keys[code] names the run."""
+    ordered = codes[order]
+    if len(ordered) == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    stops = np.r_[starts[1:], len(ordered)]
+    return dict(zip(keys[ordered[starts]].tolist(), zip(starts.tolist(), stops.tolist())))
+
+def column_arrays(df, names):
+    """
+    The backing arrays of df's columns, without converting them: records only ever take a
+    page of rows from a column, so e.g. Arrow-backed string columns are never copied whole.
+    """
+    return {name: df[name].to_numpy() if isinstance(df[name].dtype, np.dtype) else df[name].array
+            for name in names}
+
+class SnapshotIndex:
+    """
+    Lookups over one snapshot: by route and bus over its vehicle rows, and by stop and bus over
+    its upcoming table, which has a row for every (vehicle, upcoming stop) pair (see
+    incremental.IncrementalScorer.score_upcoming). Without one, stops are looked up among the
+    vehicles' next stops.
+    """
+
+    def __init__(self, df, bus_predictions, upcoming=None):
+        self.columns = column_arrays(df, DATASET_COLUMNS)
+        self.columns['prediction'] = df['bus_id'].map(bus_predictions).to_numpy(dtype=object)
+        if upcoming is None:
+            upcoming = df.assign(stops_ahead=0, prediction=self.columns['prediction'])
+        self.upcoming = column_arrays(upcoming, UPCOMING_FIELDS)
+
+        # Codes in sorted key order, so ties within a run come out by bus_id (or stop order)
+        bus_codes, _ = pd.factorize(self.columns['bus_id'], sort=True)
+        route_codes, routes = pd.factorize(self.columns['route_id'], sort=True)
+        self.route_order = np.lexsort((bus_codes, route_codes))
+        self.routes = group_runs(np.asarray(routes, dtype=object), route_codes, self.route_order)
+        self.buses = dict(zip(self.columns['bus_id'].tolist(), range(len(df))))
+
+        pair_bus_codes, pair_buses = pd.factorize(self.upcoming['bus_id'], sort=True)
+        stop_codes, stops = pd.factorize(self.upcoming['next_stop_id'], sort=True)
+        # Soonest arrival first; rows without an expected time last
+        self.stop_order = np.lexsort((pair_bus_codes, np.asarray(self.upcoming['expected_arrival_time']), stop_codes))
+        self.stops = group_runs(np.asarray(stops, dtype=object), stop_codes, self.stop_order)
+        self.bus_stop_order = np.lexsort((np.asarray(self.upcoming['stops_ahead']), pair_bus_codes))
+        self.bus_stops = group_runs(np.asarray(pair_buses, dtype=object), pair_bus_codes, self.bus_stop_order)
+
+    def to_arrays(self):
+        """The predictions, sort orders and runs as plain NumPy arrays (see shared_snapshot.py)."""
+        arrays = {
+            'prediction': self.columns['prediction'].astype(str),
+            'route_order': self.route_order,
+            'stop_order': self.stop_order,
+            'bus_stop_order': self.bus_stop_order,
+        }
+        for name, runs in (('route', self.routes), ('stop', self.stops), ('bus_stop', self.bus_stops)):
+            arrays[f'{name}_keys'] = np.array(list(runs), dtype=str)
+            arrays[f'{name}_runs'] = np.array(list(runs.values()), dtype=np.intp).reshape(-1, 2)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, df, upcoming):
+        """
+        Rebuild the index over df and upcoming, the snapshot's vehicle rows and upcoming table,
+        from to_arrays output (e.g. memory-mapped).
+        """
+        index = cls.__new__(cls)
+        index.columns = column_arrays(df, DATASET_COLUMNS)
+        index.columns['prediction'] = arrays['prediction'].astype(object)
+        index.upcoming = column_arrays(upcoming, UPCOMING_FIELDS)
+        index.buses = dict(zip(index.columns['bus_id'].tolist(), range(len(df))))
+
+        def runs(name):
+            return dict(zip(arrays[f'{name}_keys'].tolist(), map(tuple, arrays[f'{name}_runs'].tolist())))
+        index.route_order, index.routes = arrays['route_order'], runs('route')
+        index.stop_order, index.stops = arrays['stop_order'], runs('stop')
+        index.bus_stop_order, index.bus_stops = arrays['bus_stop_order'], runs('bus_stop')
+        return index
+
+    def __len__(self):
+        return len(self.buses)
+
+    def route_rows(self, route_id):
+        """Rows of the buses on a route, by bus_id (empty if none is running it)."""
+        start, stop = self.routes.get(route_id, (0, 0))
+        return self.route_order[start:stop]
+
+    def stop_rows(self, stop_id):
+        """Upcoming rows of the buses due at stop_id, soonest expected arrival first."""
+        start, stop = self.stops.get(stop_id, (0, 0))
+        return self.stop_order[start:stop]
+
+    def bus_stop_rows(self, bus_id):
+        """Upcoming rows of a bus, one per stop still ahead of it, in trip order."""
+        start, stop = self.bus_stops.get(bus_id, (0, 0))
+        return self.bus_stop_order[start:stop]
+
+    def bus_row(self, bus_id):
+        """Row of a bus, or None if it isn't in the snapshot."""
+        return self.buses.get(bus_id)
+
+    def records(self, rows, fields, upcoming=False):
+        """
+        Vehicle rows (or upcoming rows) as JSON-friendly dictionaries with just `fields`
+        (NaN becomes None).
+        """
+        columns = self.upcoming if upcoming else self.columns
+        values = []
+        for name in fields:
+            column = columns[name].take(rows).tolist()
+            values.append([None if value != value else value for value in column])
+        return [dict(zip(fields, row)) for row in zip(*values)]
+
+    def page(self, rows, fields, offset, limit, key="items", upcoming=False):
+        """One page of rows as records under `key`, with the total and where the next page starts."""
+        total = len(rows)
+        end = min(offset + limit, total)
+        return {
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": end if end < total else None,
+            key: self.records(rows[offset:end], fields, upcoming),
+        }
@@ -0,0 +1,238 @@
+# stops_index.py
+# In-memory index over data/stops.txt, built once at import: O(1) lookups by stop_id
+# plus a uniform lat/lon grid for nearest-stop and radius queries. The stops' columns are
+# loaded from the binary artifact cache, so stops.txt is only parsed when it has changed.
+
+import logging
+import math
+from pathlib import Path
+
+import numpy as np
+
+from artifact_cache import load_or_build
+
+logger = logging.getLogger(__name__)
+
+# Get absolute directory of the script
+BASE_DIR = Path(__file__).resolve().parent
+
+EARTH_RADIUS_M = 6371e3  # Earth's radius in meters
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Haversine distance in meters. Accepts scalars or NumPy arrays (broadcast elementwise)."""
+    φ1, φ2 = np.radians(lat1), np.radians(lat2)
+    Δφ = φ2 - φ1
+    Δλ = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(Δφ / 2) ** 2 + np.cos(φ1) * np.cos(φ2) * np.sin(Δλ / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class GridIndex:
+    """
+    Buckets points into square lat/lon cells so neighbour queries only touch nearby cells.
+    The default 0.01° cell is roughly 1.1 km north-south, which keeps a city's stops at a
+    handful per cell.
+    """
+
+    def __init__(self, lats, lons, cell_deg=0.01):
+        self.lat = np.ascontiguousarray(lats, dtype=np.float64)
+        self.lon = np.ascontiguousarray(lons, dtype=np.float64)
+        self.cell_deg = cell_deg
+        self.cells = {}
+        if len(self.lat) == 0:
+            self.max_lat = 0.0
+            self.max_ring = 0
+            return
+
+        rows = np.floor(self.lat / cell_deg).astype(np.int64)
+        cols = np.floor(self.lon / cell_deg).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        keys = np.stack([rows[order], cols[order]], axis=1)
+        # Split the sorted points wherever the cell key changes
+        breaks = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+        for chunk in np.split(order, breaks):
+            self.cells[(int(rows[chunk[0]]), int(cols[chunk[0]]))] = chunk
+
+        self.max_lat = float(np.abs(self.lat).max())
+        self.row_range = (int(rows.min()), int(rows.max()))
+        self.col_range = (int(cols.min()), int(cols.max()))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _ring(self, row, col, ring):
+        """Point indices in the cells exactly `ring` cells away from (row, col)."""
+        if ring == 0:
+            keys = [(row, col)]
+        else:
+            keys = [(row + dr, col + dc) for dr in (-ring, ring) for dc in range(-ring, ring + 1)]
+            keys += [(row + dr, col + dc) for dc in (-ring, ring) for dr in range(-ring + 1, ring)]
+        return [self.cells[key] for key in keys if key in self.cells]
+
+    def _rings_to_cover(self, row, col):
+        """Ring count after which every occupied cell has been visited."""
+        return max(abs(row - self.row_range[0]), abs(row - self.row_range[1]),
+                   abs(col - self.col_range[0]), abs(col - self.col_range[1]))
+
+    def nearest(self, lat, lon, k=1):
+        """Return (indices, distances_m) of the k points closest to (lat, lon), nearest first."""
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        row, col = self._cell(lat, lon)
+        last_ring = self._rings_to_cover(row, col)
+        found = []
+        ring = 0
+        while True:
+            found.extend(self._ring(row, col, ring))
+            count = sum(len(chunk) for chunk in found)
+            if count >= k or ring >= last_ring:
+                candidates = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+                distances = haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+                if count >= k:
+                    kth = np.partition(distances, k - 1)[k - 1]
+                    # Anything outside the visited rings is at least this far away (conservative
+                    # in longitude by using the cosine of the highest latitude the grid could reach)
+                    lat_bound = min(max(abs(lat), self.max_lat) + ring * self.cell_deg, 89.0)
+                    covered = ring * self.cell_deg * METERS_PER_DEGREE * math.cos(math.radians(lat_bound))
+                    if kth <= covered or ring >= last_ring:
+                        break
+                else:
+                    break
+            ring += 1
+
+        order = np.argsort(distances, kind='stable')[:k]
+        return candidates[order], distances[order]
+
+    def within(self, lat, lon, radius_m):
+        """Return (indices, distances_m) of every point within radius_m of (lat, lon), nearest first."""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 1e-6))
+        row_lo, col_lo = self._cell(lat - dlat, lon - dlon)
+        row_hi, col_hi = self._cell(lat + dlat, lon + dlon)
+        found = [self.cells[(r, c)] for r in range(row_lo, row_hi + 1) for c in range(col_lo, col_hi + 1)
+                 if (r, c) in self.cells]
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        candidates = np.concatenate(found)
+        distances = haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+        keep = distances <= radius_m
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+
+class StopsIndex:
+    """Column-oriented view of stops.txt keyed by stop_id."""
+
+    def __init__(self, stops_df):
+        self._set_columns(
+            stop_id=stops_df['stop_id'].to_numpy(dtype=object),
+            lat=stops_df['stop_lat'].to_numpy(dtype=np.float64),
+            lon=stops_df['stop_lon'].to_numpy(dtype=np.float64),
+            name=stops_df['stop_name'].to_numpy(dtype=object),
+            wheelchair_boarding=stops_df['wheelchair_boarding'].to_numpy(),
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild an index from the arrays of to_arrays (e.g. memory-mapped from the artifact cache)."""
+        index = cls.__new__(cls)
+        index._set_columns(**arrays)
+        return index
+
+    def to_arrays(self):
+        """The index's columns as plain NumPy arrays, with strings as fixed-width unicode."""
+        return {
+            'stop_id': self.stop_id.astype(str),
+            'lat': self.lat,
+            'lon': self.lon,
+            'name': self.name.astype(str),
+            'wheelchair_boarding': self.wheelchair_boarding,
+        }
+
+    def _set_columns(self, stop_id, lat, lon, name, wheelchair_boarding):
+        # Ids and names are looked up and serialized one at a time; keep them as Python strings
+        self.stop_id = np.asarray(stop_id).astype(object)
+        self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+        self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+        self.name = np.asarray(name).astype(object)
+        self.wheelchair_boarding = np.asarray(wheelchair_boarding)
+
+        # First row wins for a repeated stop_id, as with the old stops_df[...].iloc[0] lookup
+        self.positions = {}
+        for i, stop_id in enumerate(self.stop_id):
+            self.positions.setdefault(stop_id, i)
+
+        self.grid = GridIndex(self.lat, self.lon)
+
+    def __len__(self):
+        return len(self.stop_id)
+
+    def position(self, stop_id):
+        """Row position of stop_id, or None if the stop is unknown."""
+        return self.positions.get(stop_id)
+
+    def positions_of(self, stop_ids):
+        """Row positions for an array of stop_ids, with -1 for unknown stops."""
+        get = self.positions.get
+        return np.fromiter((get(stop_id, -1) for stop_id in stop_ids), dtype=np.intp, count=len(stop_ids))
+
+    def record(self, i, distance_m=None):
+        """Stop at row position i as a JSON-friendly dictionary."""
+        record = {
+            'stop_id': self.stop_id[i],
+            'stop_name': self.name[i],
+            'stop_lat': float(self.lat[i]),
+            'stop_lon': float(self.lon[i]),
+            'wheelchair_boarding': int(self.wheelchair_boarding[i]),
+        }
+        if distance_m is not None:
+            record['distance_meters'] = float(distance_m)
+        return record
+
+    def nearest(self, lat, lon, k=1):
+        """The k stops closest to (lat, lon), nearest first."""
+        indices, distances = self.grid.nearest(lat, lon, k)
+        return [self.record(i, d) for i, d in zip(indices, distances)]
+
+    def within(self, lat, lon, radius_m):
+        """Every stop within radius_m of (lat, lon), nearest first."""
+        indices, distances = self.grid.within(lat, lon, radius_m)
+        return [self.record(i, d) for i, d in zip(indices, distances)]
+
+
+def read_stops(path):
+    """Read a GTFS stops.txt, keeping stop ids as strings."""
+    import pandas as pd  # Deferred: only needed when the cached index is stale
+    return pd.read_csv(path, dtype={'stop_id': str})
+
+def load_stops_index(path):
+    """StopsIndex for a stops.txt, from the artifact cache when the file hasn't changed."""
+    if not Path(path).exists():
+        raise FileNotFoundError(f"No stops file at {path}")
+    arrays, _ = load_or_build('stops', [path], lambda: (StopsIndex(read_stops(path)).to_arrays(), {}))
+    return StopsIndex.from_arrays(arrays)
+
+# Load stops data using absolute path
+try:
+    stops_index = load_stops_index(BASE_DIR / "data/stops.txt")
+except FileNotFoundError as e:
+    logger.error(f"Failed to load stops metadata: {e}")
+    raise
+
+def __getattr__(name):
+    # The parsed stops.txt DataFrame, for older importers; parsed on first use
+    if name == 'stops_df':
+        globals()['stops_df'] = read_stops(BASE_DIR / "data/stops.txt")
+        return globals()['stops_df']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,84 +1,278 @@
-import pandas as pd
-import pickle
-import matplotlib.pyplot as plt
-import os
-from pathlib import Path
-from sklearn.model_selection import train_test_split
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.metrics import confusion_matrix, accuracy_score, ConfusionMatrixDisplay
-from sklearn.preprocessing import StandardScaler
-
-# Define absolute directory of the script
-BASE_DIR = Path(__file__).resolve().parent
-
-# Ensure the model_weights directory exists
-(BASE_DIR / "model_weights").mkdir(parents=True, exist_ok=True)
-
-# Load dataset using absolute path
-dataset_path = BASE_DIR / 'bus_status_dataset_unix.csv'
-if not dataset_path.exists():
-    # Fallback to non-unix dataset if it exists, or output instructions
-    alt_dataset_path = BASE_DIR / 'bus_status_dataset.csv'
-    if alt_dataset_path.exists():
-        dataset_path = alt_dataset_path
-    else:
-        print(f"Error: Dataset not found at {dataset_path} or {alt_dataset_path}.")
-        print("Please run data collection (e.g. data_creation/create_dataset_scan.py) first.")
-        exit(1)
-
-df = pd.read_csv(dataset_path)
-
-# Remove unnecessary columns and features that cause Target Leakage
-# time_to_arrival_seconds and expected_arrival_time must be removed to prevent leakage
-columns_to_remove = [
-    'bus_id', 'trip_id', 'route_id', 'next_stop_name', 
-    'stop_sequence', 'wheelchair_boarding', 
-    'time_to_arrival_seconds', 'expected_arrival_time'
-]
-
-def train_decision_tree(df, columns_to_remove, target='status'):
-    df = df.drop(columns=columns_to_remove, errors='ignore')
-
-    # Split features and target
-    X_train, X_test, y_train, y_test = train_test_split(df.drop(target, axis=1), df[target], test_size=0.2, random_state=42)
-
-    # Standardize features
-    scaler = StandardScaler()
-    X_train = scaler.fit_transform(X_train)
-    X_test = scaler.transform(X_test)
-
-    # Train Decision Tree model
-    dt_model = DecisionTreeClassifier(random_state=42)
-    dt_model.fit(X_train, y_train)
-
-    # Save the model to model_weights/ directory
-    model_path = BASE_DIR / "model_weights" / "decision_tree_model.pkl"
-    with open(model_path, "wb") as file:
-        pickle.dump(dt_model, file)
-
-    # Make predictions
-    y_pred = dt_model.predict(X_test)
-
-    # Evaluate model
-    acc = accuracy_score(y_test, y_pred)
-    cm = confusion_matrix(y_test, y_pred)
-
-    print(f"Decision Tree Accuracy: {acc * 100:.2f}%")
-    print("Confusion Matrix:")
-    print(cm)
-
-    # Save Confusion Matrix plot instead of showing it (headless friendly)
-    disp = ConfusionMatrixDisplay(confusion_matrix=cm)
-    disp.plot(cmap=plt.cm.Blues)
-    plt.title("Decision Tree Confusion Matrix")
-    plt.savefig(BASE_DIR / "confusion_matrix.png")
-    print(f"Confusion matrix plot saved to {BASE_DIR / 'confusion_matrix.png'}")
-    plt.close()
-
-    # Save the scaler to use during inference
-    scaler_path = BASE_DIR / "model_weights" / "scaler.pkl"
-    with open(scaler_path, "wb") as file:
-        pickle.dump(scaler, file)
-    print(f"Model and scaler successfully saved to {BASE_DIR / 'model_weights'}")
-
-train_decision_tree(df, columns_to_remove)
\ No newline at end of file
+# train_decision_tree.py
+# Training entry point for the bus status classifier. Reads only the columns it needs from the
+# collected dataset (a partitioned Parquet directory, a Parquet file or a CSV), holds out the most
+# recent snapshots as the test set, tunes the tree with a parallel grid search over time-ordered
+# folds and writes a versioned bundle:
+#
+#   model_weights/<version>/decision_tree_model.pkl   fitted tree
+#                           scaler.pkl                fitted StandardScaler
+#                           manifest.json             feature schema, classes, params, data range
+#                           metrics.json              test-set and cross-validation scores
+#                           confusion_matrix.png
+#
+# A bundle directory holds the same two pickles as model_weights/ itself, so any bundle can be
+# served (or rolled back to) by pointing an agency's model_dir at it. Existing bundles and the
+# top-level model files are never overwritten.
+#
+# Usage: python train_decision_tree.py
+#        python train_decision_tree.py --dataset bus_status_dataset --from 2025-03-01 --to 2025-05-31
+#        python train_decision_tree.py --search-rows 500000 --folds 5 --n-jobs -1
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")  # Headless: plots are only ever saved
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.metrics import (accuracy_score, balanced_accuracy_score, classification_report, confusion_matrix,
+                             ConfusionMatrixDisplay, f1_score)
+from sklearn.model_selection import GridSearchCV, TimeSeriesSplit
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeClassifier
+
+from dataset_store import read_dataset
+from features import FEATURE_COLUMNS, LEAKAGE_COLUMNS, feature_matrix
+
+# Define absolute directory of the script
+BASE_DIR = Path(__file__).resolve().parent
+
+TARGET = 'status'
+# Snapshot time; used to order rows and split them, not necessarily as an input
+TIME_COLUMN = 'current_time'
+
+# Absolute Unix times: under the time-based split every test row lies past the training range, so
+# the tree could only extrapolate from them
+ABSOLUTE_TIME_COLUMNS = ['current_time', 'position_timestamp']
+
+# Model inputs: the serving features minus the ones that leak the target or only date a row
+TRAINING_FEATURES = [col for col in FEATURE_COLUMNS if col not in LEAKAGE_COLUMNS + ABSOLUTE_TIME_COLUMNS]
+
+# Hyperparameters searched; every combination is cross-validated
+PARAM_GRID = {
+    'tree__max_depth': [6, 10, 14, 20, None],
+    'tree__min_samples_leaf': [1, 10, 50, 200],
+    'tree__criterion': ['gini', 'entropy'],
+    'tree__class_weight': [None, 'balanced'],
+}
+
+def default_dataset():
+    """The collector's Parquet dataset if there is one, else the legacy CSV exports."""
+    for path in (BASE_DIR / 'bus_status_dataset', BASE_DIR / 'bus_status_dataset_unix.csv',
+                 BASE_DIR / 'bus_status_dataset.csv'):
+        if path.exists():
+            return path
+    return None
+
+def load_training_data(path, features, service_date_range=None):
+    """
+    Load the feature, target and time columns of a dataset, and nothing else.
+
+    Parameters:
+    - path (Path): Partitioned Parquet directory, Parquet file or CSV file
+    - features (list): Model input columns
+    - service_date_range (tuple): Inclusive (first, last) service dates (Parquet directories only)
+
+    Returns:
+    - pd.DataFrame: The requested columns, ordered by snapshot time
+    """
+    columns = list(dict.fromkeys(features + [TARGET, TIME_COLUMN]))
+    if path.is_dir():
+        df = read_dataset(path, columns=columns, service_date_range=service_date_range)
+    elif path.suffix == '.parquet':
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_csv(path, usecols=columns, dtype={'next_stop_id': str})
+    df = df.dropna(subset=[TARGET, TIME_COLUMN])
+    return df.sort_values(TIME_COLUMN, kind='stable', ignore_index=True)
+
+def time_split(times, test_fraction):
+    """
+    Index of the first test row: the latest `test_fraction` of snapshots are held out, and a
+    snapshot is never split between the training and test sets.
+    """
+    snapshots = np.unique(times)
+    if len(snapshots) < 2:
+        raise ValueError("A time-based split needs at least two snapshots.")
+    first_test = snapshots[min(len(snapshots) - 1, max(1, int(len(snapshots) * (1 - test_fraction))))]
+    return int(np.searchsorted(times, first_test))
+
+def search_hyperparameters(X, y, folds, n_jobs):
+    """Grid search over PARAM_GRID with time-ordered folds; X and y must be in time order."""
+    pipeline = Pipeline([('scaler', StandardScaler()), ('tree', DecisionTreeClassifier(random_state=42))])
+    search = GridSearchCV(pipeline, PARAM_GRID, scoring='balanced_accuracy', cv=TimeSeriesSplit(n_splits=folds),
+                          n_jobs=n_jobs, refit=False, error_score='raise')
+    search.fit(X, y)
+    return search
+
+def evaluate(pipeline, X_test, y_test):
+    y_pred = pipeline.predict(X_test)
+    labels = list(pipeline.classes_)
+    return {
+        'accuracy': float(accuracy_score(y_test, y_pred)),
+        'balanced_accuracy': float(balanced_accuracy_score(y_test, y_pred)),
+        'f1_macro': float(f1_score(y_test, y_pred, average='macro', zero_division=0)),
+        'per_class': classification_report(y_test, y_pred, labels=labels, output_dict=True, zero_division=0),
+        'confusion_matrix': {'labels': labels, 'matrix': confusion_matrix(y_test, y_pred, labels=labels).tolist()},
+    }
+
+def unix_to_iso(seconds):
+    return datetime.fromtimestamp(float(seconds), tz=timezone.utc).isoformat()
+
+def write_bundle(output_dir, version, pipeline, manifest, metrics):
+    """
+    Write the bundle to a temporary directory and rename it into place, so a bundle directory
+    only ever exists complete.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    final = output_dir / version
+    if final.exists():
+        raise FileExistsError(f"Model bundle {final} already exists.")
+    staging = output_dir / f".{version}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+
+    with open(staging / "decision_tree_model.pkl", "wb") as file:
+        pickle.dump(pipeline.named_steps['tree'], file)
+    with open(staging / "scaler.pkl", "wb") as file:
+        pickle.dump(pipeline.named_steps['scaler'], file)
+    with open(staging / "manifest.json", "w") as file:
+        json.dump(manifest, file, indent=4)
+    with open(staging / "metrics.json", "w") as file:
+        json.dump(metrics, file, indent=4)
+
+    # Save Confusion Matrix plot instead of showing it (headless friendly)
+    cm = metrics['test']['confusion_matrix']
+    disp = ConfusionMatrixDisplay(confusion_matrix=np.array(cm['matrix']), display_labels=cm['labels'])
+    disp.plot(cmap=plt.cm.Blues)
+    plt.title(f"Decision Tree Confusion Matrix ({version})")
+    plt.savefig(staging / "confusion_matrix.png")
+    plt.close()
+
+    os.replace(staging, final)
+    return final
+
+def train(args):
+    dataset = Path(args.dataset) if args.dataset else default_dataset()
+    if dataset is None or not dataset.exists():
+        print(f"Error: Dataset not found at {dataset or BASE_DIR / 'bus_status_dataset'}.")
+        print("Please run data collection (e.g. data_creation/create_dataset_scan.py) first.")
+        return None
+
+    features = args.features or TRAINING_FEATURES
+    leaking = sorted(set(features) & set(LEAKAGE_COLUMNS))
+    if leaking:
+        print(f"Warning: {leaking} leak the target; test scores will be optimistic.")
+    dated = [col for col in features if col in ABSOLUTE_TIME_COLUMNS]
+    if dated:
+        print(f"Warning: {dated} are absolute times; test rows all lie past their training range.")
+    date_range = (args.date_from or '0000-00-00', args.date_to or '9999-99-99') \
+        if (args.date_from or args.date_to) else None
+
+    started = time.perf_counter()
+    df = load_training_data(dataset, features, date_range)
+    if df.empty:
+        print(f"Error: No rows to train on in {dataset}.")
+        return None
+    times = df[TIME_COLUMN].to_numpy(dtype=np.float64)
+    y = df[TARGET].to_numpy(dtype=object)
+    X = feature_matrix(df, features)
+    del df
+    load_seconds = time.perf_counter() - started
+    print(f"Loaded {len(y)} rows x {len(features)} features from {dataset} in {load_seconds:.1f}s")
+
+    split = time_split(times, args.test_fraction)
+    X_train, y_train, X_test, y_test = X[:split], y[:split], X[split:], y[split:]
+    print(f"Training on {split} rows up to {unix_to_iso(times[split - 1])}, "
+          f"testing on {len(y) - split} rows from {unix_to_iso(times[split])}")
+
+    # Tune on the most recent training rows only if asked; the final fit always uses all of them
+    search_rows = min(args.search_rows or split, split)
+    started = time.perf_counter()
+    search = search_hyperparameters(X_train[-search_rows:], y_train[-search_rows:], args.folds, args.n_jobs)
+    search_seconds = time.perf_counter() - started
+    n_candidates = len(search.cv_results_['params'])
+    print(f"Searched {n_candidates} candidates x {args.folds} folds on {search_rows} rows in {search_seconds:.1f}s; "
+          f"best balanced accuracy {search.best_score_:.4f} with {search.best_params_}")
+
+    pipeline = Pipeline([('scaler', StandardScaler()), ('tree', DecisionTreeClassifier(random_state=42))])
+    pipeline.set_params(**search.best_params_)
+    started = time.perf_counter()
+    pipeline.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+
+    test_metrics = evaluate(pipeline, X_test, y_test)
+    print(f"Decision Tree test accuracy: {test_metrics['accuracy'] * 100:.2f}% "
+          f"(balanced {test_metrics['balanced_accuracy'] * 100:.2f}%)")
+    print("Confusion Matrix:")
+    print(np.array(test_metrics['confusion_matrix']['matrix']))
+
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    tree = pipeline.named_steps['tree']
+    manifest = {
+        'version': version,
+        'created_at': int(time.time()),
+        'model': 'DecisionTreeClassifier',
+        'features': [{'name': name, 'dtype': 'float64'} for name in features],
+        'target': TARGET,
+        'classes': [str(c) for c in tree.classes_],
+        'params': {name.removeprefix('tree__'): value for name, value in search.best_params_.items()},
+        'tree': {'depth': int(tree.get_depth()), 'leaves': int(tree.get_n_leaves())},
+        'data': {
+            'dataset': str(dataset),
+            'service_date_range': list(date_range) if date_range else None,
+            'rows': len(y),
+            'train_rows': split,
+            'test_rows': len(y) - split,
+            'train_start': unix_to_iso(times[0]),
+            'test_start': unix_to_iso(times[split]),
+            'test_end': unix_to_iso(times[-1]),
+        },
+        'versions': {'python': platform.python_version(), 'sklearn': sklearn.__version__,
+                     'numpy': np.__version__, 'pandas': pd.__version__},
+    }
+    metrics = {
+        'test': test_metrics,
+        'cross_validation': {
+            'scoring': 'balanced_accuracy',
+            'folds': args.folds,
+            'rows': search_rows,
+            'candidates': n_candidates,
+            'best_score': float(search.best_score_),
+            'best_std': float(search.cv_results_['std_test_score'][search.best_index_]),
+        },
+        'seconds': {'load': load_seconds, 'search': search_seconds, 'fit': fit_seconds},
+    }
+    bundle = write_bundle(Path(args.output), version, pipeline, manifest, metrics)
+    print(f"Model bundle {version} saved to {bundle}")
+    return bundle
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune and train the bus status decision tree.")
+    parser.add_argument('--dataset', help="Parquet dataset directory, Parquet file or CSV "
+                                          "(default: bus_status_dataset/, then the CSV exports)")
+    parser.add_argument('--output', default=str(BASE_DIR / 'model_weights'), help="Directory to write bundles to")
+    parser.add_argument('--from', dest='date_from', help="First service date to train on (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', help="Last service date to train on (YYYY-MM-DD)")
+    parser.add_argument('--features', nargs='+', help=f"Model inputs (default: {' '.join(TRAINING_FEATURES)})")
+    parser.add_argument('--test-fraction', type=float, default=0.2, help="Share of the latest snapshots held out")
+    parser.add_argument('--folds', type=int, default=4, help="Time-ordered cross-validation folds")
+    parser.add_argument('--search-rows', type=int, help="Tune on only this many of the latest training rows")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Parallel search workers (-1: all cores)")
+    args = parser.parse_args()
+
+    if train(args) is None:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_decoder.py
+# Compares the dict-tree path (protobuf_to_json + row dicts) with the columnar decoder for
+# turning raw feed payloads into the feature dataset. Reports best-of-N wall time and the
+# peak Python allocation (tracemalloc) of each stage.
+#
+# Usage: python benchmarks/bench_decoder.py --vehicles 5000 --stops-per-trip 10
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import pandas as pd
+
+from synthetic_feed import make_feeds  # also puts app/ on sys.path
+from protobuf_to_json import protobuf_bytes_to_json
+from gtfs_columnar import parse_feed, decode_vehicle_positions, decode_trip_updates
+from features import build_dataset, compute_features
+from stops_index import stops_index
+
+def dict_dataset(vehicle_positions_pb, trip_updates_pb):
+    """The previous pipeline: nested dicts, then one row dict per vehicle."""
+    vehicle_positions = protobuf_bytes_to_json(vehicle_positions_pb)
+    trip_updates = protobuf_bytes_to_json(trip_updates_pb)
+    trip_index = {}
+    for entity in trip_updates['entity']:
+        if 'trip_update' in entity:
+            trip_index.setdefault(entity['trip_update']['trip']['trip_id'], entity['trip_update'])
+    rows = []
+    for entity in vehicle_positions['entity']:
+        vehicle = entity['vehicle']
+        trip_update = trip_index.get(vehicle['trip']['trip_id'])
+        if not trip_update or not trip_update['stop_time_update']:
+            continue
+        stu = trip_update['stop_time_update'][0]
+        pos = stops_index.position(stu['stop_id'])
+        if pos is None or not stu['arrival']['time']:
+            continue
+        rows.append({
+            'bus_id': entity['id'], 'trip_id': vehicle['trip']['trip_id'],
+            'route_id': vehicle['trip']['route_id'], 'current_lat': vehicle['position']['latitude'],
+            'current_lon': vehicle['position']['longitude'], 'position_timestamp': vehicle['timestamp'],
+            'next_stop_id': stu['stop_id'], 'stop_pos': pos,
+            'expected_arrival_time': stu['arrival']['time'], 'stop_sequence': stu['stop_sequence'],
+        })
+    columns = {name: pd.Series([row[name] for row in rows]).to_numpy() for name in rows[0]} if rows else None
+    return compute_features(columns, float(vehicle_positions['header']['timestamp'])) if columns else None
+
+def decode_dict(vehicle_positions_pb, trip_updates_pb):
+    return protobuf_bytes_to_json(vehicle_positions_pb), protobuf_bytes_to_json(trip_updates_pb)
+
+def decode_columnar(vehicle_positions_pb, trip_updates_pb):
+    return (decode_vehicle_positions(parse_feed(vehicle_positions_pb)),
+            decode_trip_updates(parse_feed(trip_updates_pb)))
+
+def columnar_dataset(vehicle_positions_pb, trip_updates_pb):
+    return build_dataset(*decode_columnar(vehicle_positions_pb, trip_updates_pb))
+
+def measure(func, payloads, repeat):
+    """Best-of-`repeat` seconds and peak traced bytes for one call of func(*payloads)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*payloads)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(*payloads)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dict vs columnar feed decoding.")
+    parser.add_argument('--vehicles', type=int, default=2000)
+    parser.add_argument('--stops-per-trip', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    payloads = make_feeds(args.vehicles, args.stops_per_trip)
+    results = {
+        'vehicles': args.vehicles,
+        'stops_per_trip': args.stops_per_trip,
+        'payload_bytes': sum(len(p) for p in payloads),
+        'stages': {
+            'decode_dict': measure(decode_dict, payloads, args.repeat),
+            'decode_columnar': measure(decode_columnar, payloads, args.repeat),
+            'dataset_dict': measure(dict_dataset, payloads, args.repeat),
+            'dataset_columnar': measure(columnar_dataset, payloads, args.repeat),
+        },
+    }
+
+    print(f"{args.vehicles} vehicles x {args.stops_per_trip} stop_time_updates "
+          f"({results['payload_bytes'] / 1024:.0f} KiB of protobuf)")
+    for name, stage in results['stages'].items():
+        print(f"  {name:<18} {stage['seconds'] * 1000:9.2f} ms   peak {stage['peak_bytes'] / 2**20:8.2f} MiB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# bench_inference.py
+# Checks that the compiled tree (fast_tree.CompiledTree) predicts exactly what the pickled
+# StandardScaler + DecisionTreeClassifier predict, and times both.
+#
+# Recorded snapshots can be passed as a dataset written by the collector or get_real_time_data
+# (CSV or Parquet); otherwise synthetic feed snapshots are generated.
+#
+# Usage: python benchmarks/bench_inference.py [--dataset bus_status_dataset.csv]
+# Exits with status 1 if any prediction differs.
+
+import argparse
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+from synthetic_feed import make_feeds  # also puts app/ on sys.path
+import decision_tree_predict
+from features import feature_frame, feature_matrix
+from fast_tree import agreement
+
+def load_snapshots(args):
+    if args.dataset:
+        reader = pd.read_parquet if args.dataset.endswith('.parquet') else pd.read_csv
+        return [reader(args.dataset, dtype={'next_stop_id': str, 'bus_id': str})]
+    return [decision_tree_predict.process_payloads(*make_feeds(args.vehicles, 1, seed=seed))
+            for seed in range(args.snapshots)]
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity check and timing for compiled tree inference.")
+    parser.add_argument('--dataset', help="Recorded dataset (CSV or Parquet) to check against")
+    parser.add_argument('--vehicles', type=int, default=5000)
+    parser.add_argument('--snapshots', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    scaler = decision_tree_predict.scaler
+    dt_model = decision_tree_predict.dt_model
+    fast_model = decision_tree_predict.fast_model
+
+    ok = True
+    for i, df in enumerate(load_snapshots(args)):
+        X = feature_matrix(df)
+        share = agreement(fast_model, dt_model, scaler, X)
+        ok &= share == 1.0
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            sklearn_s = best_time(lambda: dt_model.predict(scaler.transform(feature_frame(df))), args.repeat)
+        fast_s = best_time(lambda: fast_model.predict(feature_matrix(df)), args.repeat)
+        print(f"snapshot {i}: {len(df)} rows, agreement {share:.2%}, "
+              f"sklearn {sklearn_s * 1000:.2f} ms, compiled {fast_s * 1000:.2f} ms")
+
+    if not ok:
+        print("Compiled tree disagrees with the sklearn model.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# bench_pipeline.py
+# Times every stage of the serving pipeline separately on synthetic feeds, at one or more
+# fleet sizes, and records best-of-N wall time and peak Python allocation (tracemalloc) per
+# stage. Results can be written as JSON and compared against a run from another commit.
+# tracemalloc only sees allocations made through Python's allocator, so memory held inside
+# protobuf's C extension (the parse stage) shows up as near zero.
+#
+# Stages, each fed the previous stage's output:
+#   parse          protobuf bytes -> FeedMessage (both feeds)
+#   decode         FeedMessage -> column tables (both feeds)
+#   join           vehicle -> trip -> next stop_time_update (includes the stop lookup)
+#   stop_lookup    next stop_id -> stops.txt row (the lookup inside join, on its own)
+#   features       distance, speed, time to arrival and status as a DataFrame
+#   scale_predict  feature matrix + compiled tree (scaler folded in)
+#   serialize      /get_predictions body and the raw VehiclePositions JSON body
+#
+# In-process metrics (metrics.py) are switched off unless --metrics is given.
+#
+# Usage: python benchmarks/bench_pipeline.py --vehicles 100 1000 10000 50000 --json results.json
+#        python benchmarks/bench_pipeline.py --compare results.json
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from synthetic_feed import make_feeds  # also puts app/ on sys.path
+from bench_decoder import measure
+from gtfs_columnar import parse_feed, decode_vehicle_positions, decode_trip_updates
+from features import join_next_stops, compute_features, feature_frame, feature_matrix
+from stops_index import stops_index
+from protobuf_to_json import protobuf_bytes_to_json
+from raw_feeds import dumps
+import decision_tree_predict
+import metrics
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_scale(vehicles, stops_per_trip, repeat, sklearn=False):
+    """Measure every stage for one fleet size; each stage maps to {'seconds', 'peak_bytes'}."""
+    vp_pb, tu_pb = make_feeds(vehicles, stops_per_trip)
+
+    # Each stage's input is the previous stage's output, computed once up front
+    vp_feed, tu_feed = parse_feed(vp_pb), parse_feed(tu_pb)
+    vehicles_table, trips = decode_vehicle_positions(vp_feed), decode_trip_updates(tu_feed)
+    columns = join_next_stops(vehicles_table, trips)
+    current_time = float(vehicles_table['header_timestamp'])
+    df = compute_features(columns, current_time)
+    predictions = decision_tree_predict.fast_model.predict(feature_matrix(df))
+    bus_predictions = dict(zip(df['bus_id'], predictions))
+
+    stages = {
+        'parse': measure(lambda: (parse_feed(vp_pb), parse_feed(tu_pb)), (), repeat),
+        'decode': measure(lambda: (decode_vehicle_positions(vp_feed), decode_trip_updates(tu_feed)), (), repeat),
+        'join': measure(join_next_stops, (vehicles_table, trips), repeat),
+        'stop_lookup': measure(stops_index.positions_of, (columns['next_stop_id'],), repeat),
+        'features': measure(compute_features, (columns, current_time), repeat),
+        'scale_predict': measure(lambda: decision_tree_predict.fast_model.predict(feature_matrix(df)), (), repeat),
+        'serialize': measure(lambda: (dumps({"bus_predictions": bus_predictions}),
+                                      dumps(protobuf_bytes_to_json(vp_pb))), (), repeat),
+    }
+    if sklearn:
+        scaler, dt_model = decision_tree_predict.scaler, decision_tree_predict.dt_model
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            stages['scale_predict_sklearn'] = measure(
+                lambda: dt_model.predict(scaler.transform(feature_frame(df))), (), repeat)
+    return {
+        'vehicles': vehicles,
+        'rows': len(df),
+        'payload_bytes': len(vp_pb) + len(tu_pb),
+        'stages': stages,
+        'total_seconds': sum(stage['seconds'] for name, stage in stages.items()
+                             if name not in ('stop_lookup', 'scale_predict_sklearn')),
+    }
+
+def print_results(results, baseline=None):
+    """Print a table per fleet size, with the ratio to the baseline run when one is given."""
+    previous = {run['vehicles']: run for run in baseline['runs']} if baseline else {}
+    for run in results['runs']:
+        print(f"{run['vehicles']} vehicles ({run['rows']} rows, {run['payload_bytes'] / 1024:.0f} KiB of protobuf)")
+        before = previous.get(run['vehicles'], {}).get('stages', {})
+        for name, stage in run['stages'].items():
+            line = f"  {name:<22} {stage['seconds'] * 1000:10.2f} ms   peak {stage['peak_bytes'] / 2**20:8.2f} MiB"
+            if name in before and before[name]['seconds'] > 0:
+                line += f"   x{stage['seconds'] / before[name]['seconds']:.2f} vs {baseline.get('commit')}"
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage timing and peak memory of the prediction pipeline.")
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--stops-per-trip', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sklearn', action='store_true', help="Also time the pickled sklearn scaler + model")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Results JSON from another run to compare against")
+    parser.add_argument('--metrics', action='store_true', help="Keep in-process metrics on, to measure their cost")
+    args = parser.parse_args()
+    if not args.metrics:
+        metrics.disable()
+
+    results = {
+        'commit': git_commit(),
+        'created_at': int(time.time()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'stops_per_trip': args.stops_per_trip,
+        'repeat': args.repeat,
+        'metrics': metrics.ENABLED,
+        'runs': [bench_scale(n, args.stops_per_trip, args.repeat, args.sklearn) for n in args.vehicles],
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# bench_startup.py
+# Cold-start cost of the API: imports `main` in fresh interpreters with `-X importtime` and
+# records the total import wall time and the self and cumulative import time of every module.
+# Runs are made with a warm artifact cache (the normal case after a deploy) and, with --cold,
+# with an empty one, which rebuilds the stops and model artifacts from their sources.
+#
+# Usage: python benchmarks/bench_startup.py --repeat 5 --json startup.json
+#        python benchmarks/bench_startup.py --cold --compare startup.json
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench_pipeline import git_commit
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# Dependencies worth watching: whether startup pays for them at all
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'scipy', 'httpx', 'google.transit.gtfs_realtime_pb2',
+                 'fastapi', 'uvicorn', 'pyarrow', 'pytz']
+
+# Heavy dependencies importing main is expected to load. Every poll builds its features, snapshot
+# index and dataset rows as pandas DataFrames, and the first poll starts with the app, so deferring
+# pandas would only move its cost to just after startup. pandas itself imports pyarrow and pytz.
+EAGER_MODULES = ['pandas', 'numpy', 'fastapi', 'uvicorn', 'pyarrow', 'pytz']
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+PROBE = ("import time; started = time.perf_counter(); import main; "
+         "print(time.perf_counter() - started)")
+
+def import_once(cache_dir=None):
+    """Import main in a fresh interpreter; returns (wall seconds, {module: (self_us, cumulative_us, depth)})."""
+    env = dict(os.environ)
+    if cache_dir is not None:
+        env['ARTIFACT_CACHE_DIR'] = str(cache_dir)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=APP_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+    return float(result.stdout.strip().splitlines()[-1]), modules
+
+def bench(repeat, cold):
+    """Median wall time and per-module import times over `repeat` fresh imports."""
+    walls, runs = [], []
+    for _ in range(repeat):
+        if cold:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                wall, modules = import_once(cache_dir)
+        else:
+            wall, modules = import_once()
+        walls.append(wall)
+        runs.append(modules)
+
+    names = set().union(*runs)
+    modules = {}
+    for name in names:
+        samples = [run[name] for run in runs if name in run]
+        modules[name] = {
+            'self_ms': float(np.median([s[0] for s in samples])) / 1000,
+            'cumulative_ms': float(np.median([s[1] for s in samples])) / 1000,
+            'depth': samples[0][2],
+        }
+    return {
+        'wall_seconds': float(np.median(walls)),
+        'wall_seconds_all': walls,
+        # A package counts as loaded when any of its submodules is (pandas imports pytz's directly)
+        'loaded': {name: any(m == name or m.startswith(name + '.') for m in names) for name in HEAVY_MODULES},
+        'modules': modules,
+    }
+
+def print_results(name, run, baseline=None, top=15):
+    line = f"{name}: import main {run['wall_seconds'] * 1000:.0f} ms (median)"
+    if baseline and baseline.get('wall_seconds'):
+        line += f"   x{run['wall_seconds'] / baseline['wall_seconds']:.2f} vs baseline"
+    print(line)
+    print("  loaded: " + ", ".join(f"{m} {'yes' if loaded else 'no'}" for m, loaded in run['loaded'].items()))
+    unexpected = [m for m, loaded in run['loaded'].items() if loaded and m not in EAGER_MODULES]
+    if unexpected:
+        print(f"  unexpected at startup: {', '.join(unexpected)}")
+    # Top-level imports are where the time is attributed to something we control
+    top_level = sorted(((m, s) for m, s in run['modules'].items() if s['depth'] <= 1),
+                       key=lambda item: item[1]['cumulative_ms'], reverse=True)[:top]
+    before = baseline['modules'] if baseline else {}
+    for module, stats in top_level:
+        line = f"  {module:<36} {stats['cumulative_ms']:9.1f} ms cumulative {stats['self_ms']:8.1f} ms self"
+        if module in before:
+            line += f"   (was {before[module]['cumulative_ms']:.1f} ms)"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the API, per module.")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument('--cold', action='store_true', help="Also measure with an empty artifact cache")
+    parser.add_argument('--top', type=int, default=15, help="Modules to list")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Results JSON from another run to compare against")
+    args = parser.parse_args()
+
+    import_once()  # Make sure the artifact cache and bytecode are warm
+    results = {
+        'commit': git_commit(),
+        'created_at': int(time.time()),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'runs': {'warm_cache': bench(args.repeat, cold=False)},
+    }
+    if args.cold:
+        results['runs']['cold_cache'] = bench(args.repeat, cold=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    for name, run in results['runs'].items():
+        print_results(name, run, baseline['runs'].get(name) if baseline else None, args.top)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
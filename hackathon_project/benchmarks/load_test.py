@@ -0,0 +1,105 @@
+# load_test.py
+# Load driver for the prediction API. Runs a fixed number of concurrent clients against the
+# chosen endpoints for a set duration and reports throughput, error counts and p50/p95/p99
+# latency per endpoint. Pair it with mock_feed_server.py so no load reaches the real agency.
+# Start the server with METRICS_ENABLED=0 to measure it without its instrumentation.
+#
+# Usage: python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 64 --duration 30
+#        python benchmarks/load_test.py --endpoints /get_predictions /fetch_trip_updates?format=pb --json load.json
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import numpy as np
+
+DEFAULT_ENDPOINTS = ['/get_predictions', '/fetch_vehicle_positions', '/fetch_trip_updates']
+
+async def client_loop(client, endpoints, deadline, samples, offset):
+    """One simulated client: request the endpoints in turn until the deadline."""
+    i = offset
+    while time.perf_counter() < deadline:
+        endpoint = endpoints[i % len(endpoints)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = await client.get(endpoint)
+            # Read the whole body, as a real client would
+            ok = response.status_code < 400
+            size = len(response.content)
+        except httpx.HTTPError:
+            ok, size = False, 0
+        samples[endpoint].append((time.perf_counter() - start, ok, size))
+
+def summarize(samples, elapsed):
+    """Per-endpoint request counts, throughput and latency percentiles (milliseconds)."""
+    summary = {}
+    for endpoint, results in samples.items():
+        if not results:
+            continue
+        latency = np.array([r[0] for r in results]) * 1000
+        errors = sum(1 for r in results if not r[1])
+        summary[endpoint] = {
+            'requests': len(results),
+            'errors': errors,
+            'requests_per_second': len(results) / elapsed,
+            'mean_bytes': float(np.mean([r[2] for r in results])),
+            'p50_ms': float(np.percentile(latency, 50)),
+            'p95_ms': float(np.percentile(latency, 95)),
+            'p99_ms': float(np.percentile(latency, 99)),
+            'max_ms': float(latency.max()),
+        }
+    return summary
+
+async def run(args):
+    samples = {endpoint: [] for endpoint in args.endpoints}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits, headers=headers) as client:
+        if args.warmup:
+            await client_loop(client, args.endpoints, time.perf_counter() + args.warmup,
+                              {endpoint: [] for endpoint in args.endpoints}, 0)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(client_loop(client, args.endpoints, deadline, samples, i)
+                               for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        # The server's own view: event loop lag and CPU pool queue over the run
+        try:
+            server = (await client.get('/test')).json()
+        except (httpx.HTTPError, ValueError):
+            server = {}
+    return summarize(samples, elapsed), elapsed, server
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test of the prediction API.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the API")
+    parser.add_argument('--endpoints', nargs='+', default=DEFAULT_ENDPOINTS)
+    parser.add_argument('--concurrency', type=int, default=32, help="Number of concurrent clients")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run for")
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds of single-client warm-up first")
+    parser.add_argument('--timeout', type=float, default=30, help="Per-request timeout in seconds")
+    parser.add_argument('--accept-encoding', default='gzip', help="Accept-Encoding to send ('' for none)")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    summary, elapsed, server = asyncio.run(run(args))
+    total = sum(s['requests'] for s in summary.values())
+    print(f"{total} requests in {elapsed:.1f}s from {args.concurrency} clients ({total / elapsed:.1f} req/s)")
+    for endpoint, s in summary.items():
+        print(f"  {endpoint:<32} {s['requests_per_second']:8.1f} req/s  errors {s['errors']:<5} "
+              f"p50 {s['p50_ms']:7.1f} ms  p95 {s['p95_ms']:7.1f} ms  p99 {s['p99_ms']:7.1f} ms")
+    if 'event_loop_lag' in server:
+        lag = server['event_loop_lag']
+        print(f"  server event loop lag: last {lag['last_seconds'] * 1000:.1f} ms, max {lag['max_seconds'] * 1000:.1f} ms; "
+              f"CPU pool {server['cpu_pool']['kind']}, {server['cpu_pool']['rejected']} tasks rejected")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': args.url, 'concurrency': args.concurrency, 'duration': elapsed,
+                       'endpoints': summary, 'server': server}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
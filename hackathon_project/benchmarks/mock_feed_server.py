@@ -0,0 +1,132 @@
+# mock_feed_server.py
+# Local stand-in for the agency's GTFS-RT endpoints, for load tests that must not touch the
+# real feeds. Serves /VehiclePositions and /TripUpdates from synthetic feeds (regenerated on
+# an interval, like a live feed) or from a feed archive replay, with optional latency and
+# failure injection. Answers If-None-Match / If-Modified-Since with a 304 like upstream.
+#
+# Usage: python benchmarks/mock_feed_server.py --vehicles 2000 --port 9000 --latency-ms 80 --error-rate 0.02
+#        GTFS_RT_BASE_URL=http://127.0.0.1:9000 uvicorn main:app   (from app/)
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from synthetic_feed import make_feeds  # also puts app/ on sys.path
+from feed_archive import ReplaySource
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class FeedState:
+    """The payload pair currently being served, with its validators."""
+
+    def __init__(self):
+        self.payloads = {}
+        self.etags = {}
+        self.last_modified = None
+
+    def publish(self, vehicle_positions_pb, trip_updates_pb):
+        if self.payloads.get('VehiclePositions') == vehicle_positions_pb and \
+                self.payloads.get('TripUpdates') == trip_updates_pb:
+            return
+        self.payloads = {'VehiclePositions': vehicle_positions_pb, 'TripUpdates': trip_updates_pb}
+        self.etags = {name: f'"{hashlib.blake2b(pb, digest_size=8).hexdigest()}"' for name, pb in self.payloads.items()}
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+def create_app(args):
+    state = FeedState()
+    rng = random.Random(args.seed)
+    stats = {'requests': 0, 'not_modified': 0, 'errors': 0, 'timeouts': 0, 'corrupt': 0}
+
+    async def refresh():
+        replay = ReplaySource(args.replay, speed=args.speed) if args.replay else None
+        seed = args.seed
+        while True:
+            if replay is not None:
+                vehicle_positions_pb, trip_updates_pb = await replay.fetch_payloads()
+                if vehicle_positions_pb is not None:
+                    state.publish(vehicle_positions_pb, trip_updates_pb)
+            else:
+                state.publish(*await asyncio.to_thread(make_feeds, args.vehicles, args.stops_per_trip, seed))
+                seed += 1
+            await asyncio.sleep(args.update_interval)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        task = asyncio.create_task(refresh())
+        yield
+        task.cancel()
+        logger.info(f"Mock feed server stats: {stats}")
+
+    app = FastAPI(title="Mock GTFS-RT feed server", lifespan=lifespan)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.get("/{feed}")
+    async def serve_feed(feed: str, request: Request):
+        if feed not in ('VehiclePositions', 'TripUpdates'):
+            return Response(status_code=404)
+        stats['requests'] += 1
+        if args.latency_ms or args.jitter_ms:
+            await asyncio.sleep(max(0.0, rng.gauss(args.latency_ms, args.jitter_ms)) / 1000)
+
+        # Failure injection, in the ways a real upstream misbehaves
+        roll = rng.random()
+        if roll < args.error_rate:
+            stats['errors'] += 1
+            return Response(status_code=503)
+        roll -= args.error_rate
+        if roll < args.timeout_rate:
+            stats['timeouts'] += 1
+            await asyncio.sleep(args.timeout_seconds)
+            return Response(status_code=504)
+        roll -= args.timeout_rate
+        if roll < args.corrupt_rate:
+            stats['corrupt'] += 1
+            return Response(content=rng.randbytes(256), media_type="application/x-protobuf")
+
+        payload = state.payloads.get(feed)
+        if payload is None:
+            return Response(status_code=503)
+        headers = {'ETag': state.etags[feed], 'Last-Modified': state.last_modified}
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match == state.etags[feed] or (
+                if_none_match is None and request.headers.get('if-modified-since') == state.last_modified):
+            stats['not_modified'] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=payload, media_type="application/x-protobuf", headers=headers)
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic or replayed GTFS-RT feeds for load tests.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--stops-per-trip', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--update-interval', type=float, default=15, help="Seconds between feed updates")
+    parser.add_argument('--replay', help="Serve a feed archive directory instead of synthetic feeds")
+    parser.add_argument('--speed', type=float, default=1, help="Replay speed as a multiple of real time")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Mean added response latency")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Standard deviation of the added latency")
+    parser.add_argument('--error-rate', type=float, default=0, help="Share of requests answered with a 503")
+    parser.add_argument('--timeout-rate', type=float, default=0, help="Share of requests that hang")
+    parser.add_argument('--timeout-seconds', type=float, default=30, help="How long a hanging request hangs")
+    parser.add_argument('--corrupt-rate', type=float, default=0, help="Share of requests answered with garbage bytes")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
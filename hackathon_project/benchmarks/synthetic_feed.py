@@ -0,0 +1,91 @@
+# synthetic_feed.py
+# Builds valid GTFS-Realtime VehiclePositions/TripUpdates payloads at a chosen scale for
+# benchmarks. Stop ids come from the app's data/stops.txt so the stops join finds them.
+#
+# Usage: python benchmarks/synthetic_feed.py --vehicles 5000 --stops-per-trip 10 --output feeds/
+# writes VehiclePositions.pb and TripUpdates.pb for serving or inspecting outside a benchmark.
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+sys.path.insert(0, str(APP_DIR))
+
+from google.transit import gtfs_realtime_pb2
+from stops_index import stops_index
+
+def numeric_stop_ids():
+    """Stop ids the current model can consume (it treats next_stop_id as a number)."""
+    return [stop_id for stop_id in stops_index.stop_id if stop_id.isdigit()]
+
+def make_feeds(vehicles=1000, stops_per_trip=5, seed=0, now=None):
+    """
+    Build a matching pair of serialized feeds.
+
+    Parameters:
+    - vehicles (int): Number of vehicle entities (each on its own trip)
+    - stops_per_trip (int): stop_time_updates per trip update
+    - seed (int): Random seed, so the same arguments give the same bytes
+    - now (int): Feed header timestamp (default: current time)
+
+    Returns:
+    - tuple: (vehicle_positions_pb, trip_updates_pb) as bytes
+    """
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    stop_ids = numeric_stop_ids()
+
+    vehicle_positions = gtfs_realtime_pb2.FeedMessage()
+    vehicle_positions.header.gtfs_realtime_version = "2.0"
+    vehicle_positions.header.timestamp = now
+    trip_updates = gtfs_realtime_pb2.FeedMessage()
+    trip_updates.header.gtfs_realtime_version = "2.0"
+    trip_updates.header.timestamp = now
+
+    for i in range(vehicles):
+        trip_id = f"trip-{i}"
+        route_id = str(900 + i % 60)
+
+        entity = vehicle_positions.entity.add()
+        entity.id = str(8000 + i)
+        entity.vehicle.trip.trip_id = trip_id
+        entity.vehicle.trip.route_id = route_id
+        entity.vehicle.position.latitude = 43.9 + rng.uniform(-0.15, 0.15)
+        entity.vehicle.position.longitude = -78.9 + rng.uniform(-0.25, 0.25)
+        entity.vehicle.timestamp = now - rng.randint(0, 90)
+
+        entity = trip_updates.entity.add()
+        entity.id = trip_id
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route_id
+        arrival = now + rng.randint(-240, 480)
+        for sequence in range(1, stops_per_trip + 1):
+            stu = entity.trip_update.stop_time_update.add()
+            stu.stop_sequence = sequence
+            stu.stop_id = rng.choice(stop_ids)
+            stu.arrival.time = arrival
+            stu.departure.time = arrival + 20
+            arrival += rng.randint(60, 180)
+
+    return vehicle_positions.SerializeToString(), trip_updates.SerializeToString()
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic pair of GTFS-RT feeds to disk.")
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--stops-per-trip', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='.', help="Directory for VehiclePositions.pb and TripUpdates.pb")
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    vehicle_positions_pb, trip_updates_pb = make_feeds(args.vehicles, args.stops_per_trip, args.seed)
+    (output / "VehiclePositions.pb").write_bytes(vehicle_positions_pb)
+    (output / "TripUpdates.pb").write_bytes(trip_updates_pb)
+    print(f"Wrote {args.vehicles} vehicles ({len(vehicle_positions_pb) + len(trip_updates_pb)} bytes) to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# conftest.py
+# The app and benchmark modules import each other by bare name (they run from their own
+# directories), so put both directories on sys.path for the tests.
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for directory in ("app", "benchmarks"):
+    sys.path.insert(0, str(ROOT / directory))
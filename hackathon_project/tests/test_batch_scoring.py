@@ -0,0 +1,70 @@
+# test_batch_scoring.py
+# A batch file must score the same whatever format it arrives in: NDJSON in predicts exactly what
+# Parquet in predicts, and NDJSON out reads back to the values that went in, time columns included.
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_scoring
+import decision_tree_predict
+from synthetic_feed import make_feeds
+
+NOW = 1_792_206_551
+
+@pytest.fixture(scope="module")
+def rows():
+    """Dataset rows scored from a synthetic feed, some with a next_stop_id that does not parse."""
+    df = decision_tree_predict.process_payloads(*make_feeds(500, stops_per_trip=5, seed=3, now=NOW))
+    df.loc[::7, 'next_stop_id'] = 'not-a-stop'
+    return df
+
+@pytest.fixture(scope="module")
+def model():
+    return batch_scoring.load_model(batch_scoring.BASE_DIR / 'model_weights').model
+
+@pytest.fixture
+def batch_files(tmp_path, rows):
+    parquet = tmp_path / 'rows.parquet'
+    ndjson = tmp_path / 'rows.ndjson'
+    rows.to_parquet(parquet, index=False)
+    ndjson.write_bytes(batch_scoring.ndjson_lines(rows.copy()))
+    return parquet, ndjson
+
+def read_output(path, fmt):
+    return pd.concat(batch_scoring.read_chunks(path, fmt), ignore_index=True)
+
+def test_ndjson_in_predicts_like_parquet_in(tmp_path, batch_files, model):
+    parquet, ndjson = batch_files
+    for source, fmt in [(parquet, 'parquet'), (ndjson, 'ndjson')]:
+        batch_scoring.score_file(source, tmp_path / f'scored_{fmt}.parquet', model, output_format='parquet',
+                                 chunk_rows=128)
+    from_parquet = pd.read_parquet(tmp_path / 'scored_parquet.parquet')['predicted_status']
+    from_ndjson = pd.read_parquet(tmp_path / 'scored_ndjson.parquet')['predicted_status']
+    assert len(from_parquet) == 500
+    assert (from_ndjson.to_numpy() == from_parquet.to_numpy()).all()
+
+def test_ndjson_out_reads_back_exactly(tmp_path, batch_files, rows, model):
+    parquet, _ = batch_files
+    scored = tmp_path / 'scored.ndjson'
+    batch_scoring.score_file(parquet, scored, model, output_format='ndjson')
+    out = read_output(scored, 'ndjson')
+    # Unix-second columns must stay numbers, not be parsed into dates
+    assert out['current_time'].dtype.kind in 'fi'
+    assert out['current_time'].iloc[0] == rows['current_time'].iloc[0]
+    for name in rows.columns:
+        expected = rows[name].to_numpy()
+        actual = out[name].to_numpy()
+        if expected.dtype.kind in 'fi':
+            np.testing.assert_array_equal(actual.astype(float), expected.astype(float), err_msg=name)
+        else:
+            assert (pd.Series(actual).astype(str) == pd.Series(expected).astype(str)).all(), name
+
+def test_datetime_columns_become_unix_seconds():
+    df = pd.DataFrame({'when': pd.to_datetime([NOW, NOW + 1.5], unit='s', utc=True), 'value': [1e-12, 0.1]})
+    lines = batch_scoring.ndjson_lines(df).decode('utf-8').splitlines()
+    back = pd.read_json(io.StringIO('\n'.join(lines)), lines=True, convert_dates=False, keep_default_dates=False)
+    assert back['when'].tolist() == [NOW, NOW + 1.5]
+    assert back['value'].tolist() == [1e-12, 0.1]
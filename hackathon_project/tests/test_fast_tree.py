@@ -0,0 +1,114 @@
+# test_fast_tree.py
+# The compiled tree (fast_tree.py) must predict exactly what the pickled sklearn pipeline,
+# scaler.transform then dt_model.predict, predicts: on realistic synthetic feeds, on rows whose
+# next_stop_id does not parse, and on values right at every split threshold, where folding the
+# scaler into float32-rounded thresholds is easiest to get wrong.
+
+import warnings
+
+import numpy as np
+import pytest
+
+import decision_tree_predict
+from fast_tree import CompiledTree
+from features import FEATURE_COLUMNS, compute_features, feature_matrix, join_next_stops
+from gtfs_columnar import decode_trip_updates, decode_vehicle_positions, parse_feed
+from synthetic_feed import make_feeds
+
+NEXT_STOP_ID = FEATURE_COLUMNS.index('next_stop_id')
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return decision_tree_predict.scaler, decision_tree_predict.dt_model
+
+@pytest.fixture(scope="module")
+def deep_pipeline():
+    """A much deeper tree than the shipped one, fitted with missing stop ids, for many more thresholds."""
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.tree import DecisionTreeClassifier
+    X = synthetic_matrix(5000, 6)
+    X[::4, NEXT_STOP_ID] = np.nan
+    labels = np.random.default_rng(0).choice(['early', 'on-time', 'late'], size=len(X))
+    scaler = StandardScaler().fit(X)
+    return scaler, DecisionTreeClassifier(max_depth=12, random_state=0).fit(scaler.transform(X), labels)
+
+@pytest.fixture(scope="module")
+def compiled(pipeline):
+    return CompiledTree.from_sklearn(pipeline[1], pipeline[0])
+
+def synthetic_matrix(vehicles, seed):
+    vp_pb, tu_pb = make_feeds(vehicles, stops_per_trip=5, seed=seed, now=1_792_206_551)
+    vehicles_table = decode_vehicle_positions(parse_feed(vp_pb))
+    columns = join_next_stops(vehicles_table, decode_trip_updates(parse_feed(tu_pb)))
+    return feature_matrix(compute_features(columns, float(vehicles_table['header_timestamp'])))
+
+def sklearn_predict(pipeline, X):
+    scaler, dt_model = pipeline
+    with warnings.catch_warnings():
+        # The scaler was fitted on a DataFrame; plain arrays are fine here
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        return dt_model.predict(scaler.transform(X))
+
+def assert_same_predictions(compiled, pipeline, X):
+    expected = sklearn_predict(pipeline, X)
+    actual = compiled.predict(X)
+    mismatched = np.flatnonzero(actual != expected)
+    assert len(mismatched) == 0, f"{len(mismatched)} of {len(X)} rows differ, e.g. row {X[mismatched[0]].tolist()}"
+
+@pytest.mark.parametrize("vehicles, seed", [(50, 0), (2000, 1), (20000, 2)])
+def test_synthetic_feeds(compiled, pipeline, vehicles, seed):
+    assert_same_predictions(compiled, pipeline, synthetic_matrix(vehicles, seed))
+
+def test_unparseable_next_stop_id(compiled, pipeline):
+    X = synthetic_matrix(2000, 3)
+    X[::3, NEXT_STOP_ID] = np.nan
+    assert_same_predictions(compiled, pipeline, X)
+
+def test_serving_model_matches_pickles(compiled, pipeline):
+    # The model the server loads comes from the artifact cache, not from the pickles directly
+    X = synthetic_matrix(2000, 4)
+    X[::5, NEXT_STOP_ID] = np.nan
+    np.testing.assert_array_equal(decision_tree_predict.fast_model.predict(X), compiled.predict(X))
+
+def boundary_rows(compiled, pipeline, base):
+    """
+    For every split, copies of a base row with the split's feature set to values straddling the
+    threshold: the folded raw bound and its float64 neighbours, and the raw values of the
+    float32 threshold and its float32 neighbours in scaled units.
+    """
+    scaler, dt_model = pipeline
+    tree = dt_model.tree_
+    splits = np.flatnonzero(tree.children_left >= 0)
+    # Prefer a base row that actually reaches the split, so the candidates decide it
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        reaches = dt_model.decision_path(scaler.transform(base)).tocsc()
+
+    rows = []
+    for node in splits:
+        feature = tree.feature[node]
+        visitors = reaches[:, node].indices
+        row = base[visitors[0] if len(visitors) else node % len(base)]
+
+        bound = compiled.threshold[node]
+        raw = [bound, np.nextafter(bound, -np.inf), np.nextafter(bound, np.inf),
+               np.nextafter(np.nextafter(bound, -np.inf), -np.inf), np.nextafter(np.nextafter(bound, np.inf), np.inf)]
+        t32 = np.float32(tree.threshold[node])
+        for scaled in (t32, np.nextafter(t32, np.float32(-np.inf)), np.nextafter(t32, np.float32(np.inf))):
+            raw.append(float(scaled) * scaler.scale_[feature] + scaler.mean_[feature])
+        for value in raw:
+            candidate = row.copy()
+            candidate[feature] = value
+            rows.append(candidate)
+    return np.array(rows)
+
+def test_threshold_boundaries(compiled, pipeline):
+    X = boundary_rows(compiled, pipeline, synthetic_matrix(2000, 5))
+    assert_same_predictions(compiled, pipeline, X)
+
+def test_deep_tree(deep_pipeline):
+    compiled = CompiledTree.from_sklearn(deep_pipeline[1], deep_pipeline[0])
+    X = synthetic_matrix(2000, 7)
+    X[::3, NEXT_STOP_ID] = np.nan
+    assert_same_predictions(compiled, deep_pipeline, X)
+    assert_same_predictions(compiled, deep_pipeline, boundary_rows(compiled, deep_pipeline, X))
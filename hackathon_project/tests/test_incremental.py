@@ -0,0 +1,79 @@
+# test_incremental.py
+# IncrementalScorer reuses a bus's previous prediction when none of the inputs its model splits
+# on changed. That only saves work with a model that doesn't split on inputs that move with the
+# feed clock (time to arrival, speed): such a model rescores every bus on every poll.
+
+import numpy as np
+import pytest
+
+from fast_tree import CompiledTree
+from features import feature_matrix
+from gtfs_columnar import decode_trip_updates, decode_vehicle_positions, parse_feed
+from incremental import IncrementalScorer
+from synthetic_feed import make_feeds
+
+NOW = 1_792_206_551
+
+# Inputs that only change when a bus moves or its next stop does
+POSITION_FEATURES = ['current_lat', 'current_lon', 'next_stop_lat', 'next_stop_lon', 'distance_to_stop_meters']
+
+def decode(now, vehicles=400, seed=5):
+    vp_pb, tu_pb = make_feeds(vehicles, stops_per_trip=3, seed=seed, now=now)
+    return decode_vehicle_positions(parse_feed(vp_pb)), decode_trip_updates(parse_feed(tu_pb))
+
+def later(trips, seconds):
+    """The NOW snapshot's reports and arrival times, in a feed published `seconds` later."""
+    vehicles, _ = decode(NOW)
+    return dict(vehicles, header_timestamp=vehicles['header_timestamp'] + seconds), trips
+
+def fit_model(features):
+    """A small tree on the given dataset columns, compiled the way bundles are served."""
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.tree import DecisionTreeClassifier
+    from features import build_dataset
+    df = build_dataset(*decode(NOW - 600, vehicles=2000, seed=9))
+    X = feature_matrix(df, features)
+    labels = np.random.default_rng(0).choice(['early', 'on-time', 'late'], size=len(X))
+    scaler = StandardScaler().fit(X)
+    tree = DecisionTreeClassifier(max_depth=8, random_state=0).fit(scaler.transform(X), labels)
+    model = CompiledTree.from_sklearn(tree, scaler)
+    model.features = features
+    return model
+
+@pytest.fixture(scope="module")
+def position_model():
+    return fit_model(POSITION_FEATURES)
+
+def test_unchanged_buses_reuse_predictions(position_model):
+    scorer = IncrementalScorer(position_model)
+    vehicles, trips = decode(NOW)
+    scorer.update(vehicles, trips)
+    # Same reports, 30 s later: every time to arrival moved, no bus did
+    df, predictions, delta, stats = scorer.update(*later(trips, 30))
+    assert stats['rows'] > 0
+    assert stats['reused_predictions'] == stats['rows']
+    assert stats['rescored'] == 0
+    assert delta == {'added': {}, 'changed': {}, 'removed': []}
+    expected = position_model.predict(feature_matrix(df, POSITION_FEATURES))
+    assert list(predictions.values()) == list(expected)
+
+def test_moved_buses_are_rescored(position_model):
+    scorer = IncrementalScorer(position_model)
+    vehicles, trips = decode(NOW)
+    scorer.update(vehicles, trips)
+    vehicles, trips = later(trips, 30)
+    moved = dict(vehicles, latitude=vehicles['latitude'].copy())
+    moved['latitude'][:10] += 0.02
+    df, predictions, delta, stats = scorer.update(moved, trips)
+    assert 0 < stats['rescored'] <= 10
+    assert stats['reused_predictions'] == stats['rows'] - stats['rescored']
+    assert set(delta['changed']) <= set(moved['entity_id'][:10])
+    expected = position_model.predict(feature_matrix(df, POSITION_FEATURES))
+    assert list(predictions.values()) == list(expected)
+
+def test_clock_dependent_model_rescores_every_bus():
+    scorer = IncrementalScorer(fit_model(POSITION_FEATURES + ['time_to_arrival_seconds']))
+    vehicles, trips = decode(NOW)
+    scorer.update(vehicles, trips)
+    _, _, _, stats = scorer.update(*later(trips, 30))
+    assert stats['rescored'] == stats['rows']
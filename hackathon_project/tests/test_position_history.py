@@ -0,0 +1,98 @@
+# test_position_history.py
+# PositionHistory's ring buffers and slot bookkeeping: each vehicle keeps only its latest `size`
+# reports, stale vehicles are evicted after `ttl`, and once max_vehicles slots are taken the least
+# recently seen vehicle gives up its slot, but never to a newcomer in the same snapshot.
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from position_history import HISTORY_COLUMNS, PositionHistory
+from stops_index import haversine_m
+
+# One stop, at the origin of the test trips
+STOPS = SimpleNamespace(lat=np.array([43.9]), lon=np.array([-78.9]))
+
+def report(history, bus_ids, now, timestamps=None, lat=None, lon=None, stop_sequence=None):
+    """Record one snapshot of reports; by default every bus reports `now` from the stop, at stop sequence 1."""
+    n = len(bus_ids)
+    full = lambda value, default: np.asarray(value if value is not None else [default] * n, dtype=np.float64)
+    return history.update(np.array(bus_ids, dtype=object), full(timestamps, now), full(lat, 43.9), full(lon, -78.9),
+                          np.zeros(n, dtype=np.int32),
+                          np.asarray(stop_sequence if stop_sequence is not None else [1] * n, dtype=np.int32),
+                          float(now))
+
+def test_ring_keeps_the_latest_reports():
+    history = PositionHistory(size=4)
+    for t in range(100, 700, 100):
+        report(history, ['A'], t)
+    slot = history.slots['A']
+    samples = history.samples(np.array([slot]))
+    assert history.count[slot] == 4
+    np.testing.assert_array_equal(samples['timestamp'][0], [600, 500, 400, 300])
+
+def test_repeated_and_older_reports_are_not_appended():
+    history = PositionHistory(size=4)
+    report(history, ['A'], 100)
+    report(history, ['A'], 130, timestamps=[100])
+    report(history, ['A'], 160, timestamps=[90])
+    # A bus_id twice in one snapshot keeps its last report
+    report(history, ['A', 'A'], 190, timestamps=[180, 185])
+    samples = history.samples(np.array([history.slots['A']]))
+    np.testing.assert_array_equal(samples['timestamp'][0], [185, 100, np.nan, np.nan])
+
+def test_stale_vehicles_are_evicted():
+    history = PositionHistory(size=4, ttl=300)
+    report(history, ['A', 'B'], 100)
+    report(history, ['B'], 350)
+    assert set(history.slots) == {'A', 'B'}
+    slot_a = history.slots['A']
+    report(history, ['B', 'C'], 401)
+    assert set(history.slots) == {'B', 'C'}
+    # C reuses A's slot, with none of A's samples
+    assert history.slots['C'] == slot_a
+    assert history.count[slot_a] == 1
+
+def test_least_recently_seen_vehicle_gives_up_its_slot():
+    history = PositionHistory(size=4, max_vehicles=3, initial_slots=1)
+    report(history, ['A'], 10)
+    report(history, ['B'], 20)
+    report(history, ['C'], 30)
+    assert history.capacity == 3
+    slot_a = history.slots['A']
+    slots = report(history, ['B', 'C', 'D'], 40)
+    assert len(history) == 3
+    assert 'A' not in history.slots
+    assert slots[2] == slot_a
+    assert history.count[slot_a] == 1
+
+def test_full_buffer_never_evicts_a_vehicle_seen_this_snapshot():
+    history = PositionHistory(size=4, max_vehicles=2, initial_slots=2)
+    slots = report(history, ['A', 'B', 'C'], 10)
+    np.testing.assert_array_equal(slots, [0, 1, -1])
+    features = history.features(slots, STOPS)
+    assert all(np.isnan(features[col][2]) for col in HISTORY_COLUMNS)
+    # The untracked vehicle gets a slot once another one has gone quiet
+    slots = report(history, ['A', 'C'], 20)
+    assert slots[1] == 1 and 'B' not in history.slots
+
+def test_features_match_hand_computed_values():
+    history = PositionHistory(size=4)
+    # A drives away from the stop at a steady pace, past two stops; B sits still
+    lats = [43.9, 43.901, 43.902]
+    for t, lat, sequence in zip([100, 130, 160], lats, [1, 2, 3]):
+        report(history, ['A', 'B'], t, lat=[lat, 43.95], stop_sequence=[sequence, 5])
+    slots = np.array([history.slots['A'], history.slots['B']])
+    features = history.features(slots, STOPS)
+    speed = haversine_m(43.901, -78.9, 43.902, -78.9) / 30
+    previous_speed = haversine_m(43.9, -78.9, 43.901, -78.9) / 30
+    assert features['observed_speed_m_s'][0] == pytest.approx(speed)
+    assert features['acceleration_m_s2'][0] == pytest.approx((speed - previous_speed) / 30)
+    assert features['stops_advanced'][0] == 2
+    # Distance to the stop grew, so the approach speed is negative
+    assert features['approach_speed_m_s'][0] == pytest.approx(-haversine_m(43.9, -78.9, 43.902, -78.9) / 60)
+    assert features['dwell_seconds'][0] == 0
+    assert features['observed_speed_m_s'][1] == 0
+    assert features['dwell_seconds'][1] == 60
+    assert features['stops_advanced'][1] == 0
@@ -0,0 +1,33 @@
+# test_raw_feeds.py
+# Content negotiation for the raw feed endpoints: the server's preferred encoding the client
+# accepts, where a coding refused by name (q=0) stays refused whatever a "*" entry says.
+
+import pytest
+
+import raw_feeds
+
+@pytest.fixture(autouse=True)
+def both_encodings(monkeypatch):
+    # Brotli is optional; pretend it is installed so br can be negotiated
+    monkeypatch.setattr(raw_feeds, "ENCODINGS", ("br", "gzip"))
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.5, gzip;q=1", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("BR ; q=0.0, GZIP", "gzip"),
+    ("*", "br"),
+    ("br;q=0, *", "gzip"),
+    ("*, br;q=0", "gzip"),
+    ("br;q=0, gzip;q=0, *", None),
+    ("gzip;q=0, *;q=0.1", "br"),
+    ("*;q=0", None),
+    ("*;q=0, gzip", "gzip"),
+    ("br;q=x, gzip", "gzip"),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert raw_feeds.choose_encoding(accept_encoding) == expected
@@ -0,0 +1,117 @@
+# test_shared_snapshot.py
+# Two pollers sharing one SharedSnapshot directory, as two server processes would: only the
+# flock holder polls and publishes, and the follower serves exactly what the leader scored,
+# from memory-mapped segments (protobuf payloads included, parsed straight from the mapping).
+
+import asyncio
+
+import numpy as np
+
+from cpu_pool import CpuPool
+from gtfs_columnar import decode_vehicle_positions, parse_feed
+from poller import PredictionPoller
+from shared_snapshot import KEEP_SEGMENTS, SharedSnapshot
+from snapshot_index import DEFAULT_ARRIVAL_FIELDS, DEFAULT_FIELDS
+from synthetic_feed import make_feeds
+
+NOW = 1_792_206_551
+
+class Feeds:
+    """A fetch callable serving whatever payloads the test sets."""
+
+    def __init__(self, seed=0):
+        self.payloads = make_feeds(300, stops_per_trip=4, seed=seed, now=NOW)
+
+    async def __call__(self):
+        return self.payloads
+
+def make_poller(directory, fetch):
+    return PredictionPoller(fetch=fetch, pool=CpuPool("inline"), shared=SharedSnapshot(directory, 0.01))
+
+def assert_same_frame(follower, leader):
+    """Same columns and values; the follower's numeric columns are memmaps, its strings fixed-width."""
+    assert list(follower.columns) == list(leader.columns)
+    for name in leader.columns:
+        expected, actual = np.asarray(leader[name]), np.asarray(follower[name])
+        if expected.dtype.kind not in 'biuf':
+            expected, actual = expected.astype(str), actual.astype(str)
+        np.testing.assert_array_equal(actual, expected, err_msg=name)
+
+def assert_same_snapshot(follower, leader):
+    assert follower.bus_predictions == leader.bus_predictions
+    assert_same_frame(follower.df, leader.df)
+    assert_same_frame(follower.upcoming, leader.upcoming)
+    assert bytes(follower.predictions_json) == leader.predictions_json
+    assert follower.delta == leader.delta
+    assert follower.feed_timestamp == leader.feed_timestamp
+    # Payloads come back as memoryviews of the mapped segment and parse as they are
+    assert isinstance(follower.vehicle_positions_pb, memoryview)
+    assert bytes(follower.trip_updates_pb) == leader.trip_updates_pb
+    np.testing.assert_array_equal(decode_vehicle_positions(parse_feed(follower.vehicle_positions_pb))['entity_id'],
+                                  decode_vehicle_positions(parse_feed(leader.vehicle_positions_pb))['entity_id'])
+    for route_id in leader.index.routes:
+        np.testing.assert_array_equal(follower.index.route_rows(route_id), leader.index.route_rows(route_id))
+    for stop_id in list(leader.index.stops)[:20]:
+        rows = leader.index.stop_rows(stop_id)
+        assert follower.index.page(follower.index.stop_rows(stop_id), DEFAULT_ARRIVAL_FIELDS, 0, 50, upcoming=True) \
+            == leader.index.page(rows, DEFAULT_ARRIVAL_FIELDS, 0, 50, upcoming=True)
+    bus_id = leader.df['bus_id'].iloc[0]
+    assert follower.index.records([follower.index.bus_row(bus_id)], DEFAULT_FIELDS) \
+        == leader.index.records([leader.index.bus_row(bus_id)], DEFAULT_FIELDS)
+
+def test_one_leader_at_a_time(tmp_path):
+    first, second = SharedSnapshot(tmp_path), SharedSnapshot(tmp_path)
+    assert first.lead()
+    assert not second.lead()
+    assert first.lead()
+    # What the OS does when the leading process exits
+    first._lock_file.close()
+    assert second.lead()
+    assert second.describe()['leader']
+
+def test_publish_follow_round_trip(tmp_path):
+    async def run():
+        fetch = Feeds()
+        leader, follower = make_poller(tmp_path, fetch), make_poller(tmp_path, fetch)
+        fetch_calls = []
+
+        async def must_not_fetch():
+            fetch_calls.append(1)
+            return fetch.payloads
+        follower.fetch = must_not_fetch
+
+        published = await leader.refresh()
+        followed = await follower.refresh()
+        assert leader.leading and not follower.leading
+        assert not fetch_calls
+        assert follower.shared.state()[0] == 1
+        assert_same_snapshot(followed, published)
+
+        # A new poll publishes the next version, which the follower maps in
+        fetch.payloads = make_feeds(250, stops_per_trip=4, seed=1, now=NOW + 30)
+        published = await leader.refresh()
+        followed = await follower.refresh()
+        assert follower.shared.state()[0] == 2
+        assert_same_snapshot(followed, published)
+
+        # Unchanged feeds only confirm the published version
+        published = await leader.refresh()
+        followed = await follower.refresh()
+        assert follower.shared.state()[0] == 2
+        assert followed.created_at == published.created_at
+        assert followed.delta == {'added': {}, 'changed': {}, 'removed': []}
+    asyncio.run(run())
+
+def test_old_segments_are_pruned(tmp_path):
+    async def run():
+        fetch = Feeds()
+        leader = make_poller(tmp_path, fetch)
+        for seed in range(KEEP_SEGMENTS + 2):
+            fetch.payloads = make_feeds(50, stops_per_trip=2, seed=seed, now=NOW + seed)
+            await leader.refresh()
+        return leader.shared.state()[0]
+    version = asyncio.run(run())
+    assert version == KEEP_SEGMENTS + 2
+    assert len(list(tmp_path.glob("v*"))) == KEEP_SEGMENTS
+    # The newest segments are the ones kept
+    assert (tmp_path / f"v{version:012d}").is_dir()
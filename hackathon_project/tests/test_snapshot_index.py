@@ -0,0 +1,89 @@
+# test_snapshot_index.py
+# Every SnapshotIndex lookup must return what a brute-force filter over the snapshot returns,
+# in the documented order: a route's buses by bus_id, a stop's arrivals soonest first (ties by
+# bus_id), a bus's stops in trip order. page() must split any result into consecutive pages.
+
+import numpy as np
+import pytest
+
+import decision_tree_predict
+from incremental import IncrementalScorer, score_payloads
+from snapshot_index import DEFAULT_ARRIVAL_FIELDS, FIELDS, SnapshotIndex
+from synthetic_feed import make_feeds
+
+NOW = 1_792_206_551
+
+@pytest.fixture(scope="module")
+def snapshot():
+    scorer = IncrementalScorer(decision_tree_predict.fast_model)
+    return score_payloads(scorer, *make_feeds(600, stops_per_trip=4, seed=7, now=NOW))
+
+def plain(records):
+    """Records with NaN as None, the way SnapshotIndex.records writes them."""
+    return [{name: None if value != value else value for name, value in record.items()} for record in records]
+
+def expected_records(frame, fields):
+    columns = [frame[name].to_numpy().tolist() for name in fields]
+    return plain(dict(zip(fields, row)) for row in zip(*columns))
+
+def test_route_lookups(snapshot):
+    index, df = snapshot['index'], snapshot['df'].assign(prediction=lambda d: d['bus_id'].map(snapshot['bus_predictions']))
+    assert len(index) == len(df)
+    for route_id, expected in df.sort_values('bus_id').groupby('route_id', sort=False):
+        assert index.records(index.route_rows(route_id), FIELDS) == expected_records(expected, FIELDS)
+    assert len(index.route_rows('no-such-route')) == 0
+
+def test_stop_lookups(snapshot):
+    index, upcoming = snapshot['index'], snapshot['upcoming']
+    assert upcoming['next_stop_id'].nunique() < len(upcoming)  # Some stops are shared
+    ordered = upcoming.sort_values(['expected_arrival_time', 'bus_id'], na_position='last', kind='stable')
+    for stop_id, expected in ordered.groupby('next_stop_id', sort=False):
+        actual = index.records(index.stop_rows(stop_id), DEFAULT_ARRIVAL_FIELDS, upcoming=True)
+        assert actual == expected_records(expected, DEFAULT_ARRIVAL_FIELDS)
+    assert len(index.stop_rows('no-such-stop')) == 0
+
+def test_bus_lookups(snapshot):
+    index, df, upcoming = snapshot['index'], snapshot['df'], snapshot['upcoming']
+    assert [index.bus_row(bus_id) for bus_id in df['bus_id']] == list(range(len(df)))
+    for bus_id, expected in upcoming.sort_values('stops_ahead', kind='stable').groupby('bus_id', sort=False):
+        actual = index.records(index.bus_stop_rows(bus_id), ['next_stop_id', 'stops_ahead'], upcoming=True)
+        assert actual == expected_records(expected, ['next_stop_id', 'stops_ahead'])
+    assert index.bus_row('no-such-bus') is None
+    assert len(index.bus_stop_rows('no-such-bus')) == 0
+
+def test_next_stops_only_without_upcoming_table(snapshot):
+    df = snapshot['df']
+    index = SnapshotIndex(df, snapshot['bus_predictions'])
+    ordered = df.sort_values(['expected_arrival_time', 'bus_id'], kind='stable')
+    for stop_id, expected in ordered.groupby('next_stop_id', sort=False):
+        assert index.records(index.stop_rows(stop_id), ['bus_id'], upcoming=True) == expected_records(expected, ['bus_id'])
+        assert all(record['stops_ahead'] == 0
+                   for record in index.records(index.stop_rows(stop_id), ['stops_ahead'], upcoming=True))
+
+@pytest.mark.parametrize("limit", [1, 7, 50, 1000])
+def test_pages_cover_the_result(snapshot, limit):
+    index = snapshot['index']
+    rows = index.stop_order  # Every upcoming row, by stop
+    pages, offset = [], 0
+    while offset is not None:
+        page = index.page(rows, DEFAULT_ARRIVAL_FIELDS, offset, limit, key="arrivals", upcoming=True)
+        assert page['total'] == len(rows)
+        assert page['offset'] == offset and page['limit'] == limit
+        assert len(page['arrivals']) == min(limit, len(rows) - offset)
+        pages.extend(page['arrivals'])
+        offset = page['next_offset']
+    assert pages == index.records(rows, DEFAULT_ARRIVAL_FIELDS, upcoming=True)
+
+def test_page_past_the_end(snapshot):
+    index = snapshot['index']
+    rows = index.route_rows(snapshot['df']['route_id'].iloc[0])
+    page = index.page(rows, ['bus_id'], len(rows) + 5, 10)
+    assert page['items'] == [] and page['next_offset'] is None and page['total'] == len(rows)
+
+def test_arrays_round_trip(snapshot):
+    index, df, upcoming = snapshot['index'], snapshot['df'], snapshot['upcoming']
+    rebuilt = SnapshotIndex.from_arrays(index.to_arrays(), df, upcoming)
+    for name in ('route_order', 'stop_order', 'bus_stop_order'):
+        np.testing.assert_array_equal(getattr(rebuilt, name), getattr(index, name))
+    assert rebuilt.routes == index.routes and rebuilt.stops == index.stops and rebuilt.bus_stops == index.bus_stops
+    assert rebuilt.records(np.arange(len(df)), FIELDS) == index.records(np.arange(len(df)), FIELDS)